@@ -0,0 +1,262 @@
+"""Benchmarks of the wijklabels pipeline on synthetic data
+
+Measures the duration of each processing stage per Pand, and the throughput of full
+runs at several scales, on synthetic input from :py:mod:`wijklabels.synthetic`. The
+full runs are done in-process from the generated data, or with `wijklabels-process`
+on a PostGIS database (`--database`), such as the one in `docker/docker-compose.yaml`.
+
+The results are written to `benchmarks/results/<version>_<timestamp>.json` and they are
+compared to the previous results with the latest `timestamp`, so that the regressions
+show up between releases. Commit the results of the releases, they are the baseline of the next.
+
+Usage:
+
+    python benchmarks/bench.py --sizes 10000 100000 1000000 --distributions energielabel_spreiding.xlsx
+
+Copyright 2023 3DGI
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from importlib.metadata import version, PackageNotFoundError
+from pathlib import Path
+from time import perf_counter
+
+import pandas as pd
+
+from wijklabels import LabelEstimationMethod
+from wijklabels.aggregate import label_shares
+from wijklabels.labels import parse_energylabel_ditributions, reshape_for_classification
+from wijklabels.load import ExcelLoader
+from wijklabels.process import process_pand, STAGES
+from wijklabels.synthetic import generate_input, load_input_postgres
+from wijklabels.timing import StageTimer, TimingOptions, read_records, summarize
+
+log = logging.getLogger("BENCHMARK")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+DIR_BENCHMARKS = Path(__file__).resolve().parent
+DIR_RESULTS = DIR_BENCHMARKS.joinpath("results")
+PATH_DISTRIBUTIONS_SUBSET = DIR_BENCHMARKS.parent.joinpath(
+    "tests", "data", "input", "energielabel_spreiding_subset.xlsx")
+COLUMNS_INDEX = ["pand_identificatie", "vbo_identificatie"]
+
+_distributions = None
+_seed = 1
+
+
+def init_worker(distributions: pd.DataFrame, seed: int):
+    global _distributions, _seed
+    _distributions = distributions
+    _seed = seed
+
+
+def process_panden(panden: list[pd.DataFrame]) -> list[pd.DataFrame]:
+    """Process the panden like the workers of wijklabels-process, without the
+    database."""
+    done = []
+    for pand_df in panden:
+        try:
+            process_pand(pand_df, _distributions, LabelEstimationMethod.DISTRIBUTION,
+                         _seed)
+            done.append(pand_df)
+        except Exception:
+            pass
+    return done
+
+
+def split_panden(df: pd.DataFrame) -> list[pd.DataFrame]:
+    """Split the input into the records per Pand, like the rows of `get_pand`."""
+    df = df.drop(columns=["geometrie"]).set_index(COLUMNS_INDEX)
+    return [g for _, g in df.groupby(level="pand_identificatie", sort=False)]
+
+
+def bench_stages(distributions: pd.DataFrame, nr_pand: int, seed: int) -> dict:
+    """The duration of the processing stages per Pand."""
+    panden = split_panden(generate_input(nr_pand, seed=seed))
+    with tempfile.TemporaryDirectory() as directory:
+        timer = StageTimer(TimingOptions(directory=Path(directory)))
+        for pand_df in panden:
+            timer.start(pand_df.index.get_level_values(0)[0])
+            try:
+                process_pand(pand_df, distributions, LabelEstimationMethod.DISTRIBUTION,
+                             seed, timer)
+                timer.finish(rows=len(pand_df))
+            except Exception:
+                timer.finish(rows=len(pand_df), failed=True)
+        timer.file.close()
+        summary = summarize(read_records(Path(directory)), STAGES)
+    return {f"stage_{stage}": {"seconds": stats["total"],
+                               "mean_ms": stats["mean"] * 1000,
+                               "p99_ms": stats["p99"] * 1000}
+            for stage, stats in summary["stages"].items()}
+
+
+def bench_run(distributions: pd.DataFrame, nr_pand: int, jobs: int, seed: int) -> dict:
+    """A full run from the generated data, without the database."""
+    results = {}
+    start = perf_counter()
+    df = generate_input(nr_pand, seed=seed)
+    results[f"generate_{nr_pand}"] = {"seconds": perf_counter() - start}
+
+    panden = split_panden(df)
+    chunks = [panden[i:i + 100] for i in range(0, len(panden), 100)]
+    start = perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(distributions, seed)) as executor:
+        done = list(itertools.chain.from_iterable(executor.map(process_panden, chunks)))
+    seconds = perf_counter() - start
+    results[f"run_{nr_pand}"] = {"seconds": seconds, "panden_per_second": nr_pand / seconds,
+                                 "panden_failed": nr_pand - len(done)}
+
+    labels = pd.concat(done)
+    start = perf_counter()
+    label_shares(labels, "energylabel")
+    results[f"aggregate_{nr_pand}"] = {"seconds": perf_counter() - start}
+    return results
+
+
+def bench_run_database(connection_str: str, path_distributions: Path, nr_pand: int,
+                       jobs: int, seed: int) -> dict:
+    """A full run of wijklabels-process on the generated data in the database."""
+    table = f"wijklabels.input_synthetic_{nr_pand}"
+    load_input_postgres(generate_input(nr_pand, seed=seed), connection_str, table)
+    conn = psycopg_conninfo(connection_str)
+    with tempfile.TemporaryDirectory() as directory:
+        start = perf_counter()
+        subprocess.run(["wijklabels-process", directory, str(path_distributions),
+                        conn["dbname"], conn["user"], conn["password"], table,
+                        "--host", conn["host"], "--port", conn["port"],
+                        "--jobs", str(jobs)], check=True)
+        seconds = perf_counter() - start
+    return {f"run_database_{nr_pand}": {"seconds": seconds,
+                                        "panden_per_second": nr_pand / seconds}}
+
+
+def psycopg_conninfo(connection_str: str) -> dict:
+    from psycopg.conninfo import conninfo_to_dict
+    conn = {"host": "localhost", "port": "5432", "password": ""}
+    conn.update({k: str(v) for k, v in conninfo_to_dict(connection_str).items()})
+    return conn
+
+
+def environment() -> dict:
+    try:
+        wijklabels_version = version("wijklabels")
+    except PackageNotFoundError:
+        wijklabels_version = "unknown"
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                cwd=DIR_BENCHMARKS, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"version": wijklabels_version, "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count()}
+
+
+def compare(results: dict, previous: dict, threshold: float) -> list[str]:
+    """The benchmarks that are slower than in the previous results by more than the
+    threshold, as a fraction."""
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        before = previous["benchmarks"].get(name)
+        if before is None or before["seconds"] <= 0:
+            continue
+        change = result["seconds"] / before["seconds"] - 1
+        if change > threshold:
+            regressions.append(f"{name}: {before['seconds']:.3f}s -> "
+                               f"{result['seconds']:.3f}s (+{change:.0%})")
+    return regressions
+
+
+def latest_results(dir_results: Path) -> Path | None:
+    """The results file in the directory with the latest `timestamp`, or None if
+    there are no results. The file names start with the version, so their order is
+    not the order of the runs."""
+    latest, latest_timestamp = None, None
+    for path in dir_results.glob("*.json"):
+        try:
+            timestamp = datetime.fromisoformat(json.loads(path.read_text())["timestamp"])
+        except (ValueError, KeyError, TypeError) as e:
+            log.warning(f"Skipping the results {path.name}, {e!r}")
+            continue
+        if latest_timestamp is None or timestamp > latest_timestamp:
+            latest, latest_timestamp = path, timestamp
+    return latest
+
+
+parser_bench = argparse.ArgumentParser(prog="bench")
+parser_bench.add_argument("--sizes", type=int, nargs="+", default=[10_000],
+                          help="The numbers of panden of the full runs")
+parser_bench.add_argument("--stages-sample", type=int, default=2000,
+                          help="The number of panden of the stage benchmarks")
+parser_bench.add_argument("--distributions", default=str(PATH_DISTRIBUTIONS_SUBSET),
+                          help="Path to the energy label distributions Excel file")
+parser_bench.add_argument("--database",
+                          help="Run wijklabels-process on the synthetic data in this PostgreSQL database, as a connection string")
+parser_bench.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+parser_bench.add_argument("--seed", type=int, default=1)
+parser_bench.add_argument("--output", default=str(DIR_RESULTS),
+                          help="Directory of the results")
+parser_bench.add_argument("--compare",
+                          help="Results file to compare to, by default the latest in the output directory")
+parser_bench.add_argument("--threshold", type=float, default=0.1,
+                          help="Report the benchmarks that are slower by more than this fraction")
+
+
+def main():
+    args = parser_bench.parse_args()
+    dir_output = Path(args.output).resolve()
+    dir_output.mkdir(parents=True, exist_ok=True)
+    path_distributions = Path(args.distributions).resolve()
+    distributions = reshape_for_classification(
+        parse_energylabel_ditributions(ExcelLoader(file=path_distributions)))
+
+    results = {**environment(), "distributions": path_distributions.name,
+               "benchmarks": {}}
+    log.info(f"Benchmarking the stages on {args.stages_sample} panden")
+    results["benchmarks"].update(bench_stages(distributions, args.stages_sample,
+                                              args.seed))
+    for size in args.sizes:
+        log.info(f"Benchmarking a run of {size} panden")
+        results["benchmarks"].update(bench_run(distributions, size, args.jobs, args.seed))
+        if args.database is not None:
+            results["benchmarks"].update(bench_run_database(
+                args.database, path_distributions, size, args.jobs, args.seed))
+    for name, result in results["benchmarks"].items():
+        log.info(f"{name}: {result['seconds']:.3f}s")
+
+    path_previous = Path(args.compare) if args.compare else latest_results(dir_output)
+    timestamp = datetime.fromisoformat(results["timestamp"])
+    path_results = dir_output.joinpath(
+        f"{results['version']}_{timestamp.strftime('%Y%m%dT%H%M%S')}.json")
+    path_results.write_text(json.dumps(results, indent=2))
+    log.info(f"Results written to {path_results}")
+
+    if path_previous is not None:
+        regressions = compare(results, json.loads(path_previous.read_text()),
+                              args.threshold)
+        for regression in regressions:
+            log.warning(f"Regression compared to {path_previous.name}, {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
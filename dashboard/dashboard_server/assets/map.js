@@ -0,0 +1,23 @@
+// Style functions of the buurten map, which are referenced from dashboard.py
+window.wijklabels = Object.assign({}, window.wijklabels, {
+    // Colour the buurt with the colour of the selected label, the opacity is the share
+    // of the label in the buurt
+    styleBuurt: function (feature, context) {
+        const hideout = context.hideout || {};
+        const percentage = feature.properties.p[hideout.label_index];
+        return {
+            color: "#555555",
+            weight: 0.5,
+            fillColor: hideout.color || "#dcf09e",
+            fillOpacity: percentage == null ? 0.0 : Math.min(percentage / 50.0, 1.0) * 0.9
+        };
+    },
+    tooltipBuurt: function (feature, layer, context) {
+        layer.bindTooltip(function () {
+            const hideout = context.hideout || {};
+            const percentage = feature.properties.p[hideout.label_index];
+            const share = percentage == null ? "-" : percentage.toFixed(1) + "%";
+            return `${feature.properties.g}, ${feature.properties.b}<br>${hideout.label}: ${share}`;
+        });
+    }
+});
@@ -0,0 +1,202 @@
+"""Precompute the payloads of the dashboard
+
+Reads the neighbourhood labels (labels_neighborhood_geom.fgb) once, and writes a small
+index of the municipalities and their buurten, and the label percentages of the
+buurten as an array that the dashboard server memory-maps. The dashboard server only
+reads these payloads, so that it starts quickly and does not need geopandas.
+
+Each run writes a new version to `<data>/versions/<version>/` and then points the
+`<data>/current` symlink to it. The running dashboard swaps in the new version without
+a restart, see data.py.
+
+For the map, the buurt polygons are simplified at several levels of detail. The
+simplification preserves the shared boundaries between the buurten, so that there are
+no gaps or overlaps between neighbours. Each level is split into tiles of the web map
+tiling scheme, and each buurt is stored in the tile of its representative point.
+The dashboard only loads the tiles in view, on the level of the zoom of the map.
+
+Usage: python build.py labels_neighborhood_geom.fgb dashboard_data
+
+Copyright 2023 3DGI
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+
+import geopandas
+import numpy as np
+import shapely
+
+from data import CURRENT, VERSIONS
+
+log = logging.getLogger("BUILD")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+# Levels of detail, from coarse to fine. A level is used up to `max_zoom` of the map.
+# The tolerance of the simplification is in meters, the precision is the number of
+# decimals of the WGS84 coordinates.
+LEVELS = [
+    {"max_zoom": 8, "tile_zoom": 5, "tolerance": 250.0, "precision": 4},
+    {"max_zoom": 10, "tile_zoom": 7, "tolerance": 60.0, "precision": 4},
+    {"max_zoom": 12, "tile_zoom": 9, "tolerance": 15.0, "precision": 5},
+    {"max_zoom": 24, "tile_zoom": 11, "tolerance": 2.0, "precision": 6},
+]
+CRS_METRIC = "EPSG:28992"
+FEATURE_COLLECTION_START = '{"type":"FeatureCollection","features":['
+FEATURE_COLLECTION_END = ']}'
+
+
+def tile_xy(lon: np.ndarray, lat: np.ndarray, zoom: int):
+    """The x, y indices of the web map tiles that contain the WGS84 coordinates."""
+    n = 2 ** zoom
+    x = np.floor((lon + 180.0) / 360.0 * n).astype(int)
+    lat_rad = np.radians(lat)
+    y = np.floor((1.0 - np.arcsinh(np.tan(lat_rad)) / math.pi) / 2.0 * n).astype(int)
+    return np.clip(x, 0, n - 1), np.clip(y, 0, n - 1)
+
+
+def simplify_coverage(geometries: np.ndarray, tolerance: float) -> np.ndarray:
+    """Simplify the polygons of a coverage, preserving the boundaries that they share.
+
+    `shapely.coverage_simplify` requires shapely 2.1. With an older shapely, each
+    polygon is simplified on its own, which can leave small gaps and overlaps between
+    the neighbours.
+    """
+    if hasattr(shapely, "coverage_simplify"):
+        return shapely.coverage_simplify(geometries, tolerance=tolerance)
+    return shapely.simplify(geometries, tolerance=tolerance, preserve_topology=True)
+
+
+def build_tiles(neighborhoods: geopandas.GeoDataFrame, dir_output: Path) -> list[dict]:
+    """Simplify the buurt polygons for each level of detail and write them as GeoJSON
+    tiles to `dir_output/tiles/<tile_zoom>/<x>/<y>.json`.
+
+    :returns: The levels of detail, with the number of tiles of each level.
+    """
+    metric = neighborhoods.to_crs(CRS_METRIC)
+    percentages = [
+        [None if math.isnan(v) else round(v * 100, 1) for v in row]
+        for row in metric.drop(columns=["geometry"]).to_numpy(dtype=float).tolist()
+    ]
+    properties = [
+        json.dumps({"g": g, "b": b, "p": p}, ensure_ascii=False, separators=(",", ":"))
+        for (g, b), p in zip(metric.index, percentages)
+    ]
+    representative = geopandas.GeoSeries(
+        metric.geometry.representative_point(), crs=CRS_METRIC).to_crs("EPSG:4326")
+    levels = []
+    for level in LEVELS:
+        simplified = simplify_coverage(metric.geometry.to_numpy(), level["tolerance"])
+        wgs84 = geopandas.GeoSeries(simplified, crs=CRS_METRIC).to_crs(
+            "EPSG:4326").to_numpy()
+        precision = level["precision"]
+        wgs84 = shapely.transform(wgs84, lambda c: np.round(c, precision))
+        geometries = shapely.to_geojson(wgs84)
+        x, y = tile_xy(representative.x.to_numpy(), representative.y.to_numpy(),
+                       level["tile_zoom"])
+        tiles = {}
+        for i in range(len(metric)):
+            if shapely.is_empty(wgs84[i]):
+                continue
+            feature = (f'{{"type":"Feature","geometry":{geometries[i]},'
+                       f'"properties":{properties[i]}}}')
+            tiles.setdefault((x[i], y[i]), []).append(feature)
+        for (tx, ty), features in tiles.items():
+            path_tile = dir_output.joinpath(
+                "tiles", str(level["tile_zoom"]), str(tx), f"{ty}.json")
+            path_tile.parent.mkdir(parents=True, exist_ok=True)
+            path_tile.write_text(FEATURE_COLLECTION_START + ",".join(features) +
+                                 FEATURE_COLLECTION_END)
+        levels.append({"max_zoom": level["max_zoom"],
+                       "tile_zoom": level["tile_zoom"],
+                       "nr_tiles": len(tiles)})
+    return levels
+
+
+def build_payloads(path_neighborhoods: Path, dir_output: Path) -> int:
+    """Write the index, the label percentages and the tiles of the buurten to
+    `dir_output`.
+
+    The percentages are stored in `shares.npy`, one row per buurt, with the buurten of
+    a gemeente in contiguous rows. The index has the names of the buurten in the same
+    order, and the range of rows of each gemeente.
+
+    :returns: The number of gemeenten.
+    """
+    neighborhoods_geom = geopandas.read_file(path_neighborhoods).set_index(
+        ["gemeentenaam", "buurtnaam"]).sort_index()
+    neighborhoods = neighborhoods_geom.drop(columns=["geometry"])
+    labels = [str(c) for c in neighborhoods.columns]
+    # A version is never written in place, the dashboard could be reading it
+    dir_output.mkdir(parents=True)
+    shares = np.round(neighborhoods.to_numpy(dtype=float) * 100, 2)
+    np.save(dir_output.joinpath("shares.npy"), shares)
+    gemeenten = {}
+    for gemeentenaam, rows in neighborhoods.groupby(level="gemeentenaam").indices.items():
+        # sorted on the index, so the rows of a gemeente are a contiguous range
+        gemeenten[gemeentenaam] = [int(rows[0]), int(rows[-1]) + 1]
+    levels = build_tiles(neighborhoods_geom, dir_output)
+    index = {"labels": labels, "gemeenten": gemeenten,
+             "buurten": neighborhoods.index.get_level_values("buurtnaam").tolist(),
+             "levels": levels,
+             "bounds": neighborhoods_geom.to_crs("EPSG:4326").total_bounds.tolist()}
+    # The index is written last, a version without an index is not complete
+    dir_output.joinpath("index.json").write_text(
+        json.dumps(index, ensure_ascii=False, separators=(",", ":")))
+    return len(gemeenten)
+
+
+def publish(dir_data: Path, version: str, keep: int = 3, grace: float = 600):
+    """Point the `current` symlink of the data directory to a version, and remove the
+    old versions except for the last `keep`.
+
+    The symlink is replaced atomically, so that the dashboard never sees a partial
+    dataset. The workers swap in the new version when their watcher polls the
+    symlink, and until then they read the tiles of the version they have. Therefore a
+    version is only removed when the version that replaced it was published more than
+    `grace` seconds ago, which must be longer than the reload interval of the
+    dashboard. The versions that are not removed yet are removed by the next publish.
+    """
+    link_tmp = dir_data.joinpath(CURRENT + ".tmp")
+    link_tmp.unlink(missing_ok=True)
+    link_tmp.symlink_to(Path(VERSIONS, version), target_is_directory=True)
+    os.replace(link_tmp, dir_data.joinpath(CURRENT))
+    versions = sorted(p for p in dir_data.joinpath(VERSIONS).iterdir() if p.is_dir())
+    now = time.time()
+    for old, successor in zip(versions[:-keep], versions[1:]):
+        if old.name == version:
+            continue
+        # The index is written last, so its time is when the successor was complete
+        published = successor.joinpath("index.json")
+        if published.exists() and now - published.stat().st_mtime > grace:
+            shutil.rmtree(old)
+
+
+parser_build = argparse.ArgumentParser(prog="build")
+parser_build.add_argument("neighborhoods",
+                          help="Path to the labels_neighborhood_geom.fgb file")
+parser_build.add_argument("output", help="Path to the data directory")
+parser_build.add_argument("--keep", type=int, default=3,
+                          help="Number of versions that are kept in the data directory")
+parser_build.add_argument("--grace", type=float, default=600,
+                          help="Seconds after which a replaced version can be removed, must be longer than the reload interval of the dashboard")
+
+if __name__ == "__main__":
+    args = parser_build.parse_args()
+    dir_data = Path(args.output).resolve()
+    version = datetime.now().strftime("%Y%m%dT%H%M%S")
+    nr_gemeenten = build_payloads(Path(args.neighborhoods).resolve(),
+                                  dir_data.joinpath(VERSIONS, version))
+    publish(dir_data, version, keep=args.keep, grace=args.grace)
+    log.info(f"Published version {version} with {nr_gemeenten} gemeenten in {args.output}")
@@ -1,8 +1,16 @@
-from dash import Dash, html, dcc, callback, Output, Input
-import geopandas
+import functools
+import gzip
+import os
+from pathlib import Path
+
+from dash import Dash, html, dcc, callback, Output, Input, State, no_update
+import dash_leaflet as dl
 import plotly.graph_objects as go
 import flask
 
+from data import DashboardData, DataStore
+from tiles import tile_range
+
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
 server = flask.Flask(__name__) # define flask app.server
@@ -27,34 +35,47 @@ COLORS = {"#1a9641": "a++++",
           "#d7191c": "g"
           }
 
-neighborhoods = geopandas.read_file("labels_neighborhood_geom.fgb").set_index(["gemeentenaam", "buurtnaam"])
-nbhd_long = neighborhoods.drop(columns=["geometry"]).melt(var_name="Energielabel", value_name="Percentage", ignore_index=False).sort_index()
-nbhd_long["Percentage"] = nbhd_long["Percentage"] * 100
+# The payloads are precomputed with build.py from labels_neighborhood_geom.fgb.
+# A new version that is published by build.py is loaded without a restart.
+DATA_DIR = Path(os.environ.get("WIJKLABELS_DASHBOARD_DATA", "dashboard_data"))
+DATA = DataStore(DATA_DIR, interval=float(
+    os.environ.get("WIJKLABELS_DASHBOARD_RELOAD_INTERVAL", 10)))
+# Responses smaller than this are not compressed
+GZIP_MIN_SIZE = 500
+# The largest number of tiles that is loaded for one view of the map
+MAX_TILES_VIEW = 64
+FEATURE_COLLECTION_START = '{"type":"FeatureCollection","features":['
+FEATURE_COLLECTION_END = ']}'
 
-def plot_buurt(selected_municipality, selected_neighborhood):
+
+@functools.lru_cache(maxsize=8192)
+def plot_buurt(data: DashboardData, selected_municipality, selected_neighborhood):
+    """Returns the serialized figure, which is cached. Dash only needs the dict, so
+    the plotly Figure is built once per buurt and version of the data."""
+    percentages = data.percentages(selected_municipality, selected_neighborhood)
     fig = go.Figure(data=[go.Bar(
-        x=nbhd_long.loc[(selected_municipality, selected_neighborhood)].Energielabel,
-        y=nbhd_long.loc[(selected_municipality, selected_neighborhood)].Percentage,
+        x=data.labels,
+        y=percentages,
         marker_color=list(COLORS.keys()),
         hovertemplate = "%{x}: %{y:.1f}%"
     )])
     fig.update_yaxes(range=[0, 60])
     fig.update_layout(title_text=f"{selected_municipality}, {selected_neighborhood}", xaxis_title="Energielabel", yaxis_title="Percentage (%)")
-    return fig
+    return fig.to_plotly_json()
 
 @callback(
     Output(component_id='controls-and-graph', component_property='figure'),
     [Input('municipalities-dropdown', 'value'), Input('neighborhoods-dropdown', 'value')]
 )
 def update_graph(selected_municipality, selected_neighborhood):
-    fig = plot_buurt(selected_municipality, selected_neighborhood)
+    fig = plot_buurt(DATA.current(), selected_municipality, selected_neighborhood)
     return fig
 
 @app.callback(
     Output('neighborhoods-dropdown', 'options'),
     [Input('municipalities-dropdown', 'value')])
 def set_neighborhoods_options(selected_municipality):
-    return neighborhoods.index.get_loc_level(selected_municipality, level=0)[1]
+    return DATA.current().buurten_of(selected_municipality)
 
 @app.callback(
     Output('neighborhoods-dropdown', 'value'),
@@ -62,32 +83,154 @@ def set_neighborhoods_options(selected_municipality):
 def set_neighborhoods_value(available_options):
     return available_options[0]
 
-app.layout = html.Div([
-    html.Div([
+
+def level_of_detail(data: DashboardData, zoom):
+    """The level of detail (see build.py) for the zoom of the map."""
+    for level in data.index["levels"]:
+        if zoom <= level["max_zoom"]:
+            return level
+    return data.index["levels"][-1]
+
+
+@functools.lru_cache(maxsize=4096)
+def load_tile_features(version: Path, tile_zoom, x, y):
+    """The features of a tile of a version of the data, as a JSON string without the
+    FeatureCollection.
+
+    The cache is keyed on the directory of the version, so that a request that is
+    still in progress with the previous version cannot put its tiles in the cache of
+    the new version after a reload.
+    """
+    path = DashboardData.path_tile_of(version, tile_zoom, x, y)
+    try:
+        tile = path.read_text()
+    except FileNotFoundError:
+        return ""
+    return tile[len(FEATURE_COLLECTION_START):-len(FEATURE_COLLECTION_END)]
+
+
+@server.route("/wijklabels/dashboard/view/<int:tile_zoom>/<int:x_min>/<int:y_min>/<int:x_max>/<int:y_max>.json")
+def view(tile_zoom, x_min, y_min, x_max, y_max):
+    """The buurten in a range of tiles, as a GeoJSON FeatureCollection."""
+    data = DATA.current()
+    if tile_zoom not in {level["tile_zoom"] for level in data.index["levels"]}:
+        flask.abort(404)
+    if (x_max - x_min + 1) * (y_max - y_min + 1) > MAX_TILES_VIEW:
+        flask.abort(400)
+    features = (load_tile_features(data.directory, tile_zoom, x, y)
+                for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1))
+    body = FEATURE_COLLECTION_START + ",".join(f for f in features if f) + FEATURE_COLLECTION_END
+    response = flask.Response(body, mimetype="application/geo+json")
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response
+
+
+@callback(
+    Output('buurten-map-layer', 'url'),
+    [Input('buurten-map', 'bounds'), Input('buurten-map', 'zoom')],
+    State('buurten-map-layer', 'url'))
+def update_map_view(bounds, zoom, current_url):
+    """Load only the tiles in view, on the level of detail of the zoom."""
+    if bounds is None or zoom is None:
+        return no_update
+    tile_zoom = level_of_detail(DATA.current(), zoom)["tile_zoom"]
+    x_min, y_min, x_max, y_max = tile_range(bounds, tile_zoom, MAX_TILES_VIEW)
+    url = f"/wijklabels/dashboard/view/{tile_zoom}/{x_min}/{y_min}/{x_max}/{y_max}.json"
+    return no_update if url == current_url else url
+
+
+@callback(
+    Output('buurten-map-layer', 'hideout'),
+    Input('label-dropdown', 'value'))
+def update_map_label(selected_label):
+    label_index = DATA.current().labels.index(selected_label)
+    return {"label_index": label_index, "label": selected_label,
+            "color": list(COLORS.keys())[label_index]}
+
+
+@server.after_request
+def compress_and_tag(response: flask.Response):
+    """Add an ETag to the responses, answer with 304 if the client already has the
+    response, and gzip the response if the client accepts it."""
+    if (response.direct_passthrough or response.status_code != 200
+            or "Content-Encoding" in response.headers):
+        return response
+    response.add_etag()
+    response.make_conditional(flask.request)
+    if response.status_code != 200:
+        return response
+    if ("gzip" in flask.request.headers.get("Accept-Encoding", "")
+            and response.content_length is not None
+            and response.content_length >= GZIP_MIN_SIZE):
+        response.set_data(gzip.compress(response.get_data(), compresslevel=5))
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+    return response
+
+# The caches are keyed on the version of the data, they are cleared on a reload to
+# free the entries of the previous version
+DATA.on_reload(plot_buurt.cache_clear)
+DATA.on_reload(load_tile_features.cache_clear)
+
+
+def layout():
+    """The layout is built for each page load, from the current version of the data."""
+    data = DATA.current()
+    return html.Div([
+        html.Div([
+            html.Div(
+                children=[
+                    html.H5(children="Gemeente"),
+                    dcc.Dropdown(
+                        id="municipalities-dropdown",
+                        options=list(data.gemeenten),
+                        value="'s-Gravenhage",
+                        clearable=False
+                    ),
+                ], style={'padding': 10, 'flex': 1}
+            ),
+            html.Div(
+                children=[
+                    html.H5(children="Buurt"),
+                    dcc.Dropdown(
+                        id="neighborhoods-dropdown",
+                        value="Bezuidenhout-Midden",
+                        clearable=False
+                    ),
+                ], style={'padding': 10, 'flex': 1}
+            ),
+        ], style={'display': 'flex', 'flexDirection': 'row'}),
+        dcc.Graph(figure={}, id="controls-and-graph"),
         html.Div(
             children=[
-                html.H5(children="Gemeente"),
+                html.H5(children="Aandeel van het energielabel per buurt"),
                 dcc.Dropdown(
-                    id="municipalities-dropdown",
-                    options=neighborhoods.index.get_level_values(0).unique(),
-                    value="'s-Gravenhage",
+                    id="label-dropdown",
+                    options=data.labels,
+                    value=data.labels[4],
                     clearable=False
                 ),
-            ], style={'padding': 10, 'flex': 1}
+            ], style={'padding': 10}
         ),
-        html.Div(
+        dl.Map(
+            id="buurten-map",
+            bounds=[[data.index["bounds"][1], data.index["bounds"][0]],
+                    [data.index["bounds"][3], data.index["bounds"][2]]],
             children=[
-                html.H5(children="Buurt"),
-                dcc.Dropdown(
-                    id="neighborhoods-dropdown",
-                    value="Bezuidenhout-Midden",
-                    clearable=False
+                dl.TileLayer(),
+                dl.GeoJSON(
+                    id="buurten-map-layer",
+                    style={"variable": "wijklabels.styleBuurt"},
+                    onEachFeature={"variable": "wijklabels.tooltipBuurt"},
                 ),
-            ], style={'padding': 10, 'flex': 1}
+            ],
+            style={'height': '600px'}
         ),
-    ], style={'display': 'flex', 'flexDirection': 'row'}),
-    dcc.Graph(figure={}, id="controls-and-graph"),
-])
+    ])
+
+
+app.layout = layout
 
 # if __name__ == '__main__':
-#     app.run_server(debug=True)
\ No newline at end of file
+#     app.run_server(debug=True)
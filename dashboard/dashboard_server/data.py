@@ -0,0 +1,143 @@
+"""The dataset of the dashboard, with hot reload
+
+`build.py` writes each version of the dataset to its own directory,
+`<data>/versions/<version>/`, and then points the `<data>/current` symlink to it.
+Replacing the symlink is atomic, so a reader sees either the old or the new version.
+
+The label percentages of the buurten are stored in a single `shares.npy` array, which
+is memory-mapped. The mapped pages are in the page cache of the operating system, thus
+they are shared by all gunicorn workers, instead of being loaded into each worker.
+
+Each worker watches the `current` symlink in a background thread, and swaps in the
+new version when it changes. The requests that are in progress keep the version they
+started with.
+
+Copyright 2023 3DGI
+"""
+import json
+import logging
+import math
+import os
+import threading
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+log = logging.getLogger("DASHBOARD")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+CURRENT = "current"
+VERSIONS = "versions"
+
+
+class DashboardData:
+    """One version of the dataset.
+
+    :param directory: The directory of the version, with the `index.json`, the
+        `shares.npy` and the `tiles`.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.version = directory.name
+        self.index = json.loads(directory.joinpath("index.json").read_text())
+        self.labels = self.index["labels"]
+        self.gemeenten = self.index["gemeenten"]
+        self.buurten = self.index["buurten"]
+        # The rows of the buurten of a gemeente are contiguous, see build.py
+        self.shares = np.load(directory.joinpath("shares.npy"), mmap_mode="r")
+        self._positions = {}
+
+    def buurten_of(self, gemeente: str) -> list[str]:
+        start, stop = self.gemeenten[gemeente]
+        return self.buurten[start:stop]
+
+    def percentages(self, gemeente: str, buurt: str) -> list:
+        """The percentages of the energy labels of a buurt, None where not available."""
+        positions = self._positions.get(gemeente)
+        if positions is None:
+            start, _ = self.gemeenten[gemeente]
+            positions = {b: start + i for i, b in enumerate(self.buurten_of(gemeente))}
+            self._positions[gemeente] = positions
+        row = self.shares[positions[buurt]].tolist()
+        return [None if math.isnan(v) else v for v in row]
+
+    def path_tile(self, tile_zoom: int, x: int, y: int) -> Path:
+        return self.path_tile_of(self.directory, tile_zoom, x, y)
+
+    @staticmethod
+    def path_tile_of(directory: Path, tile_zoom: int, x: int, y: int) -> Path:
+        return directory.joinpath("tiles", str(tile_zoom), str(x), f"{y}.json")
+
+
+def resolve_version(root: Path) -> Path:
+    """The directory of the current version in `root`. A directory without versions
+    is a dataset itself."""
+    current = root.joinpath(CURRENT)
+    if current.exists():
+        return current.resolve()
+    return root.resolve()
+
+
+class DataStore:
+    """The current version of the dataset, which is reloaded when it changes.
+
+    :param root: The data directory that is written by build.py.
+    :param interval: Seconds between the checks for a new version.
+    """
+
+    def __init__(self, root: Path, interval: float = 10.0):
+        self.root = root
+        self.interval = interval
+        self._data = DashboardData(resolve_version(root))
+        self._on_reload = []
+        self._lock = threading.Lock()
+        self._watcher_pid = None
+
+    def on_reload(self, callback: Callable[[], None]):
+        """Register a function that is called after a new version is swapped in, for
+        example to clear the caches of the previous version."""
+        self._on_reload.append(callback)
+
+    def current(self) -> DashboardData:
+        """The current version. Starts the watcher in this process if it does not run
+        yet, because the thread of the parent process does not survive a fork of a
+        gunicorn worker."""
+        if self._watcher_pid != os.getpid() and self.interval > 0:
+            with self._lock:
+                if self._watcher_pid != os.getpid():
+                    self._watcher_pid = os.getpid()
+                    threading.Thread(target=self._watch, name="dashboard-data",
+                                     daemon=True).start()
+        return self._data
+
+    def reload(self) -> bool:
+        """Swap in the current version if it changed.
+
+        :returns: True if a new version was loaded.
+        """
+        directory = resolve_version(self.root)
+        if directory == self._data.directory:
+            return False
+        data = DashboardData(directory)
+        # The assignment is atomic, the requests read the reference once
+        self._data = data
+        for callback in self._on_reload:
+            callback()
+        log.info(f"Loaded the dashboard data version {data.version}")
+        return True
+
+    def _watch(self):
+        event = threading.Event()
+        while not event.wait(self.interval):
+            try:
+                self.reload()
+            except Exception as e:
+                # A version that is not complete yet is retried at the next check
+                log.warning(f"Could not load the dashboard data: {e}")
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+
+geopandas = pytest.importorskip("geopandas")
+import shapely
+from shapely.geometry import box
+
+from build import publish, build_tiles, build_payloads, LEVELS
+from data import CURRENT, VERSIONS, DashboardData, resolve_version
+
+
+@pytest.fixture
+def neighborhoods():
+    """Three adjacent buurten of 1 km, in two gemeenten."""
+    return geopandas.GeoDataFrame({
+        "gemeentenaam": ["Rijswijk", "Delft", "Delft"],
+        "buurtnaam": ["Oud Rijswijk", "Centrum", "Noord"],
+        "A": [0.25, 0.5, np.nan],
+        "B": [0.75, 0.5, 1.0],
+        "geometry": [box(83000, 445000, 84000, 446000),
+                     box(84000, 445000, 85000, 446000),
+                     box(84000, 446000, 85000, 447000)],
+    }, crs="EPSG:28992")
+
+
+def make_version(dir_data, version, published):
+    directory = dir_data.joinpath(VERSIONS, version)
+    directory.mkdir(parents=True)
+    index = directory.joinpath("index.json")
+    index.write_text("{}")
+    os.utime(index, (published, published))
+    return directory
+
+
+def test_publish_deferred_removal(tmp_path):
+    now = time.time()
+    old = make_version(tmp_path, "20230101T000000", now - 7200)
+    replaced = make_version(tmp_path, "20230102T000000", now - 3600)
+    recent = make_version(tmp_path, "20230103T000000", now - 60)
+    new = make_version(tmp_path, "20230104T000000", now)
+    publish(tmp_path, new.name, keep=1, grace=600)
+    assert resolve_version(tmp_path) == new.resolve()
+    # A version is removed when its successor was published before the grace period
+    assert not old.exists()
+    # The workers can still read the versions that were replaced recently
+    assert replaced.exists()
+    assert recent.exists()
+    assert tmp_path.joinpath(CURRENT).is_symlink()
+
+
+def read_tiles(directory):
+    features = {}
+    for path in directory.joinpath("tiles").rglob("*.json"):
+        zoom = int(path.relative_to(directory).parts[1])
+        for feature in json.loads(path.read_text())["features"]:
+            features.setdefault(zoom, []).append(feature)
+    return features
+
+
+@pytest.mark.parametrize("coverage_simplify", [True, False])
+def test_build_tiles(tmp_path, neighborhoods, monkeypatch, coverage_simplify):
+    if not coverage_simplify:
+        # shapely < 2.1
+        monkeypatch.delattr(shapely, "coverage_simplify", raising=False)
+    levels = build_tiles(neighborhoods.set_index(["gemeentenaam", "buurtnaam"]),
+                         tmp_path)
+    assert [level["tile_zoom"] for level in levels] == \
+           [level["tile_zoom"] for level in LEVELS]
+    features = read_tiles(tmp_path)
+    for level in levels:
+        assert level["nr_tiles"] >= 1
+        # Each buurt is in exactly one tile of each level
+        buurten = sorted(f["properties"]["b"] for f in features[level["tile_zoom"]])
+        assert buurten == ["Centrum", "Noord", "Oud Rijswijk"]
+    noord = next(f for f in features[LEVELS[-1]["tile_zoom"]]
+                 if f["properties"]["b"] == "Noord")
+    assert noord["properties"] == {"g": "Delft", "b": "Noord", "p": [None, 100.0]}
+    assert noord["geometry"]["type"] == "Polygon"
+
+
+def test_build_payloads(tmp_path, neighborhoods):
+    path_neighborhoods = tmp_path / "labels_neighborhood_geom.fgb"
+    neighborhoods.to_file(path_neighborhoods, driver="FlatGeobuf")
+    directory = tmp_path.joinpath("data", VERSIONS, "20230101T000000")
+    assert build_payloads(path_neighborhoods, directory) == 2
+    data = DashboardData(directory)
+    assert data.labels == ["A", "B"]
+    assert data.buurten_of("Delft") == ["Centrum", "Noord"]
+    assert data.buurten_of("Rijswijk") == ["Oud Rijswijk"]
+    assert np.isnan(data.shares[1, 0])
+    assert data.shares[2].tolist() == [25.0, 75.0]
+    west, south, east, north = data.index["bounds"]
+    assert 4.0 < west < east < 5.0 and 51.0 < south < north < 53.0
+    # A version is never written in place
+    with pytest.raises(FileExistsError):
+        build_payloads(path_neighborhoods, directory)
@@ -0,0 +1,29 @@
+import pytest
+
+from tiles import tile_range
+
+
+@pytest.mark.parametrize("bounds", [
+    # Square view
+    ((51.9, 4.2), (52.2, 4.5)),
+    # Wide and low view, 100 x 3 tiles
+    ((52.0, -10.0), (52.0001, 40.0)),
+    # Narrow and high view
+    ((30.0, 4.3), (70.0, 4.3001)),
+])
+def test_tile_range(bounds):
+    x_min, y_min, x_max, y_max = tile_range(bounds, 9, 64)
+    assert x_min <= x_max and y_min <= y_max
+    assert (x_max - x_min + 1) * (y_max - y_min + 1) <= 64
+
+
+def test_tile_range_small_view():
+    # The view and its neighbouring tiles
+    assert tile_range(((52.0, 4.3), (52.0001, 4.3001)), 9, 64) == (261, 168, 263, 170)
+
+
+def test_tile_range_wide_view():
+    x_min, y_min, x_max, y_max = tile_range(((52.0, -10.0), (52.0001, 40.0)), 9, 64)
+    # The height of the view is kept, the width is reduced to the centre
+    assert y_max - y_min + 1 == 3
+    assert x_max - x_min + 1 == 21
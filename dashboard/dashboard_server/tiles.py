@@ -0,0 +1,53 @@
+"""The web map tiles of the buurten in view
+
+Copyright 2023 3DGI
+"""
+import math
+
+
+def tile_xy(lon, lat, zoom):
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def shrink_range(lo: int, hi: int, size: int) -> tuple[int, int]:
+    """The centre `size` tiles of the range from `lo` to `hi`."""
+    excess = hi - lo + 1 - size
+    if excess <= 0:
+        return lo, hi
+    lo += excess // 2
+    return lo, lo + size - 1
+
+
+def tile_range(bounds, tile_zoom: int, max_tiles: int) -> tuple[int, int, int, int]:
+    """The range of tiles of the map view, with at most `max_tiles` tiles.
+
+    The neighbouring tiles of the view are included, because a buurt is stored in the
+    tile of its representative point, which can be outside of the view. If the range
+    has too many tiles, it is reduced to its centre. Each axis is reduced on its own,
+    so that an elongated view keeps its shape as far as possible.
+
+    :param bounds: The bounds of the map, as `((south, west), (north, east))`.
+    :returns: `(x_min, y_min, x_max, y_max)`, with `x_min <= x_max` and
+        `y_min <= y_max`.
+    """
+    (south, west), (north, east) = bounds
+    x_min, y_min = tile_xy(west, north, tile_zoom)
+    x_max, y_max = tile_xy(east, south, tile_zoom)
+    n = 2 ** tile_zoom - 1
+    x_min, y_min = max(x_min - 1, 0), max(y_min - 1, 0)
+    x_max, y_max = min(x_max + 1, n), min(y_max + 1, n)
+    width, height = x_max - x_min + 1, y_max - y_min + 1
+    if width * height > max_tiles:
+        side = max(math.isqrt(max_tiles), 1)
+        if height <= side:
+            width = max(max_tiles // height, 1)
+        elif width <= side:
+            height = max(max_tiles // width, 1)
+        else:
+            width = height = side
+        x_min, x_max = shrink_range(x_min, x_max, width)
+        y_min, y_max = shrink_range(y_min, y_max, height)
+    return x_min, y_min, x_max, y_max
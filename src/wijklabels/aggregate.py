@@ -0,0 +1,273 @@
+"""Aggregate the individual labels to areal units
+
+The aggregation is done in a single pass over the individual records. The records are
+grouped on the codes of all the requested levels at once, which results in a small
+table of counts per finest unit. The coarser levels are rolled up from these counts.
+The distance statistics are computed from the exact histogram of the label distances
+per unit, which can be rolled up too, unlike the medians.
+
+Besides the CBS units, other units can be registered with a precomputed mapping table
+from the verblijfsobjecten to the units, see :py:func:`register_unit`.
+
+Copyright 2023 3DGI
+"""
+import numpy as np
+import pandas as pd
+
+from wijklabels import AggregateUnit
+from wijklabels.labels import EnergyLabel
+
+# From coarse to fine
+AGGREGATE_LEVELS = (AggregateUnit.NL, AggregateUnit.GEMEENTE, AggregateUnit.WIJK,
+                    AggregateUnit.BUURT)
+
+
+# The column with the unit codes of each registered unit
+UNIT_COLUMNS = {
+    AggregateUnit.NL: "landcode",
+    AggregateUnit.GEMEENTE: "gemeentecode",
+    AggregateUnit.WIJK: "wijkcode",
+    AggregateUnit.BUURT: "buurtcode",
+}
+# The index of the aggregates, the unit codes of different units can be the same
+UNIT_INDEX = ["unit", "unit_code"]
+# The VBO-to-unit mapping tables of the units that are not in the input, indexed on
+# vbo_identificatie, see :py:func:`register_unit`
+UNIT_MAPPINGS: dict[str, pd.Series] = {}
+
+
+def register_unit(unit: str, mapping: pd.DataFrame = None, column: str = None):
+    """Register an additional aggregate unit, such as postcode-4, energy region or a
+    set of user-defined polygons.
+
+    The unit codes are either in a column of the individual labels, or they are joined
+    to the labels on their `vbo_identificatie` from a mapping table. The mapping tables
+    are precomputed with a spatial join by :py:func:`wijklabels.units.build_unit_mapping`,
+    so that the aggregation is a group-by on the unit codes.
+
+    :param unit: The name of the unit, which is used as the aggregate level.
+    :param mapping: The mapping table, with the columns `vbo_identificatie` (int64)
+        and `unit_code`. If None, the unit codes must be in the input.
+    :param column: The name of the column of the unit codes. Defaults to `<unit>code`.
+    """
+    column = f"{unit}code" if column is None else column
+    UNIT_COLUMNS[unit] = column
+    if mapping is not None:
+        UNIT_MAPPINGS[unit] = mapping.set_index("vbo_identificatie")["unit_code"]
+
+
+def read_unit_mapping(path) -> pd.DataFrame:
+    """Read a mapping table that was written by `wijklabels-units`."""
+    mapping = pd.read_parquet(path)
+    mapping["vbo_identificatie"] = mapping["vbo_identificatie"].astype("Int64")
+    return mapping
+
+
+def aggregate_column_name(aggregate_level):
+    try:
+        return UNIT_COLUMNS[aggregate_level]
+    except KeyError:
+        raise ValueError(f"Unknown aggregate level: {aggregate_level}") from None
+
+
+def attach_units(df: pd.DataFrame, aggregate_levels) -> pd.DataFrame:
+    """Add the unit codes of the levels that are not in the DataFrame from their
+    mapping tables, joined on `vbo_identificatie`, which is a column or an index
+    level with int64 identifiers.
+
+    :returns: The DataFrame with the unit code columns, a copy if columns were added.
+    """
+    missing = [level for level in aggregate_levels
+               if aggregate_column_name(level) not in df.columns]
+    if len(missing) == 0:
+        return df
+    if "vbo_identificatie" in df.columns:
+        vbo = df["vbo_identificatie"]
+    else:
+        vbo = df.index.get_level_values("vbo_identificatie").to_series(index=df.index)
+    df = df.copy()
+    for level in missing:
+        if level not in UNIT_MAPPINGS:
+            raise ValueError(f"The {aggregate_column_name(level)} column of the "
+                             f"{level} units is not in the input, and the unit does "
+                             f"not have a mapping table")
+        df[aggregate_column_name(level)] = vbo.map(UNIT_MAPPINGS[level])
+    return df
+
+
+def rollup_counts(df: pd.DataFrame, value_column: str,
+                  aggregate_levels=AGGREGATE_LEVELS) -> pd.DataFrame:
+    """Count the values of `value_column` per unit, for each of the aggregate levels.
+
+    The records are grouped only once, on the unit codes of all levels, then the
+    counts are summed per level.
+
+    :returns: A DataFrame with the columns `unit`, `unit_code`, `value` and `count`.
+        Units that have only missing values are included with a missing value and a
+        count of 0, so that all units of the input are present.
+    """
+    df = attach_units(df, aggregate_levels)
+    columns = [aggregate_column_name(level) for level in aggregate_levels]
+    base = df.groupby(columns + [value_column], dropna=False, sort=False,
+                      observed=True).size()
+    base = base.reset_index(name="count")
+    base.loc[base[value_column].isna(), "count"] = 0
+    frames = []
+    for level, column in zip(aggregate_levels, columns):
+        counts = base.loc[base[column].notna()].groupby(
+            [column, value_column], dropna=False, sort=False, observed=True
+        )["count"].sum().reset_index()
+        counts.columns = ["unit_code", "value", "count"]
+        # Only keep the placeholder of the missing values for units without values
+        has_values = counts.groupby("unit_code")["count"].transform("sum") > 0
+        counts = counts.loc[counts["value"].notna() | ~has_values]
+        # Keep the units in the order of their appearance in the input
+        order = pd.Index(df[column].dropna().unique())
+        counts = counts.iloc[np.argsort(order.get_indexer(counts["unit_code"]),
+                                        kind="stable")]
+        counts.insert(0, "unit", str(level))
+        frames.append(counts)
+    return pd.concat(frames, ignore_index=True)
+
+
+def merge_counts(counts: pd.DataFrame) -> pd.DataFrame:
+    """Merge the counts of :py:func:`rollup_counts` of several parts of the records,
+    such as chunks or shards, into the counts of all records.
+
+    The counts are exact, thus the label shares and the statistics of small integer
+    values, such as the label distances, that are computed from the merged counts are
+    equal to computing them from all records at once.
+    """
+    return counts.groupby(["unit", "unit_code", "value"], dropna=False, sort=False,
+                          observed=True)["count"].sum().reset_index()
+
+
+def rollup_moments(df: pd.DataFrame, value_column: str,
+                   aggregate_levels=AGGREGATE_LEVELS) -> pd.DataFrame:
+    """Compute the count, sum, sum of squares, minimum and maximum of the values of
+    `value_column` per unit, for each of the aggregate levels. Unlike the median, these
+    can be merged over parts of the records, see :py:func:`merge_moments`.
+
+    :returns: A DataFrame with the columns `unit`, `unit_code`, `count`, `sum`,
+        `sum_squares`, `min` and `max`. Missing values are not counted.
+    """
+    df = attach_units(df, aggregate_levels)
+    columns = [aggregate_column_name(level) for level in aggregate_levels]
+    base = df[columns].copy()
+    base["value"] = pd.to_numeric(df[value_column], errors="coerce").astype(float)
+    base = base.loc[base["value"].notna()]
+    base["square"] = base["value"] ** 2
+    base = base.groupby(columns, dropna=False, sort=False, observed=True).agg(
+        count=("value", "size"), sum=("value", "sum"), sum_squares=("square", "sum"),
+        min=("value", "min"), max=("value", "max")).reset_index()
+    frames = []
+    for level, column in zip(aggregate_levels, columns):
+        moments = base.loc[base[column].notna()].rename(columns={column: "unit_code"})
+        moments = _merge_moments(moments, ["unit_code"])
+        moments.insert(0, "unit", str(level))
+        frames.append(moments)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _merge_moments(moments: pd.DataFrame, by: list[str]) -> pd.DataFrame:
+    return moments.groupby(by, dropna=False, sort=False, observed=True).agg(
+        count=("count", "sum"), sum=("sum", "sum"), sum_squares=("sum_squares", "sum"),
+        min=("min", "min"), max=("max", "max")).reset_index()
+
+
+def merge_moments(moments: pd.DataFrame) -> pd.DataFrame:
+    """Merge the moments of :py:func:`rollup_moments` of several parts of the
+    records."""
+    return _merge_moments(moments, ["unit", "unit_code"])
+
+
+def stats_from_moments(moments: pd.DataFrame, prefix: str) -> pd.DataFrame:
+    """Compute the mean, the sample standard deviation, the minimum and the maximum
+    per unit from the moments of :py:func:`rollup_moments`.
+
+    :returns: A DataFrame indexed on `unit` and `unit_code`, with the columns
+        `<prefix>_mean`, `<prefix>_std`, `<prefix>_min` and `<prefix>_max`.
+    """
+    m = moments.set_index(UNIT_INDEX)
+    n = m["count"]
+    var = (m["sum_squares"] - m["sum"] ** 2 / n) / (n - 1)
+    stats = pd.DataFrame({
+        f"{prefix}_mean": m["sum"] / n,
+        f"{prefix}_std": np.sqrt(var.clip(lower=0).where(n > 1)),
+        f"{prefix}_min": m["min"],
+        f"{prefix}_max": m["max"],
+    }, index=m.index)
+    return stats
+
+
+def label_shares(df: pd.DataFrame, energylabel_col: str,
+                 aggregate_levels=AGGREGATE_LEVELS) -> pd.DataFrame:
+    """Compute the share of each energy label per unit, for all aggregate levels.
+
+    :returns: A DataFrame indexed on `unit` and `unit_code`, with one column per
+        energy label, from A++++ to G. Labels that do not occur in a unit are NaN.
+    """
+    counts = rollup_counts(df, energylabel_col, aggregate_levels)
+    return shares_from_counts(counts)
+
+
+def shares_from_counts(counts: pd.DataFrame) -> pd.DataFrame:
+    """Convert the label counts from :py:func:`rollup_counts` to label shares."""
+    units = pd.MultiIndex.from_frame(counts[UNIT_INDEX].drop_duplicates())
+    counts = counts.loc[counts["value"].notna()]
+    wide = counts.pivot_table(index=UNIT_INDEX, columns="value", values="count",
+                              aggfunc="sum", sort=False, observed=True)
+    wide = wide.reindex(index=units, columns=list(reversed(EnergyLabel)))
+    shares = wide.div(wide.sum(axis=1), axis="index").replace(0.0, np.nan)
+    shares.columns.name = None
+    return shares
+
+
+def distance_stats(df: pd.DataFrame, distance_column: str,
+                   aggregate_levels=AGGREGATE_LEVELS) -> pd.DataFrame:
+    """Compute the statistics of the label distances per unit, for all aggregate
+    levels.
+
+    :returns: A DataFrame indexed on `unit` and `unit_code`, with the columns
+        `woning_count`, `afwijking_median`, `afwijking_mean`, `afwijking_std`,
+        `afwijking_min`, `afwijking_max`.
+    """
+    counts = rollup_counts(df, distance_column, aggregate_levels)
+    return stats_from_histogram(counts)
+
+
+def stats_from_histogram(counts: pd.DataFrame) -> pd.DataFrame:
+    """Compute the statistics of the values per unit from their histogram.
+
+    The results are equal to computing the statistics from the individual values,
+    with the pandas defaults (e.g. sample standard deviation).
+
+    :param counts: The histogram, as returned by :py:func:`rollup_counts`.
+    """
+    units = pd.MultiIndex.from_frame(counts[UNIT_INDEX].drop_duplicates())
+    h = counts.loc[counts["value"].notna() & (counts["count"] > 0),
+                   UNIT_INDEX + ["value", "count"]].copy()
+    h["value"] = h["value"].astype(float)
+    h.sort_values(UNIT_INDEX + ["value"], inplace=True, kind="stable")
+    h.set_index(UNIT_INDEX, inplace=True)
+    g = h.groupby(level=UNIT_INDEX, sort=False)
+    n = g["count"].sum()
+    mean = (h["value"] * h["count"]).groupby(level=UNIT_INDEX, sort=False).sum() / n
+    deviation = h["count"] * (h["value"] - mean.reindex(h.index)) ** 2
+    var = deviation.groupby(level=UNIT_INDEX, sort=False).sum() / (n - 1)
+    # The median is the mean of the values at the two middle positions
+    h["cumulative"] = g["count"].cumsum()
+    h["n"] = n.reindex(h.index)
+    median_lo = h.loc[h["cumulative"] > (h["n"] - 1) // 2].groupby(
+        level=UNIT_INDEX, sort=False)["value"].first()
+    median_hi = h.loc[h["cumulative"] > h["n"] // 2].groupby(
+        level=UNIT_INDEX, sort=False)["value"].first()
+    stats = pd.DataFrame({
+        "woning_count": n.reindex(units).fillna(0).astype(int),
+        "afwijking_median": ((median_lo + median_hi) / 2).reindex(units),
+        "afwijking_mean": mean.reindex(units),
+        "afwijking_std": np.sqrt(var.where(n > 1)).reindex(units),
+        "afwijking_min": g["value"].min().reindex(units),
+        "afwijking_max": g["value"].max().reindex(units),
+    }, index=units)
+    return stats
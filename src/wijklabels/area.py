@@ -0,0 +1,257 @@
+"""Label distributions of arbitrary areas
+
+Answers the question "what is the distribution of the energy labels in this polygon",
+for areas that are not a CBS unit, such as project areas, heat network zones or
+streets. The individual labels of `wijklabels-process` are joined to the points of
+their verblijfsobjecten and the points are indexed in an STRtree once. A query selects
+the dwellings in the area from the tree and counts their labels with numpy.
+
+`wijklabels-area` serves the queries over HTTP:
+
+    GET /distribution?bbox=minx,miny,maxx,maxy&woningtype=...&bouwperiode=...
+    POST /distribution {"geometry": <GeoJSON geometry>, "woningtype": [...], "bouwperiode": [...]}
+
+The coordinates are in the CRS of the verblijfsobject points, EPSG:28992 for the BAG.
+
+Requires the `geo` optional dependencies.
+
+Copyright 2023 3DGI
+"""
+import argparse
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import PathLike
+from pathlib import Path
+from time import perf_counter
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+
+try:
+    import geopandas
+    import shapely
+except ImportError as e:
+    raise ImportError("wijklabels.area requires the `geo` optional dependencies, "
+                      "install them with `pip install wijklabels[geo]`") from e
+
+from wijklabels.identificatie import encode_identificatie
+from wijklabels.labels import EnergyLabel, energylabel_codes
+
+# Logger for the area query messages
+log = logging.getLogger("AREA")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+# The labels from A++++ to G, in the order of the label columns of the aggregates
+LABELS = [str(label) for label in reversed(EnergyLabel)]
+NR_LABELS = len(LABELS)
+
+
+class AreaIndex:
+    """The individual labels with their location, indexed for area queries.
+
+    :param labels: The individual labels, with the columns `energylabel`, `woningtype`
+        and `bouwperiode`, in the same order as the points.
+    :param points: The locations of the dwellings, as shapely Points.
+    """
+
+    def __init__(self, labels: pd.DataFrame, points: np.ndarray,
+                 energylabel_col: str = "energylabel"):
+        self.tree = shapely.STRtree(points)
+        self.x = shapely.get_x(points)
+        self.y = shapely.get_y(points)
+        # The label codes run from G (0) to A++++ (10), -1 for a missing label
+        self.label_codes = energylabel_codes(
+            labels[energylabel_col].map(EnergyLabel.from_str, na_action="ignore")
+        ).fillna(-1).to_numpy(dtype=np.int8)
+        self.filters = {}
+        for column in ("woningtype", "bouwperiode"):
+            if column in labels.columns:
+                self.filters[column] = pd.Categorical(labels[column].astype("string"))
+
+    def __len__(self):
+        return len(self.label_codes)
+
+    def select(self, geometry: shapely.Geometry, **filters) -> np.ndarray:
+        """The positions of the dwellings in the area that match the filters.
+
+        :param geometry: The area. Dwellings on its boundary are included.
+        :param filters: The allowed values per column, e.g.
+            `woningtype=["vrijstaande woning"]`. None allows all values. The
+            dwellings with a missing value only match None.
+        """
+        # The candidates in the bounding box of the area are tested on their
+        # coordinates, which is several times faster than a predicate on the tree
+        positions = self.tree.query(geometry)
+        shapely.prepare(geometry)
+        positions = positions[shapely.intersects_xy(
+            geometry, self.x[positions], self.y[positions])]
+        for column, values in filters.items():
+            if values is None:
+                continue
+            if column not in self.filters:
+                raise ValueError(f"Cannot filter on {column}, it is not in the labels")
+            categorical = self.filters[column]
+            wanted = categorical.categories.get_indexer(list(values))
+            # A value that is not in the labels matches nothing, while its -1 would
+            # match the missing values
+            wanted = wanted[wanted >= 0]
+            positions = positions[np.isin(categorical.codes[positions], wanted)]
+        return positions
+
+    def distribution(self, geometry: shapely.Geometry, **filters) -> dict:
+        """The label counts and shares of the dwellings in the area.
+
+        :returns: A dict with the number of dwellings, the number of dwellings without
+            a label, and the counts and shares per label from A++++ to G.
+        """
+        codes = self.label_codes[self.select(geometry, **filters)]
+        labelled = codes[codes >= 0]
+        # bincount counts from G to A++++, the output is from A++++ to G
+        counts = np.bincount(labelled, minlength=NR_LABELS)[::-1]
+        total = len(labelled)
+        return {
+            "nr_dwellings": int(len(codes)),
+            "nr_without_label": int(len(codes) - total),
+            "counts": dict(zip(LABELS, counts.tolist())),
+            "shares": dict(zip(LABELS, (counts / total).tolist() if total > 0 else
+                               [None] * NR_LABELS)),
+        }
+
+
+def load_area_index(path_labels: PathLike, path_vbo: PathLike, layer: str = None,
+                    vbo_id_col: str = "identificatie",
+                    energylabel_col: str = "energylabel") -> AreaIndex:
+    """Join the individual labels to the verblijfsobject points and index them.
+
+    :param path_labels: The individual labels CSV, the output of `wijklabels-process`.
+    :param path_vbo: A file with the verblijfsobject points that geopandas can read,
+        e.g. an export of `lvbag.verblijfsobjectactueelbestaand`.
+    :param vbo_id_col: The column of the identifier in the verblijfsobjecten file.
+    """
+    columns = ["vbo_identificatie", energylabel_col, "woningtype", "bouwperiode"]
+    labels = pd.read_csv(path_labels, dtype=str,
+                         usecols=lambda c: c in columns)
+    labels["vbo_identificatie"] = encode_identificatie(labels["vbo_identificatie"])
+    vbo = geopandas.read_file(path_vbo, layer=layer)[[vbo_id_col, "geometry"]]
+    vbo[vbo_id_col] = encode_identificatie(vbo[vbo_id_col])
+    # A multipoint or polygon is located by its representative point
+    vbo["geometry"] = vbo.geometry.representative_point()
+    joined = labels.merge(vbo, how="inner", left_on="vbo_identificatie",
+                          right_on=vbo_id_col)
+    nr_missing = len(labels) - len(joined)
+    if nr_missing > 0:
+        log.info(f"{nr_missing} labels do not have a verblijfsobject point and are "
+                 f"not indexed")
+    return AreaIndex(joined, joined["geometry"].to_numpy(),
+                     energylabel_col=energylabel_col)
+
+
+def parse_query(params: dict) -> tuple[shapely.Geometry, dict]:
+    """The area and the filters of a query.
+
+    :param params: The query, with either a `bbox` as "minx,miny,maxx,maxy" or a list of
+        four numbers, or a GeoJSON `geometry`, and optionally the `woningtype` and
+        `bouwperiode` as a list or a comma-separated string.
+    """
+    if "geometry" in params:
+        geometry = params["geometry"]
+        if not isinstance(geometry, str):
+            geometry = json.dumps(geometry)
+        area = shapely.from_geojson(geometry)
+    elif "bbox" in params:
+        bbox = params["bbox"]
+        if isinstance(bbox, str):
+            bbox = bbox.split(",")
+        area = shapely.box(*map(float, bbox))
+    else:
+        raise ValueError("The query needs a bbox or a geometry")
+    filters = {}
+    for column in ("woningtype", "bouwperiode"):
+        values = params.get(column)
+        if isinstance(values, str):
+            values = values.split(",")
+        filters[column] = values
+    return area, filters
+
+
+def make_handler(index: AreaIndex):
+    class AreaRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            self.answer(url.path, params)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                params = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError as e:
+                return self.send_json(400, {"error": f"Invalid JSON: {e}"})
+            self.answer(urlparse(self.path).path, params)
+
+        def answer(self, path: str, params: dict):
+            if path != "/distribution":
+                return self.send_json(404, {"error": f"Unknown path {path}"})
+            start = perf_counter()
+            try:
+                area, filters = parse_query(params)
+                result = index.distribution(area, **filters)
+            except (ValueError, TypeError, shapely.errors.GEOSException) as e:
+                return self.send_json(400, {"error": str(e)})
+            result["milliseconds"] = round((perf_counter() - start) * 1000, 2)
+            self.send_json(200, result)
+
+        def send_json(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            log.debug(format % args)
+
+    return AreaRequestHandler
+
+
+parser_area = argparse.ArgumentParser(prog='wijklabels-area')
+parser_area.add_argument("labels",
+                         help="Path to the individual labels CSV file, the output of wijklabels-process")
+parser_area.add_argument("verblijfsobjecten",
+                         help="Path to a file with the verblijfsobject points, e.g. a GeoPackage")
+parser_area.add_argument("--layer", default=None,
+                         help="Layer of the verblijfsobjecten in the file")
+parser_area.add_argument("--vbo-id", default="identificatie",
+                         help="Name of the identifier column of the verblijfsobjecten")
+parser_area.add_argument('-e', '--energylabel', default="energylabel",
+                         help="Name of the column that contains the energy labels.")
+parser_area.add_argument("--host", default="127.0.0.1")
+parser_area.add_argument("--port", type=int, default=8060)
+
+
+def area_cli():
+    args = parser_area.parse_args()
+    log.info("Loading and indexing the individual labels")
+    index = load_area_index(Path(args.labels).resolve(),
+                            Path(args.verblijfsobjecten).resolve(),
+                            layer=args.layer, vbo_id_col=args.vbo_id,
+                            energylabel_col=args.energylabel)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(index))
+    log.info(f"Serving the distributions of {len(index)} dwellings on "
+             f"http://{args.host}:{args.port}/distribution")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    area_cli()
@@ -0,0 +1,223 @@
+"""Lightweight SVG charts of the energy label distributions
+
+The charts are the same bar charts as :py:func:`wijklabels.report.plot_buurt`, but they
+are written directly from the aggregated label shares into SVG templates, without
+matplotlib. This is fast enough to produce the charts of all buurten in seconds, for
+publishing them next to the dashboard.
+
+Copyright 2023 3DGI
+"""
+import argparse
+import functools
+import logging
+import math
+from html import escape
+from pathlib import Path
+from string import Template
+
+import pandas as pd
+
+from wijklabels.labels import EnergyLabel
+from wijklabels.report import COLORS
+
+# Logger for the chart messages
+log = logging.getLogger("CHARTS")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+# Bar colour per label, from A++++ to G
+LABEL_COLORS = {label: color for color, label in COLORS.items()}
+LABELS = list(reversed(EnergyLabel))
+LABEL_NAMES = [escape(str(label)) for label in LABELS]
+
+WIDTH = 400
+HEIGHT = 260
+MARGIN_LEFT = 40
+MARGIN_RIGHT = 10
+MARGIN_TOP = 30
+MARGIN_BOTTOM = 25
+# The y-axis runs to 80% like the matplotlib charts, unless a share is larger
+Y_MAX_DEFAULT = 80
+
+TEMPLATE_SVG = Template(
+    '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 $width $height" '
+    'width="$width" height="$height" font-family="sans-serif" font-size="11">\n'
+    '$body'
+    '</svg>\n')
+TEMPLATE_SYMBOL = Template(
+    '<symbol id="$id" viewBox="0 0 $width $height" font-family="sans-serif" '
+    'font-size="11">\n'
+    '$body'
+    '</symbol>\n')
+TEMPLATE_SPRITE_SHEET = Template("""<!DOCTYPE html>
+<html lang="nl">
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+<style>
+figure { display: inline-block; margin: 4px; }
+figure svg { width: ${width}px; height: ${height}px; }
+</style>
+</head>
+<body>
+<svg xmlns="http://www.w3.org/2000/svg" style="display: none">
+$symbols</svg>
+$figures</body>
+</html>
+""")
+TEMPLATE_FIGURE = Template(
+    '<figure id="figure-$id"><svg><use href="#$id"/></svg></figure>\n')
+# The elements that are repeated for each chart are plain format strings, which are
+# much faster to fill in than string.Template
+FORMAT_BAR = ('<rect x="{x:.1f}" y="{y:.1f}" width="{bar_width:.1f}" '
+              'height="{bar_height:.1f}" fill="{color}">'
+              '<title>{label}: {percentage:.1f}%</title></rect>\n')
+FORMAT_GRID = ('<line x1="{x1}" y1="{y:.1f}" x2="{x2}" y2="{y:.1f}" stroke="#b0b0b0" '
+               'stroke-width="0.8"/><text x="{x_text}" y="{y:.1f}" text-anchor="end" '
+               'dominant-baseline="middle">{tick}%</text>\n')
+FORMAT_XLABEL = '<text x="{x:.1f}" y="{y}" text-anchor="middle">{label}</text>\n'
+FORMAT_TITLE = ('<text x="{x:.1f}" y="18" text-anchor="middle" '
+                'font-size="13">{title}</text>\n')
+
+PLOT_WIDTH = WIDTH - MARGIN_LEFT - MARGIN_RIGHT
+PLOT_HEIGHT = HEIGHT - MARGIN_TOP - MARGIN_BOTTOM
+Y_BASE = MARGIN_TOP + PLOT_HEIGHT
+SLOT = PLOT_WIDTH / len(LABELS)
+BAR_WIDTH = SLOT * 0.8
+
+
+@functools.cache
+def _axes(y_max: int) -> str:
+    """The grid lines and the axis labels, which are the same for each chart with the
+    same range of the y-axis."""
+    elements = []
+    for tick in range(10, y_max + 1, 10):
+        elements.append(FORMAT_GRID.format(
+            x1=MARGIN_LEFT, x2=WIDTH - MARGIN_RIGHT,
+            y=Y_BASE - tick / y_max * PLOT_HEIGHT, x_text=MARGIN_LEFT - 4, tick=tick))
+    for i, label in enumerate(LABEL_NAMES):
+        elements.append(FORMAT_XLABEL.format(
+            x=MARGIN_LEFT + (i + 0.5) * SLOT, y=Y_BASE + 15, label=label))
+    return "".join(elements)
+
+
+def chart_body(percentages, title: str) -> str:
+    """Render the SVG elements of the bar chart of one unit.
+
+    :param percentages: The percentage of each energy label, from A++++ to G. Missing
+        labels are NaN and they are drawn as empty bars.
+    :param title: The title of the chart.
+    """
+    largest = max((p for p in percentages if p == p), default=0)
+    y_max = max(Y_MAX_DEFAULT, math.ceil(largest / 10) * 10)
+    elements = [FORMAT_TITLE.format(x=WIDTH / 2, title=escape(title)), _axes(y_max)]
+    for i, (label, percentage) in enumerate(zip(LABEL_NAMES, percentages)):
+        # NaN is not greater than 0
+        if percentage > 0:
+            bar_height = percentage / y_max * PLOT_HEIGHT
+            elements.append(FORMAT_BAR.format(
+                x=MARGIN_LEFT + i * SLOT + (SLOT - BAR_WIDTH) / 2,
+                y=Y_BASE - bar_height, bar_width=BAR_WIDTH, bar_height=bar_height,
+                color=LABEL_COLORS[LABELS[i]], label=label, percentage=percentage))
+    return "".join(elements)
+
+
+def _percentages(shares: pd.DataFrame):
+    """Iterate over the unit codes and the label percentages (A++++ to G) of each
+    unit."""
+    values = (shares.reindex(columns=LABELS).to_numpy(dtype=float) * 100).tolist()
+    return zip(map(str, shares.index), values)
+
+
+def render_svg(shares: pd.Series, title: str) -> str:
+    """Render the bar chart of one unit as a standalone SVG document.
+
+    :param shares: The share (0.0-1.0) of each energy label, indexed by
+        :py:class:`EnergyLabel`.
+    """
+    percentages = (shares.reindex(LABELS).to_numpy(dtype=float) * 100).tolist()
+    return TEMPLATE_SVG.substitute(width=WIDTH, height=HEIGHT,
+                                   body=chart_body(percentages, title))
+
+
+def write_svg_charts(shares: pd.DataFrame, dir_charts: Path) -> int:
+    """Write a SVG chart for each unit.
+
+    :param shares: The label shares per unit, as returned by
+        :py:func:`wijklabels.aggregate.label_shares`.
+    :returns: The number of charts that were written.
+    """
+    dir_charts.mkdir(parents=True, exist_ok=True)
+    for unit_code, percentages in _percentages(shares):
+        filename = ''.join(e for e in unit_code if e.isalnum())
+        dir_charts.joinpath(f"{filename}.svg").write_text(TEMPLATE_SVG.substitute(
+            width=WIDTH, height=HEIGHT, body=chart_body(percentages, unit_code)))
+    return len(shares)
+
+
+def write_sprite_sheet(shares: pd.DataFrame, path: Path,
+                       title: str = "Spreiding van energielabels"):
+    """Write the charts of all units into a single HTML page, as SVG symbols.
+
+    The chart of a unit can be referenced by its unit code, e.g.
+    ``<svg><use href="#BU03630000"/></svg>``.
+    """
+    symbols = []
+    figures = []
+    for unit_code, percentages in _percentages(shares):
+        symbol_id = escape(unit_code)
+        symbols.append(TEMPLATE_SYMBOL.substitute(
+            id=symbol_id, width=WIDTH, height=HEIGHT,
+            body=chart_body(percentages, unit_code)))
+        figures.append(TEMPLATE_FIGURE.substitute(id=symbol_id))
+    path.write_text(TEMPLATE_SPRITE_SHEET.substitute(
+        title=escape(title), width=WIDTH, height=HEIGHT, symbols="".join(symbols),
+        figures="".join(figures)))
+
+
+def read_label_shares(path: Path, unit: str = None) -> pd.DataFrame:
+    """Read the label shares per unit from a CSV file that is indexed on `unit_code`,
+    and has a column for each energy label, e.g. the neighbourhood output of
+    `wijklabels-validate`.
+
+    :param unit: If provided, only the units on this level are read (e.g. "buurt").
+        This requires a `unit` column in the file.
+    """
+    df = pd.read_csv(path, index_col="unit_code")
+    if unit is not None:
+        df = df.loc[df["unit"] == unit]
+    shares = df[[str(label) for label in LABELS]]
+    shares.columns = LABELS
+    return shares
+
+
+parser_charts = argparse.ArgumentParser(prog='wijklabels-charts')
+parser_charts.add_argument("shares",
+                           help="Path to the CSV file with the energy label shares per unit")
+parser_charts.add_argument("output", help="Path to the output directory")
+parser_charts.add_argument("--unit", default=None,
+                           help="Only produce the charts of this aggregation level, e.g. buurt")
+parser_charts.add_argument("--sprite-sheet", action="store_true",
+                           help="Write all charts into a single HTML sprite sheet instead of a SVG file per unit.")
+
+
+def charts_cli():
+    args = parser_charts.parse_args()
+    shares = read_label_shares(Path(args.shares).resolve(), unit=args.unit)
+    path_output = Path(args.output).resolve()
+    if args.sprite_sheet:
+        path_output.mkdir(parents=True, exist_ok=True)
+        p_out = path_output.joinpath("charts.html")
+        write_sprite_sheet(shares, p_out)
+        log.info(f"Wrote the charts of {len(shares)} units to {p_out}")
+    else:
+        nr_charts = write_svg_charts(shares, path_output)
+        log.info(f"Wrote {nr_charts} charts to {path_output}")
+
+
+if __name__ == "__main__":
+    charts_cli()
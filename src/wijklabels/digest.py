@@ -0,0 +1,103 @@
+"""Content digests for skipping unchanged outputs
+
+The digest of the data that an output file is generated from is recorded in a sidecar
+file next to the output, `<output>.digest`. When the outputs are generated again from
+data with the same digest, they are skipped.
+
+Copyright 2023 3DGI
+"""
+import hashlib
+from os import PathLike
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DIGEST_SUFFIX = ".digest"
+
+
+def digest_parts(*parts) -> str:
+    """Compute the digest of the parts, which can be strings, bytes, numpy arrays or
+    pandas objects."""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, (pd.DataFrame, pd.Series)):
+            h.update(part.to_csv().encode())
+        elif isinstance(part, np.ndarray) and part.dtype != object:
+            h.update(str(part.dtype).encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, np.ndarray):
+            h.update(repr(part.tolist()).encode())
+        elif isinstance(part, bytes):
+            h.update(part)
+        else:
+            h.update(str(part).encode())
+        # separator, so that the parts cannot run into each other
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def digest_file(path: PathLike) -> str:
+    """Compute the digest of the contents of a file."""
+    h = hashlib.blake2b(digest_size=16)
+    with Path(path).open("rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def sidecar(path: PathLike) -> Path:
+    path = Path(path)
+    return path.with_name(path.name + DIGEST_SUFFIX)
+
+
+def is_unchanged(paths: list[PathLike], digest: str) -> bool:
+    """Test if all output files exist and they were generated from data with this
+    digest."""
+    for path in paths:
+        try:
+            if sidecar(path).read_text() != digest or not Path(path).exists():
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def record(paths: list[PathLike], digest: str):
+    """Record the digest of the data that the output files were generated from."""
+    for path in paths:
+        sidecar(path).write_text(digest)
+
+
+def digest_frame(df: pd.DataFrame, *parts) -> str:
+    """Compute the digest of the DataFrame and further parts, from the hashes of its
+    rows, which is much faster than serialising the DataFrame.
+
+    The pandas version is part of the digest, because the row hashes are not
+    guaranteed to be the same between versions.
+    """
+    rows = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    return digest_parts(pd.__version__, list(df.columns), list(df.index.names),
+                        [str(dtype) for dtype in df.dtypes], rows, *parts)
+
+
+def write_csv_if_changed(df: pd.DataFrame, path: PathLike, **kwargs) -> bool:
+    """Write the DataFrame to a CSV file, unless the file was written from the same
+    DataFrame. An unchanged file is not touched, thus it keeps its modification time.
+
+    The digest of the DataFrame is compared before it is serialised, and the CSV is
+    written to a temporary file first, so that an interrupted write does not leave
+    a partial file.
+
+    :param kwargs: Passed to :py:meth:`pandas.DataFrame.to_csv`.
+    :returns: True if the file was written.
+    """
+    path = Path(path)
+    digest = digest_frame(df, sorted(kwargs.items()))
+    if is_unchanged([path], digest):
+        return False
+    path_tmp = path.with_name(path.name + ".tmp")
+    df.to_csv(path_tmp, **kwargs)
+    path_tmp.replace(path)
+    record([path], digest)
+    return True
@@ -0,0 +1,268 @@
+"""Statistical equivalence of a candidate processing engine to the reference
+
+A faster implementation of the label estimation, the surface areas or the apartment
+classification draws its random numbers differently, so its output cannot be compared
+record by record to the output of the reference per-Pand processing. The harness runs
+the reference and the candidate engine on the same input and checks:
+
+- the deterministic columns (`vormfactor`, `vormfactorclass`, `bouwperiode`) for exact
+  equality. The surface areas of apartments depend on their random layout, so the
+  panden with more than one VBO are excluded from the exact check, unless the
+  candidate draws the same random numbers (`exact_apartments`).
+- the distribution of the labels per unit, with a chi-squared test of homogeneity of
+  the label counts of the reference and the candidate. A unit fails if the difference
+  is significant (with a Bonferroni correction over the units) *and* the largest
+  difference between the label shares is above the tolerance, so that negligible
+  differences in large units and random differences in small units do not fail.
+
+An engine is a function that takes the input records, indexed on
+`pand_identificatie` and `vbo_identificatie`, and returns them with the computed
+columns. Engines are created by a factory with the signature of
+:py:func:`reference_engine`, which is what `wijklabels-equivalence` imports.
+
+Copyright 2023 3DGI
+"""
+import argparse
+import importlib
+import json
+import logging
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2_contingency
+
+from wijklabels import LabelEstimationMethod, AggregateUnit
+from wijklabels.aggregate import rollup_counts
+from wijklabels.labels import parse_energylabel_ditributions, reshape_for_classification
+from wijklabels.load import ExcelLoader
+from wijklabels.process import process_pand
+from wijklabels.synthetic import generate_input
+
+log = logging.getLogger("EQUIVALENCE")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+Engine = Callable[[pd.DataFrame], pd.DataFrame]
+
+EXACT_COLUMNS = ("vormfactor", "vormfactorclass", "bouwperiode")
+DISTRIBUTION_COLUMNS = ("energylabel",)
+EQUIVALENCE_LEVELS = (AggregateUnit.NL, AggregateUnit.GEMEENTE, AggregateUnit.WIJK)
+COLUMNS_INDEX = ["pand_identificatie", "vbo_identificatie"]
+
+
+def reference_engine(distributions: pd.DataFrame,
+                     method: LabelEstimationMethod = LabelEstimationMethod.DISTRIBUTION,
+                     seed: int = 1) -> Engine:
+    """The reference engine, which processes each Pand with
+    :py:func:`wijklabels.process.process_pand`.
+
+    The random numbers of each Pand are derived from the seed and the
+    `pand_identificatie`, see :py:func:`wijklabels.process.pand_rng`.
+    """
+
+    def engine(df: pd.DataFrame) -> pd.DataFrame:
+        processed = []
+        for pand_identificatie, pand_df in df.groupby(level="pand_identificatie",
+                                                       sort=False):
+            pand_df = pand_df.copy()
+            try:
+                process_pand(pand_df, distributions, method, seed)
+            except Exception as e:
+                log.debug(f"Could not process the Pand {pand_identificatie}: {e}")
+                continue
+            processed.append(pand_df)
+        return pd.concat(processed)
+
+    return engine
+
+
+@dataclass
+class EquivalenceReport:
+    """The result of comparing a candidate engine to the reference.
+
+    :param exact: The number of mismatches per deterministic column.
+    :param distributions: The test results per column, unit and unit code, with the
+        columns `column`, `unit`, `unit_code`, `n_reference`, `n_candidate`,
+        `statistic`, `pvalue`, `max_share_difference` and `failed`.
+    :param missing: The number of VBO that are in only one of the outputs.
+    """
+    exact: dict[str, int] = field(default_factory=dict)
+    distributions: pd.DataFrame = field(default_factory=pd.DataFrame)
+    missing: int = 0
+
+    @property
+    def equivalent(self) -> bool:
+        return (self.missing == 0 and sum(self.exact.values()) == 0
+                and not self.distributions.get("failed", pd.Series(dtype=bool)).any())
+
+    def to_dict(self) -> dict:
+        failed = self.distributions.loc[self.distributions["failed"]] \
+            if "failed" in self.distributions else self.distributions
+        return {"equivalent": self.equivalent, "missing": self.missing,
+                "exact": self.exact, "units_tested": len(self.distributions),
+                "units_failed": failed.to_dict("records")}
+
+
+def compare_exact(reference: pd.DataFrame, candidate: pd.DataFrame,
+                  columns=EXACT_COLUMNS) -> dict[str, int]:
+    """Count the VBO whose value differs between the outputs, per column. Two missing
+    values are equal."""
+    mismatches = {}
+    for column in columns:
+        r = reference[column].astype(object)
+        c = candidate[column].reindex(reference.index).astype(object)
+        equal = (r == c) | (r.isna() & c.isna())
+        mismatches[column] = int((~equal.fillna(False)).sum())
+    return mismatches
+
+
+def compare_distributions(reference: pd.DataFrame, candidate: pd.DataFrame,
+                          column: str, aggregate_levels=EQUIVALENCE_LEVELS,
+                          alpha: float = 0.01, tolerance: float = 0.02) -> pd.DataFrame:
+    """Test per unit whether the values of `column` have the same distribution in
+    both outputs.
+
+    :param alpha: The significance level over all units, which is divided by the
+        number of units that are tested.
+    :param tolerance: The largest difference between the shares of a value in the
+        reference and the candidate that is accepted.
+    """
+    counts = pd.concat({
+        "reference": rollup_counts(reference, column, aggregate_levels),
+        "candidate": rollup_counts(candidate, column, aggregate_levels),
+    }, names=["engine"]).reset_index(level="engine")
+    counts = counts.loc[counts["value"].notna()]
+    counts["value"] = counts["value"].astype(str)
+    table = counts.pivot_table(index=["unit", "unit_code", "value"], columns="engine",
+                               values="count", aggfunc="sum", fill_value=0)
+    table = table.reindex(columns=["reference", "candidate"], fill_value=0)
+    results = []
+    for (unit, unit_code), t in table.groupby(level=["unit", "unit_code"], sort=False):
+        observed = t.to_numpy().T
+        observed = observed[:, observed.sum(axis=0) > 0]
+        n = observed.sum(axis=1)
+        if observed.shape[1] < 2 or (n == 0).any():
+            statistic, pvalue = 0.0, 1.0
+        else:
+            statistic, pvalue, _, _ = chi2_contingency(observed)
+        shares = observed / np.maximum(n, 1)[:, None]
+        results.append({"column": column, "unit": unit, "unit_code": unit_code,
+                        "n_reference": int(n[0]), "n_candidate": int(n[1]),
+                        "statistic": float(statistic), "pvalue": float(pvalue),
+                        "max_share_difference": float(
+                            np.abs(shares[0] - shares[1]).max(initial=0.0))})
+    results = pd.DataFrame(results)
+    if len(results) > 0:
+        results["failed"] = ((results["pvalue"] < alpha / len(results))
+                             & (results["max_share_difference"] > tolerance))
+    return results
+
+
+def check_equivalence(df: pd.DataFrame, reference: Engine, candidate: Engine,
+                      exact_columns=EXACT_COLUMNS,
+                      distribution_columns=DISTRIBUTION_COLUMNS,
+                      aggregate_levels=EQUIVALENCE_LEVELS, alpha: float = 0.01,
+                      tolerance: float = 0.02,
+                      exact_apartments: bool = False) -> EquivalenceReport:
+    """Run the reference and the candidate engine on the same input and compare
+    their outputs.
+
+    :param df: The input records, indexed on `pand_identificatie` and
+        `vbo_identificatie`.
+    :param exact_apartments: Also compare the deterministic columns of the panden
+        with more than one VBO exactly.
+    """
+    output_reference = reference(df.copy())
+    output_candidate = candidate(df.copy())
+    report = EquivalenceReport()
+    report.missing = len(output_reference.index.symmetric_difference(
+        output_candidate.index))
+    selected = output_reference
+    if not exact_apartments:
+        selected = output_reference.loc[output_reference["vbo_count"] == 1]
+    report.exact = compare_exact(selected, output_candidate, exact_columns)
+    report.distributions = pd.concat(
+        [compare_distributions(output_reference, output_candidate, column,
+                               aggregate_levels, alpha, tolerance)
+         for column in distribution_columns], ignore_index=True)
+    return report
+
+
+def load_engine(spec: str) -> Callable[..., Engine]:
+    """Import an engine factory from a `module:function` specification."""
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def read_input(path: Path) -> pd.DataFrame:
+    """Read the input records from a CSV or Parquet file, such as the output of
+    `wijklabels-synthetic`."""
+    if path.suffix == ".parquet":
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path, dtype={"gemeentecode": str, "wijkcode": str,
+                                      "buurtcode": str})
+    return df.drop(columns=["geometrie"], errors="ignore").set_index(COLUMNS_INDEX)
+
+
+parser_equivalence = argparse.ArgumentParser(prog='wijklabels-equivalence')
+parser_equivalence.add_argument("path_label_distributions",
+                                help="Path to the energy label distributions Excel file")
+parser_equivalence.add_argument("candidate",
+                                help="The engine factory of the candidate, as module:function, with the signature of wijklabels.equivalence:reference_engine")
+parser_equivalence.add_argument("--input",
+                                help="Path to the input records, as CSV or Parquet. By default synthetic data is generated.")
+parser_equivalence.add_argument("--synthetic", type=int, default=20_000,
+                                help="The number of synthetic panden, if no input is provided")
+parser_equivalence.add_argument("--alpha", type=float, default=0.01,
+                                help="Significance level over all units")
+parser_equivalence.add_argument("--tolerance", type=float, default=0.02,
+                                help="Accepted difference between the label shares of a unit")
+parser_equivalence.add_argument("--exact-apartments", action="store_true",
+                                help="Also compare the deterministic columns of apartments exactly")
+parser_equivalence.add_argument("--seed", type=int, default=1)
+parser_equivalence.add_argument("--output", help="Write the report to this JSON file")
+
+
+def equivalence_cli():
+    args = parser_equivalence.parse_args()
+    distributions = reshape_for_classification(parse_energylabel_ditributions(
+        ExcelLoader(file=Path(args.path_label_distributions).resolve())))
+    if args.input is not None:
+        df = read_input(Path(args.input).resolve())
+    else:
+        df = generate_input(args.synthetic, seed=args.seed).drop(
+            columns=["geometrie"]).set_index(COLUMNS_INDEX)
+    log.info(f"Comparing {args.candidate} to the reference on {len(df)} VBO")
+    candidate = load_engine(args.candidate)(distributions,
+                                            LabelEstimationMethod.DISTRIBUTION,
+                                            seed=args.seed + 1)
+    report = check_equivalence(
+        df, reference_engine(distributions, seed=args.seed), candidate,
+        alpha=args.alpha, tolerance=args.tolerance,
+        exact_apartments=args.exact_apartments)
+    for column, mismatches in report.exact.items():
+        log.info(f"{column}: {mismatches} mismatches")
+    nr_failed = int(report.distributions["failed"].sum()) \
+        if "failed" in report.distributions else 0
+    log.info(f"{nr_failed} of {len(report.distributions)} units have a different "
+             f"label distribution, {report.missing} VBO are missing")
+    if args.output is not None:
+        Path(args.output).write_text(json.dumps(report.to_dict(), indent=2,
+                                                default=str))
+    if not report.equivalent:
+        log.warning("The candidate is not equivalent to the reference")
+        sys.exit(1)
+    log.info("The candidate is equivalent to the reference")
+
+
+if __name__ == "__main__":
+    equivalence_cli()
@@ -0,0 +1,99 @@
+"""Compact integer encoding of the BAG identifiers
+
+The BAG `identificatie` of an object is a 16-digit number, which is prefixed with the
+object type in the 3DBAG and in our outputs, e.g. `NL.IMBAG.Pand.0363100012345678`.
+Internally the identifiers are stored as int64, which is several times smaller than
+the prefixed strings and makes joins integer merges. The identifiers are converted
+back to the prefixed strings only when the data is written to the output.
+
+Copyright 2023 3DGI
+"""
+import pandas as pd
+
+PREFIX_PAND = "NL.IMBAG.Pand."
+PREFIX_VBO = "NL.IMBAG.Verblijfsobject."
+NR_DIGITS = 16
+
+# Prefix of the identifier per column or index level name
+PREFIXES = {
+    "pand_identificatie": PREFIX_PAND,
+    "vbo_identificatie": PREFIX_VBO,
+    "identificatie": PREFIX_PAND,
+}
+
+
+def encode_identificatie(series: pd.Series) -> pd.Series:
+    """Encode BAG identifiers to int64.
+
+    The identifiers can be with or without their object type prefix. Invalid
+    identifiers become pandas.NA.
+    """
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return series.astype("Int64")
+    digits = series.astype("string").str[-NR_DIGITS:]
+    return pd.to_numeric(digits, errors="coerce").astype("Int64")
+
+
+def decode_identificatie(series: pd.Series, prefix: str) -> pd.Series:
+    """Decode int64 BAG identifiers to prefixed strings."""
+    encoded = series.astype("Int64")
+    decoded = prefix + encoded.astype("string").str.zfill(NR_DIGITS)
+    return decoded.astype("object").where(encoded.notna(), pd.NA)
+
+
+def encode_one(identificatie: str | int) -> int:
+    """Encode a single BAG identifier to an integer."""
+    if isinstance(identificatie, int):
+        return identificatie
+    return int(identificatie[-NR_DIGITS:])
+
+
+def decode_one(identificatie: int, prefix: str) -> str:
+    """Decode a single integer BAG identifier to a prefixed string."""
+    return f"{prefix}{identificatie:0{NR_DIGITS}d}"
+
+
+def encode_reversible(identificatie: str, prefix: str) -> int:
+    """Encode a single prefixed BAG identifier to an integer, for identifiers that
+    are decoded again with :py:func:`decode_one` to query the database.
+
+    Raises a ValueError if the identifier is not in the form `<prefix><16 digits>`,
+    because the decoded identifier would not match the original.
+    """
+    try:
+        encoded = encode_one(identificatie)
+    except ValueError:
+        encoded = None
+    if encoded is None or decode_one(encoded, prefix) != identificatie:
+        raise ValueError(f"The identifier {identificatie!r} is not in the form "
+                         f"'{prefix}<{NR_DIGITS} digits>'.")
+    return encoded
+
+
+def encode_index(df: pd.DataFrame) -> pd.DataFrame:
+    """Encode the BAG identifiers in the index of the DataFrame, in-place."""
+    df.index = _map_index(df.index, lambda level, _: encode_identificatie(level))
+    return df
+
+
+def decode_index(df: pd.DataFrame) -> pd.DataFrame:
+    """Return a copy of the DataFrame with the BAG identifiers in the index decoded to
+    prefixed strings."""
+    df_decoded = df.copy(deep=False)
+    df_decoded.index = _map_index(
+        df.index, lambda level, prefix: decode_identificatie(level, prefix))
+    return df_decoded
+
+
+def _map_index(index: pd.Index, func) -> pd.Index:
+    if isinstance(index, pd.MultiIndex):
+        arrays = []
+        for i, name in enumerate(index.names):
+            level = pd.Series(index.get_level_values(i))
+            if name in PREFIXES:
+                level = func(level, PREFIXES[name])
+            arrays.append(level)
+        return pd.MultiIndex.from_arrays(arrays, names=index.names)
+    elif index.name in PREFIXES:
+        return pd.Index(func(pd.Series(index), PREFIXES[index.name]), name=index.name)
+    return index
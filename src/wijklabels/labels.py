@@ -84,6 +84,16 @@ class EnergyLabel(OrderedEnum):
             return pd.NA
 
 
+def energylabel_codes(series: pd.Series) -> pd.Series:
+    """Encode the energy labels as integers, by their position from G (0) to
+    A++++ (10). The difference of two codes is equal to :py:meth:`EnergyLabel.distance`.
+
+    :returns: An Int64 Series, with pandas.NA for missing labels.
+    """
+    codes = {label: i for i, label in enumerate(EnergyLabel._member_list())}
+    return series.map(codes).astype("Int64")
+
+
 def parse_energylabel_ditributions(excelloader) -> LabelDistributions:
     """Parse the energy label distributions from the excel file.
     The distribution tables are parsed into a DataFrame and they are indexed by
@@ -0,0 +1,253 @@
+"""Local store of the EP-Online energy labels
+
+The store is initialised once from the full EP-Online export, and afterwards it is
+kept up to date with the periodic mutations files, so that a refresh only needs to
+process the changes instead of the full national dataset.
+
+Copyright 2023 3DGI
+"""
+import argparse
+import logging
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from os import PathLike
+from pathlib import Path
+
+import pandas as pd
+
+from wijklabels import LabelBerekeningsMethode
+from wijklabels.labels import EnergyLabel
+from wijklabels.load import EPLoader, parse_ep_online, map_enum
+from wijklabels.digest import digest_file
+from wijklabels.woningtype import Woningtype
+from wijklabels.identificatie import encode_identificatie, encode_one
+
+# Logger for the label store messages
+log = logging.getLogger("EP-ONLINE")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+COLUMNS_INDEX = ["pand_identificatie", "vbo_identificatie"]
+COLUMNS = [
+    "Pand_opnamedatum",
+    "Pand_berekeningstype",
+    "energylabel",
+    "Pand_postcode",
+    "Pand_huisnummer",
+    "Pand_huisletter",
+    "Pand_huisnummertoevoeging",
+    "Pand_gebouwtype",
+    "Pand_gebouwsubtype",
+    "woningtype",
+]
+
+
+class EPLabelStore:
+    """A SQLite database of the NTA8800 labels from EP-Online, keyed by the int64
+    encoded (pand_identificatie, vbo_identificatie).
+
+    The mutations files have the same layout as the full export. The records of a
+    mutations file are applied in the order of the file, so only the last record of
+    each Verblijfsobject counts. It replaces the labels of its Verblijfsobject, also
+    if the Verblijfsobject is now in another Pand. It removes the labels of its
+    Verblijfsobject (withdrawal) if its energy label is empty, if it is not an NTA8800
+    label, or if the value in `withdrawn_column` is one of `withdrawn_values`.
+    """
+
+    def __init__(self, file: PathLike):
+        self.file = Path(file)
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.file)
+        conn.execute(f"""CREATE TABLE IF NOT EXISTS labels (
+            pand_identificatie INTEGER NOT NULL,
+            vbo_identificatie INTEGER NOT NULL,
+            {", ".join(f"{c} TEXT" for c in COLUMNS)},
+            PRIMARY KEY (pand_identificatie, vbo_identificatie)
+        )""")
+        conn.execute("""CREATE INDEX IF NOT EXISTS labels_vbo_identificatie
+            ON labels (vbo_identificatie)""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS sources (
+            digest TEXT PRIMARY KEY,
+            file TEXT,
+            kind TEXT,
+            applied TEXT
+        )""")
+        return conn
+
+    def initialize(self, file_full: PathLike, chunksize: int = 1_000_000) -> int:
+        """Replace the contents of the store with the full EP-Online export.
+
+        :returns: The number of labels in the store.
+        """
+        df = EPLoader(file=file_full, chunksize=chunksize).load()
+        with closing(self.connect()) as conn, conn:
+            conn.execute("DELETE FROM labels")
+            conn.execute("DELETE FROM sources")
+            self.__upsert(conn, df)
+            self.__record_source(conn, file_full, "full")
+            return conn.execute("SELECT count(*) FROM labels").fetchone()[0]
+
+    def apply_mutations(self, file_mutations: PathLike,
+                        withdrawn_column: str = None,
+                        withdrawn_values: tuple[str, ...] = ()) -> dict[str, int]:
+        """Apply an EP-Online mutations file to the store.
+
+        A mutations file that was already applied is skipped.
+
+        :returns: The number of upserted and withdrawn labels.
+        """
+        digest = digest_file(file_mutations)
+        usecols = list(EPLoader.columns)
+        if withdrawn_column is not None:
+            usecols.append(withdrawn_column)
+        with closing(self.connect()) as conn, conn:
+            if conn.execute("SELECT 1 FROM sources WHERE digest = ?",
+                            (digest,)).fetchone() is not None:
+                log.info(f"Mutations file {file_mutations} is already applied")
+                return {"upserted": 0, "withdrawn": 0}
+            mutations = self.read_mutations(file_mutations, usecols, withdrawn_column,
+                                            withdrawn_values)
+            withdrawn = mutations["withdrawn"]
+            nr_withdrawn = self.__delete(conn, encode_identificatie(
+                mutations.loc[withdrawn, "Pand_bagverblijfsobjectid"]))
+            parsed = parse_ep_online(mutations.loc[~withdrawn, EPLoader.columns])
+            parsed = parsed.dropna(axis="rows", how="any", subset=COLUMNS_INDEX)
+            # The store is keyed on the Pand and the Verblijfsobject, so the labels of
+            # the Verblijfsobject in its previous Pand are removed first
+            self.__delete(conn, parsed["vbo_identificatie"])
+            nr_upserted = self.__upsert(conn, parsed.set_index(COLUMNS_INDEX))
+            self.__record_source(conn, file_mutations, "mutations")
+        log.info(f"Applied {file_mutations}: {nr_upserted} labels inserted or updated, "
+                 f"{nr_withdrawn} labels withdrawn")
+        return {"upserted": nr_upserted, "withdrawn": nr_withdrawn}
+
+    @staticmethod
+    def read_mutations(file_mutations: PathLike, usecols: list[str],
+                       withdrawn_column: str = None,
+                       withdrawn_values: tuple[str, ...] = ()) -> pd.DataFrame:
+        """Read the last record of each Verblijfsobject in a mutations file, because
+        the records are changes in the order of the file.
+
+        :returns: The records as strings, with the boolean column `withdrawn`.
+        """
+        reader = pd.read_csv(file_mutations, header=0, sep=";", usecols=usecols,
+                             dtype=str, keep_default_na=False, na_filter=False,
+                             chunksize=100_000)
+        chunks = []
+        for chunk in reader:
+            chunk["vbo_key"] = encode_identificatie(chunk["Pand_bagverblijfsobjectid"])
+            chunks.append(chunk.drop_duplicates("vbo_key", keep="last"))
+        if len(chunks) == 0:
+            return pd.DataFrame(columns=usecols + ["withdrawn"], dtype=str).astype(
+                {"withdrawn": bool})
+        mutations = pd.concat(chunks).drop_duplicates("vbo_key", keep="last")
+        withdrawn = mutations["Pand_energieklasse"].str.strip() == ""
+        if withdrawn_column is not None:
+            withdrawn |= mutations[withdrawn_column].isin(withdrawn_values)
+        # A label that is replaced by a label of another method is not in the store
+        # anymore, so it is withdrawn
+        withdrawn |= ~mutations["Pand_berekeningstype"].str.contains("NTA 8800",
+                                                                     regex=False)
+        return mutations.drop(columns="vbo_key").assign(withdrawn=withdrawn)
+
+    def load(self, vbo_identificatie=None) -> pd.DataFrame:
+        """Load the labels in the same layout as :py:meth:`EPLoader.load`.
+
+        :param vbo_identificatie: If provided, only the labels of these
+            Verblijfsobjecten are loaded.
+        """
+        with closing(self.connect()) as conn, conn:
+            if vbo_identificatie is None:
+                df = pd.read_sql_query("SELECT * FROM labels", conn)
+            else:
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS selection "
+                             "(vbo_identificatie INTEGER PRIMARY KEY)")
+                conn.execute("DELETE FROM selection")
+                conn.executemany("INSERT OR IGNORE INTO selection VALUES (?)",
+                                 ((encode_one(v),) for v in vbo_identificatie))
+                df = pd.read_sql_query(
+                    "SELECT labels.* FROM labels JOIN selection USING (vbo_identificatie)",
+                    conn)
+        for column in COLUMNS_INDEX:
+            df[column] = df[column].astype("Int64")
+        df["Pand_opnamedatum"] = pd.to_datetime(df["Pand_opnamedatum"])
+        df["Pand_huisnummer"] = pd.to_numeric(df["Pand_huisnummer"])
+        df["Pand_berekeningstype"] = map_enum(df["Pand_berekeningstype"],
+                                              LabelBerekeningsMethode)
+        df["energylabel"] = map_enum(df["energylabel"], EnergyLabel)
+        df["woningtype"] = map_enum(df["woningtype"], Woningtype)
+        return df.set_index(COLUMNS_INDEX)
+
+    @staticmethod
+    def __upsert(conn: sqlite3.Connection, df: pd.DataFrame) -> int:
+        records = df.reset_index()[COLUMNS_INDEX + COLUMNS].astype("object")
+        records["Pand_opnamedatum"] = records["Pand_opnamedatum"].map(
+            lambda d: None if pd.isna(d) else d.date().isoformat())
+        records[COLUMNS] = records[COLUMNS].map(_to_sql_value)
+        records[COLUMNS_INDEX] = records[COLUMNS_INDEX].map(int)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO labels ({', '.join(COLUMNS_INDEX + COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in COLUMNS_INDEX + COLUMNS)})",
+            records.itertuples(index=False, name=None))
+        return len(records)
+
+    @staticmethod
+    def __delete(conn: sqlite3.Connection, vbo_identificatie: pd.Series) -> int:
+        """Delete the labels of the encoded Verblijfsobjecten, in any Pand."""
+        keys = vbo_identificatie.dropna().astype("int64").tolist()
+        before = conn.total_changes
+        conn.executemany("DELETE FROM labels WHERE vbo_identificatie = ?",
+                         ((key,) for key in keys))
+        return conn.total_changes - before
+
+    @staticmethod
+    def __record_source(conn: sqlite3.Connection, file: PathLike, kind: str):
+        conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                     (digest_file(file), str(Path(file).resolve()), kind,
+                      datetime.now().isoformat()))
+
+
+def _to_sql_value(value):
+    if value is None or value is pd.NA or (isinstance(value, float) and pd.isna(value)):
+        return None
+    elif hasattr(value, "value"):
+        # enum member
+        return str(value.value)
+    return str(value)
+
+
+parser_store = argparse.ArgumentParser(prog='wijklabels-ep-store')
+parser_store.add_argument("store", help="Path to the label store (SQLite) file")
+subparsers_store = parser_store.add_subparsers(dest="command", required=True)
+parser_init = subparsers_store.add_parser(
+    "init", help="Initialise the store from the full EP-Online export")
+parser_init.add_argument("ep_online", help="Path to the full EP-Online CSV file")
+parser_update = subparsers_store.add_parser(
+    "update", help="Apply an EP-Online mutations file to the store")
+parser_update.add_argument("mutations", help="Path to the EP-Online mutations CSV file")
+parser_update.add_argument("--withdrawn-column", default=None,
+                           help="Column that marks a record as withdrawn")
+parser_update.add_argument("--withdrawn-values", nargs="*", default=(),
+                           help="Values in the withdrawn column that mark a withdrawal")
+
+
+def store_cli():
+    args = parser_store.parse_args()
+    store = EPLabelStore(Path(args.store).resolve())
+    if args.command == "init":
+        nr_labels = store.initialize(Path(args.ep_online).resolve())
+        log.info(f"Initialised {store.file} with {nr_labels} labels")
+    elif args.command == "update":
+        store.apply_mutations(Path(args.mutations).resolve(),
+                              withdrawn_column=args.withdrawn_column,
+                              withdrawn_values=tuple(args.withdrawn_values))
+
+
+if __name__ == "__main__":
+    store_cli()
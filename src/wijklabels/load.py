@@ -2,7 +2,9 @@
 
 Copyright 2023 3DGI
 """
+import functools
 import inspect
+import logging
 from importlib import resources
 from os import PathLike
 from pathlib import Path
@@ -12,21 +14,158 @@ import numpy as np
 from cjio.cityjson import CityJSON
 import pandas as pd
 from openpyxl import load_workbook, Workbook
+from psycopg import sql
 
 from wijklabels import Bbox, LabelBerekeningsMethode
 from wijklabels.woningtype import Woningtype
 from wijklabels.labels import EnergyLabel
+from wijklabels.identificatie import encode_identificatie, encode_one, encode_index
+from wijklabels.digest import digest_file
+
+log = logging.getLogger("main")
 
 
 class SharedWallsLoader:
-    """Load the shared walls data from a local CSV."""
+    """Load the shared walls data from a local CSV.
+
+    The 3DBAG party walls export is large, therefore it can be converted once into a
+    columnar cache with :py:meth:`build_cache`. The cache is an uncompressed Arrow IPC
+    (Feather v2) file that is sorted on the int64 encoded `identificatie` (see
+    :py:mod:`wijklabels.identificatie`), so that it can be
+    memory-mapped and searched without reading the whole table into memory. If the
+    cache exists, it is used by :py:meth:`load` and :py:meth:`get`.
+
+    The size, modification time and digest of the CSV are stored in the metadata of
+    the cache. A cache that was built from another version of the CSV is not used.
+    The size and modification time are compared first, the CSV is only hashed when
+    its modification time changed but its size did not.
+    """
+    METADATA_DIGEST = b"wijklabels.source_digest"
+    METADATA_SIZE = b"wijklabels.source_size"
+    METADATA_MTIME = b"wijklabels.source_mtime_ns"
 
-    def __init__(self, file: PathLike = None):
+    def __init__(self, file: PathLike = None, cache: PathLike = None):
         self.file = file
+        self.cache = cache if cache is not None else self.__default_cache_path()
+        self.__digest = None
 
-    def load(self) -> pd.DataFrame:
-        df = pd.read_csv(self.file, header=0, index_col="identificatie")
-        return df
+    def load(self, columns: list[str] = None) -> pd.DataFrame:
+        """Load the shared walls data, optionally only the provided columns.
+
+        :param columns: Column names to load, without the `identificatie`. If None,
+            all columns are loaded.
+        """
+        table = None
+        if self.cache is not None and Path(self.cache).exists():
+            table = self.__read_cache()
+            if table is None:
+                log.warning(f"The cache {self.cache} was built from another version of "
+                            f"{self.file}, reading the CSV instead. Call build_cache() "
+                            f"to update the cache.")
+        if table is not None:
+            if columns is not None:
+                table = table.select(["identificatie", *columns])
+            return table.to_pandas().set_index("identificatie")
+        usecols = None if columns is None else ["identificatie", *columns]
+        df = pd.read_csv(self.file, header=0, index_col="identificatie",
+                         usecols=usecols)
+        return encode_index(df)
+
+    def get(self, identificatie: str | int, columns: list[str] = None) -> pd.DataFrame:
+        """Get the rows of one Pand from the cache.
+
+        Uses a binary search on the sorted `identificatie` column of the
+        memory-mapped cache, thus only the matching rows are materialized.
+        """
+        if self.cache is None or not Path(self.cache).exists():
+            raise FileNotFoundError(
+                f"The cache {self.cache} does not exist, call build_cache() first")
+        table = self.__read_cache()
+        if table is None:
+            raise ValueError(f"The cache {self.cache} was built from another version "
+                             f"of {self.file}, call build_cache() to update it")
+        # The int64 column is a zero-copy view on the memory-mapped file
+        ids = table.column("identificatie").to_numpy()
+        key = encode_one(identificatie)
+        start = np.searchsorted(ids, key, side="left")
+        end = np.searchsorted(ids, key, side="right")
+        subset = table.slice(start, end - start)
+        if columns is not None:
+            subset = subset.select(["identificatie", *columns])
+        return subset.to_pandas().set_index("identificatie")
+
+    def build_cache(self) -> Path:
+        """Convert the CSV into the columnar cache that is sorted on
+        `identificatie`.
+
+        :returns: The path to the cache.
+        """
+        import pyarrow as pa
+        from pyarrow import csv as pacsv
+
+        if self.cache is None:
+            raise ValueError("Either file or cache must be set")
+        # The stat is taken before the CSV is read, so that a CSV that changes while
+        # it is read does not match the cache
+        size, mtime = self.__source_stat()
+        digest = self.source_digest()
+        table = pacsv.read_csv(self.file)
+        identificatie = encode_identificatie(
+            table.column("identificatie").to_pandas()).astype("int64")
+        table = table.set_column(table.schema.get_field_index("identificatie"),
+                                 "identificatie", pa.array(identificatie))
+        table = table.sort_by("identificatie").combine_chunks()
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            self.METADATA_DIGEST: digest.encode(),
+            self.METADATA_SIZE: size, self.METADATA_MTIME: mtime})
+        path_cache = Path(self.cache)
+        path_tmp = path_cache.with_suffix(path_cache.suffix + ".tmp")
+        with pa.OSFile(str(path_tmp), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        path_tmp.replace(path_cache)
+        return path_cache
+
+    def source_digest(self) -> str:
+        """The digest of the CSV, which is computed once per size and modification
+        time of the file."""
+        stat = self.__source_stat()
+        if self.__digest is None or self.__digest[0] != stat:
+            self.__digest = (stat, digest_file(self.file))
+        return self.__digest[1]
+
+    def __read_cache(self):
+        """Read the memory-mapped cache, or None if it was built from another version
+        of the CSV. The buffers of the table keep the mapping open after the file is
+        closed."""
+        import pyarrow as pa
+
+        with pa.memory_map(str(self.cache), "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+        if self.file is not None and Path(self.file).exists():
+            if not self.__is_source(table.schema.metadata or {}):
+                return None
+        return table
+
+    def __is_source(self, metadata: dict) -> bool:
+        """Test if the cache with this metadata was built from the CSV."""
+        size, mtime = self.__source_stat()
+        if metadata.get(self.METADATA_SIZE) != size:
+            return False
+        if metadata.get(self.METADATA_MTIME) == mtime:
+            return True
+        # The CSV was touched or copied, it can still have the same contents
+        return metadata.get(self.METADATA_DIGEST) == self.source_digest().encode()
+
+    def __source_stat(self) -> tuple[bytes, bytes]:
+        stat = Path(self.file).stat()
+        return str(stat.st_size).encode(), str(stat.st_mtime_ns).encode()
+
+    def __default_cache_path(self) -> Path | None:
+        if self.file is None:
+            return None
+        return Path(self.file).with_suffix(".arrow")
 
 
 class CityJSONLoader:
@@ -98,7 +237,7 @@ class VBOLoader:
 
 
 def load_sql(filename: str = None,
-             query_params: dict = None):
+             query_params: dict = None) -> str | sql.Composed:
     """Load SQL from a file and inject parameters if provided.
 
     If providing query parametes, they need to be in a dict, where the keys are the
@@ -110,27 +249,50 @@ def load_sql(filename: str = None,
     However, the python formatting only understands ``{...}`` placeholders, so the
     ``$`` are removed from ``${...}`` when the SQL is loaded from the file.
 
+    The SQL files are read only once, see :py:func:`sql_template`.
+
     Args:
-        filename (str): SQL File to load (without the path) from the ``sql``
+        filename (str): SQL File to load (without the path) from the ``sqlfiles``
             sub-package. If None, it will load the ``.sql`` file with the name equal to
             the caller function's name.
-        query_params (dict): If provided, the templated SQL is formatted with the
-            parameters.
+        query_params (dict): If provided, the templated SQL is composed with the
+            parameters, see :py:func:`inject_parameters`.
     """
-    # Find the name of the main package. This should be bag3d.<package>, e.g. bag3d.core
-    stk = inspect.stack()[1]
-    mod = inspect.getmodule(stk[0])
-    pkgs = mod.__package__.split(".")
-    if pkgs[0] != "wijklabels" and len(pkgs) < 2:
-        raise RuntimeError(
-            "Trying to load SQL files from a namspace that is not wijklabels.<package>.")
-    sqlfiles_module = ".".join([pkgs[0], pkgs[1], "sqlfiles"])
     # Get the name of the calling function
-    _f = filename if filename is not None else f"{inspect.stack()[1].function}.sql"
-    _sql = resources.files(sqlfiles_module).joinpath(_f).read_text()
-    _pysql = _sql.replace("${", "{")
-    # return inject_parameters(_pysql, query_params)
-    return _pysql
+    _f = filename if filename is not None else \
+        f"{inspect.currentframe().f_back.f_code.co_name}.sql"
+    _pysql = sql_template(_f)
+    if query_params is None:
+        return _pysql
+    return inject_parameters(_pysql, query_params)
+
+
+@functools.cache
+def sql_template(filename: str) -> str:
+    """Read a SQL template from the ``sqlfiles`` sub-package.
+
+    The templates are cached, so each file is read from disk only once per process.
+    """
+    _sql = resources.files("wijklabels.sqlfiles").joinpath(filename).read_text()
+    return _sql.replace("${", "{")
+
+
+def inject_parameters(template: str, query_params: dict) -> sql.Composed:
+    """Compose the SQL template with the parameters.
+
+    Parameters that are :py:class:`psycopg.sql.Composable` (e.g. a table name from
+    :py:func:`sql_table`) are injected as they are, other values are injected as
+    literals. The values of the ``%s`` placeholders are not injected, they are passed
+    when the query is executed.
+    """
+    params = dict((k, v if isinstance(v, sql.Composable) else sql.Literal(v))
+                  for k, v in query_params.items())
+    return sql.SQL(template).format(**params)
+
+
+def sql_table(name: str) -> sql.Identifier:
+    """Quote a (schema-qualified) table name, e.g. `wijklabels.input`."""
+    return sql.Identifier(*name.split("."))
 
 
 class ExcelLoader:
@@ -157,57 +319,157 @@ class WoningtypeLoader:
 class EPLoader:
     """Loads the CSV file of the open energy labels from
     https://www.ep-online.nl/PublicData. The CSV file must be the one with all the
-    labels, not the one with the mutations.
-
-    It only keeps the labels that were determined after 2021-01-01, which is the start
-    of the NTA8800 method.
+    labels, not the one with the mutations. The mutations are applied to a
+    :py:class:`wijklabels.labelstore.EPLabelStore`.
+
+    It only keeps the labels that were determined with the NTA8800 method, which is
+    in use since 2021-01-01.
+
+    The CSV is read in chunks and only the used columns are parsed, with vectorized
+    string and date operations. The labels are filtered to NTA8800 before the rest of
+    the columns of a chunk are parsed. If `cache_dir` is set, the parsed labels are
+    cached in a typed columnar file that is keyed by the hash of the CSV file and the
+    version of the cache format, so that subsequent loads of the same file only read
+    the cache.
     """
-
-    def __init__(self, file: PathLike = None):
+    # Increment when the parsed columns or their types change, so that the caches of
+    # the previous format are not used
+    CACHE_FORMAT = 2
+
+    columns = [
+        "Pand_opnamedatum",
+        "Pand_berekeningstype",
+        "Pand_energieklasse",
+        "Pand_postcode",
+        "Pand_huisnummer",
+        "Pand_huisletter",
+        "Pand_huisnummertoevoeging",
+        "Pand_bagverblijfsobjectid",
+        "Pand_bagpandid",
+        "Pand_gebouwtype",
+        "Pand_gebouwsubtype",
+    ]
+
+    def __init__(self, file: PathLike = None, cache_dir: PathLike = None,
+                 chunksize: int = 1_000_000):
         self.file = file
+        self.cache_dir = cache_dir
+        self.chunksize = chunksize
 
     def load(self) -> pd.DataFrame:
-        """Columns in the csv, 0-indexed:
-        0 - opnamedatum
-        3 - berekeningsmethode
-        5 - energy label
-        11 - postcode
-        12 - huisnummer
-        13 - huisletter
-        14 - huisnummertoevoeging
-        16 - verblijfsobject ID
-        19 - pand ID
-        20 - gebouwtype (woningtype)
-        21 - gebouwsubtype (woningsubtype)
+        """Load the NTA8800 labels, indexed on the int64 encoded
+        `["pand_identificatie", "vbo_identificatie"]`.
         """
-        usecols = [0, 3, 5, 11, 12, 13, 14, 16, 19, 20, 21]
-        converters = {
-            "Pand_opnamedatum": to_date,
-            "Pand_berekeningstype": to_rekenmethode,
-            "Pand_energieklasse": EnergyLabel.from_str,
-            "Pand_bagpandid": to_identificatie,
-            "Pand_bagverblijfsobjectid": to_vbo_identifiactie,
-            "Pand_postcode": str,
-            "Pand_huisnummer": to_huisnummer,
-            "Pand_huisletter": str,
-            "Pand_huisnummertoevoeging": str
-        }
-        df = pd.read_csv(self.file, header=0, usecols=usecols, sep=";",
-                         converters=converters)
-        df["woningtype"] = df.apply(lambda row: parse_gebouwtype(row), axis=1)
-        df.rename(columns={"Pand_energieklasse": "energylabel",
-                           "Pand_bagpandid": "pand_identificatie",
-                           "Pand_bagverblijfsobjectid": "vbo_identificatie"},
-                  inplace=True)
+        path_cache = self.cache_path()
+        if path_cache is not None and path_cache.exists():
+            return self.__load_cache(path_cache)
+        df = self.__load_csv()
+        if path_cache is not None:
+            self.__write_cache(df, path_cache)
+        return df
+
+    def cache_path(self) -> Path | None:
+        """The path of the cached labels of the current file, or None if caching is
+        disabled."""
+        if self.cache_dir is None:
+            return None
+        return Path(self.cache_dir).joinpath(
+            f"ep_online_v{self.CACHE_FORMAT}_{digest_file(self.file)}"
+        ).with_suffix(".arrow")
+
+    def __load_csv(self) -> pd.DataFrame:
+        reader = pd.read_csv(self.file, header=0, sep=";", usecols=self.columns,
+                             dtype=str, keep_default_na=False, na_filter=False,
+                             chunksize=self.chunksize)
+        chunks = [parse_ep_online(chunk) for chunk in reader]
+        df = pd.concat(chunks) if len(chunks) > 0 else parse_ep_online(
+            pd.DataFrame(columns=self.columns, dtype=str))
+        # Concatenating chunks with all-missing columns replaces pandas.NA by NaN
+        for column in ("energylabel", "woningtype", "Pand_gebouwtype",
+                       "Pand_gebouwsubtype"):
+            df[column] = df[column].where(df[column].notna(), pd.NA)
         columns_index = ["pand_identificatie", "vbo_identificatie"]
-        return df.loc[
-            df["Pand_berekeningstype"] == LabelBerekeningsMethode.NTA8800
-        ].dropna(
+        return df.dropna(
             axis="rows", how="any", subset=columns_index
         ).set_index(
             columns_index
         )
 
+    @staticmethod
+    def __write_cache(df: pd.DataFrame, path_cache: Path) -> None:
+        path_cache.parent.mkdir(parents=True, exist_ok=True)
+        # The enums are stored by their value, they are restored when the cache is
+        # loaded
+        df_typed = df.reset_index()
+        for column in ("Pand_berekeningstype", "energylabel", "woningtype"):
+            df_typed[column] = df_typed[column].map(
+                lambda v: None if v is pd.NA else v.value).astype("string")
+        path_tmp = path_cache.with_suffix(path_cache.suffix + ".tmp")
+        df_typed.to_feather(path_tmp, compression="uncompressed")
+        path_tmp.replace(path_cache)
+
+    @staticmethod
+    def __load_cache(path_cache: Path) -> pd.DataFrame:
+        df = pd.read_feather(path_cache)
+        for column in ("Pand_postcode", "Pand_huisletter", "Pand_huisnummertoevoeging",
+                       "Pand_gebouwtype", "Pand_gebouwsubtype"):
+            df[column] = df[column].astype("object").where(df[column].notna(), pd.NA)
+        df["Pand_berekeningstype"] = map_enum(df["Pand_berekeningstype"],
+                                              LabelBerekeningsMethode)
+        df["energylabel"] = map_enum(df["energylabel"], EnergyLabel)
+        df["woningtype"] = map_enum(df["woningtype"], Woningtype)
+        return df.set_index(["pand_identificatie", "vbo_identificatie"])
+
+
+def parse_ep_online(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Parse a chunk of the EP-Online CSV that was read as strings.
+
+    Only the NTA8800 labels are kept, and the rest of the columns are only parsed for
+    these labels.
+    """
+    nta8800 = chunk["Pand_berekeningstype"].str.contains("NTA 8800", regex=False)
+    df = chunk.loc[nta8800].copy()
+    df["Pand_opnamedatum"] = pd.to_datetime(df["Pand_opnamedatum"], format="%Y%m%d",
+                                            errors="coerce")
+    df["Pand_berekeningstype"] = LabelBerekeningsMethode.NTA8800
+    df["Pand_energieklasse"] = map_enum(df["Pand_energieklasse"], EnergyLabel)
+    df["Pand_huisnummer"] = pd.to_numeric(df["Pand_huisnummer"], errors="coerce")
+    df["Pand_bagpandid"] = encode_identificatie(df["Pand_bagpandid"])
+    df["Pand_bagverblijfsobjectid"] = encode_identificatie(
+        df["Pand_bagverblijfsobjectid"])
+    for column in ("Pand_gebouwtype", "Pand_gebouwsubtype"):
+        df[column] = df[column].replace("", pd.NA)
+    df["woningtype"] = parse_gebouwtype_vectorized(df["Pand_gebouwtype"],
+                                                   df["Pand_gebouwsubtype"])
+    df.rename(columns={"Pand_energieklasse": "energylabel",
+                       "Pand_bagpandid": "pand_identificatie",
+                       "Pand_bagverblijfsobjectid": "vbo_identificatie"},
+              inplace=True)
+    return df
+
+
+def parse_gebouwtype_vectorized(gebouwtype: pd.Series,
+                                gebouwsubtype: pd.Series) -> pd.Series:
+    """Vectorized version of :py:func:`parse_gebouwtype`."""
+    gt = gebouwtype.str.strip().str.lower()
+    st = gebouwsubtype.str.strip().str.lower()
+    twee_onder_een_kap = gt.isin(("Twee-onder-één-kap".lower(),
+                                  "Twee-onder-een-kap / rijwoning hoek".lower()))
+    appartement = gt == "Appartement".lower()
+    candidates = gt.where(~appartement, "appartement - " + st)
+    woningtype = map_enum(candidates, Woningtype)
+    woningtype[twee_onder_een_kap.fillna(False)] = Woningtype.TWEE_ONDER_EEN_KAP
+    return woningtype
+
+
+def map_enum(series: pd.Series, enum) -> pd.Series:
+    """Map the values of a string Series to the members of an enum, invalid values
+    become pandas.NA."""
+    lookup = {str(member.value): member for member in enum}
+    mapped = series.map(lookup).astype("object")
+    mapped[mapped.isna()] = pd.NA
+    return mapped
+
 
 def to_woningtype_ep_online(gebouwtype: str):
     if (gebouwtype == "Twee-onder-één-kap" or
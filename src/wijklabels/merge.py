@@ -0,0 +1,250 @@
+"""Merge the outputs of the shards of a run
+
+Next to the individual labels, each shard of `wijklabels-shards` writes summaries
+that can be merged: the counts of the estimated labels per unit, the exact histogram
+of the label distances when they are present, and the moments (count, sum, sum of
+squares, minimum, maximum) of the vormfactor and the surface area. The counts and
+the histograms are exact, so the label shares and the distance statistics,
+including the medians, of the merged summaries are the same as those of all
+individual labels at once. `wijklabels-merge` merges the summaries into the
+national files without reading the individual labels, and optionally concatenates
+the individual labels of the shards into one file.
+
+The outputs of the shards are scoped to the run of their queue, so that the outputs
+of a previous run in the same directory are never merged into the current run. The
+summaries of a run are in `summaries/<run_id>`, and the individual labels in
+`labels_individual-<run_id>-<shard_id>.csv`. The files are written under a temporary
+name and then renamed, so that a reader never sees a partial file, also when two
+nodes write the same shard after a lease was taken over.
+
+Copyright 2023 3DGI
+"""
+import argparse
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import pandas as pd
+
+from wijklabels.aggregate import AGGREGATE_LEVELS, UNIT_COLUMNS, UNIT_INDEX, \
+    rollup_counts, merge_counts, rollup_moments, merge_moments, shares_from_counts, \
+    stats_from_histogram, stats_from_moments
+from wijklabels.labels import EnergyLabel
+
+log = logging.getLogger("MERGE")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+# The columns that are summarized, if they are in the labels
+LABEL_COLUMNS = ("energylabel", "energylabel_max_prob", "energylabel_ep_online")
+DISTANCE_COLUMNS = ("energylabel_dist_est_ep",)
+MOMENT_COLUMNS = ("vormfactor", "oppervlakte")
+DIR_SUMMARIES = "summaries"
+PREFIX_INDIVIDUAL = "labels_individual-"
+
+
+def summarize_labels(df: pd.DataFrame, aggregate_levels=AGGREGATE_LEVELS) -> tuple[
+    pd.DataFrame, pd.DataFrame]:
+    """Summarize the individual labels of a shard per unit, in a form that can be
+    merged.
+
+    Only the aggregate levels whose unit codes are in the labels are summarized.
+
+    :returns: The counts of the values of the label and distance columns, in the
+        layout of :py:func:`wijklabels.aggregate.rollup_counts` with an additional
+        `column` column, and the moments of the numeric columns, in the layout of
+        :py:func:`wijklabels.aggregate.rollup_moments` with a `column` column.
+    """
+    levels = [level for level in aggregate_levels if UNIT_COLUMNS[level] in df.columns]
+    counts = []
+    for column in LABEL_COLUMNS + DISTANCE_COLUMNS:
+        if column in df.columns:
+            c = rollup_counts(df, column, levels)
+            # Stored as strings, so that the labels and the distances fit in a column
+            c["value"] = c["value"].map(str, na_action="ignore")
+            counts.append(c.assign(column=column))
+    moments = [rollup_moments(df, column, levels).assign(column=column)
+               for column in MOMENT_COLUMNS if column in df.columns]
+    return pd.concat(counts, ignore_index=True), pd.concat(moments, ignore_index=True)
+
+
+def individual_path(path_output_dir: Path, run_id: str, shard_id: int) -> Path:
+    """The path of the individual labels of a shard."""
+    return path_output_dir.joinpath(f"{PREFIX_INDIVIDUAL}{run_id}-{shard_id:06d}.csv")
+
+
+def replace_atomic(path: Path, write) -> None:
+    """Write a file under a unique temporary name with `write(path_tmp)` and rename it
+    to `path`."""
+    path_tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        write(path_tmp)
+        os.replace(path_tmp, path)
+    finally:
+        path_tmp.unlink(missing_ok=True)
+
+
+def write_summary(df: pd.DataFrame, path_output_dir: Path, run_id: str,
+                  shard_id: int):
+    """Write the summaries of the labels of a shard to the `summaries` directory of
+    the run."""
+    counts, moments = summarize_labels(df)
+    directory = path_output_dir.joinpath(DIR_SUMMARIES, run_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, summary in (("counts", counts), ("moments", moments)):
+        replace_atomic(directory.joinpath(f"{name}-{shard_id:06d}.parquet"),
+                       lambda p: summary.to_parquet(p, index=False))
+
+
+def summary_runs(path_output_dir: Path) -> list[str]:
+    """The runs that have summaries in the output directory."""
+    directory = path_output_dir.joinpath(DIR_SUMMARIES)
+    if not directory.exists():
+        return []
+    return sorted(p.name for p in directory.iterdir() if p.is_dir())
+
+
+def select_run(path_output_dir: Path, run_id: str = None) -> str:
+    """The run to merge, which is the only run in the output directory if `run_id` is
+    not provided."""
+    runs = summary_runs(path_output_dir)
+    if run_id is None:
+        if len(runs) != 1:
+            raise ValueError(f"There are {len(runs)} runs in {path_output_dir} "
+                             f"({', '.join(runs)}), select one with --run")
+        return runs[0]
+    if run_id not in runs:
+        raise ValueError(f"There are no summaries of the run {run_id} in "
+                         f"{path_output_dir}")
+    return run_id
+
+
+def read_summaries(path_output_dir: Path, run_id: str,
+                   shard_ids: list[int] = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Read and merge the summaries of the shards of a run.
+
+    :param shard_ids: The shards to merge, which must all have summaries. By default
+        all shards of the run are merged.
+    :returns: The merged counts and moments, with the `column` column.
+    """
+    directory = path_output_dir.joinpath(DIR_SUMMARIES, run_id)
+    if shard_ids is None:
+        paths_counts = sorted(directory.glob("counts-*.parquet"))
+        paths_moments = sorted(directory.glob("moments-*.parquet"))
+    else:
+        paths_counts = [directory.joinpath(f"counts-{i:06d}.parquet")
+                        for i in sorted(shard_ids)]
+        paths_moments = [directory.joinpath(f"moments-{i:06d}.parquet")
+                         for i in sorted(shard_ids)]
+        missing = [p.name for p in paths_counts + paths_moments if not p.exists()]
+        if len(missing) > 0:
+            raise ValueError(f"{len(missing)} summaries of the done shards are "
+                             f"missing in {directory}: {', '.join(missing[:10])}")
+    if len(paths_counts) == 0:
+        raise ValueError(f"There are no shard summaries in {directory}")
+    log.info(f"Merging the summaries of {len(paths_counts)} shards of the run {run_id}")
+    counts = pd.concat([pd.read_parquet(p) for p in paths_counts], ignore_index=True)
+    counts = pd.concat([merge_counts(c).assign(column=column)
+                        for column, c in counts.groupby("column", sort=False)],
+                       ignore_index=True)
+    moments = pd.concat([pd.read_parquet(p) for p in paths_moments], ignore_index=True)
+    moments = pd.concat([merge_moments(m).assign(column=column)
+                         for column, m in moments.groupby("column", sort=False)],
+                        ignore_index=True)
+    return counts, moments
+
+
+def neighbourhood_tables(counts: pd.DataFrame,
+                         moments: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """Compute the tables per unit from the merged summaries.
+
+    :returns: The `labels_neighbourhood` table with the shares of the estimated labels
+        and the statistics of the moment columns, and when the labels were compared to
+        EP-Online, the `labels_neighbourhood_ep_online` table with the statistics of
+        the label distances, in the layout of `wijklabels-validate`.
+    """
+    def column_counts(column: str) -> pd.DataFrame:
+        c = counts.loc[counts["column"] == column].drop(columns="column")
+        if column in LABEL_COLUMNS:
+            c["value"] = c["value"].map(EnergyLabel.from_str, na_action="ignore")
+        return c
+
+    estimated = column_counts("energylabel")
+    woning_count = estimated.groupby(UNIT_INDEX, sort=False)["count"].sum()
+    neighbourhood = shares_from_counts(estimated)
+    neighbourhood.insert(0, "woning_count", woning_count.reindex(neighbourhood.index))
+    for column, m in moments.groupby("column", sort=False):
+        neighbourhood = neighbourhood.join(
+            stats_from_moments(m.drop(columns="column"), column))
+    tables = {"labels_neighbourhood": neighbourhood}
+    for column in DISTANCE_COLUMNS:
+        if (counts["column"] == column).any():
+            tables["labels_neighbourhood_ep_online"] = stats_from_histogram(
+                column_counts(column)).join(shares_from_counts(estimated))
+    return tables
+
+
+def concatenate_individual(path_output_dir: Path, path_output: Path, run_id: str,
+                           shard_ids: list[int] = None) -> int:
+    """Concatenate the individual labels of the shards of a run into one CSV file,
+    without parsing them.
+
+    :param shard_ids: The shards to concatenate, by default all shards of the run.
+    :returns: The number of shard files.
+    """
+    if shard_ids is None:
+        paths = sorted(path_output_dir.glob(f"{PREFIX_INDIVIDUAL}{run_id}-*.csv"))
+    else:
+        paths = [individual_path(path_output_dir, run_id, i) for i in sorted(shard_ids)]
+    with path_output.open("wb") as fo:
+        for i, path in enumerate(paths):
+            with path.open("rb") as fi:
+                header = fi.readline()
+                if i == 0:
+                    fo.write(header)
+                shutil.copyfileobj(fi, fo)
+    return len(paths)
+
+
+def merge_outputs(path_output_dir: Path, run_id: str, shard_ids: list[int] = None,
+                  individual: bool = False):
+    """Write the national files of a run from the outputs of its shards.
+
+    :param shard_ids: The shards to merge, by default all shards of the run.
+    :param individual: Also concatenate the individual labels of the shards.
+    """
+    counts, moments = read_summaries(path_output_dir, run_id, shard_ids)
+    for name, table in neighbourhood_tables(counts, moments).items():
+        p_out = path_output_dir.joinpath(name).with_suffix(".csv")
+        log.info(f"Writing output to {p_out}")
+        table.to_csv(p_out)
+    if individual:
+        p_out = path_output_dir.joinpath("labels_individual").with_suffix(".csv")
+        nr_shards = concatenate_individual(path_output_dir, p_out, run_id, shard_ids)
+        log.info(f"Concatenated the individual labels of {nr_shards} shards to {p_out}")
+
+
+parser_merge = argparse.ArgumentParser(prog='wijklabels-merge')
+parser_merge.add_argument("path_output_dir",
+                          help="The output directory of the shards")
+parser_merge.add_argument("--run", default=None,
+                          help="The run to merge, required if the output directory has the outputs of several runs. Use `wijklabels-shards merge` to only merge the shards that are done in the queue.")
+parser_merge.add_argument("--individual", action="store_true",
+                          help="Also concatenate the individual labels of the shards into labels_individual.csv")
+
+
+def merge_cli():
+    args = parser_merge.parse_args()
+    path_output_dir = Path(args.path_output_dir).resolve()
+    merge_outputs(path_output_dir, select_run(path_output_dir, args.run),
+                  individual=args.individual)
+
+
+if __name__ == "__main__":
+    merge_cli()
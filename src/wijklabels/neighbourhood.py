@@ -0,0 +1,122 @@
+"""Neighbourhood label shares with the buurt geometries
+
+Produces the `labels_neighborhood_geom.fgb` file of the dashboard, from the individual
+labels that are estimated by `wijklabels-process` and the CBS buurten. The individual
+labels are streamed in chunks and only their counts per buurt are kept in memory.
+
+The FlatGeobuf is written with its packed Hilbert R-tree, so that the readers can
+select the buurten in a bounding box without reading the whole file.
+
+Requires the `geo` optional dependencies.
+
+Copyright 2023 3DGI
+"""
+import argparse
+import logging
+from os import PathLike
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import geopandas
+except ImportError as e:
+    raise ImportError("wijklabels.neighbourhood requires the `geo` optional dependencies, "
+                      "install them with `pip install wijklabels[geo]`") from e
+
+from wijklabels import AggregateUnit
+from wijklabels.aggregate import rollup_counts, merge_counts, shares_from_counts
+from wijklabels.labels import EnergyLabel
+
+# Logger for the neighbourhood messages
+log = logging.getLogger("NEIGHBOURHOOD")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+COLUMNS_BUURTEN = ["buurtcode", "buurtnaam", "gemeentenaam"]
+
+
+def stream_label_counts(path_labels: PathLike, energylabel_col: str = "energylabel",
+                        chunksize: int = 1_000_000) -> pd.DataFrame:
+    """Count the energy labels per buurt in the individual labels CSV, which is read
+    in chunks.
+
+    :returns: The counts in the layout of :py:func:`wijklabels.aggregate.rollup_counts`.
+    """
+    column_buurt = "buurtcode"
+    counts = []
+    reader = pd.read_csv(path_labels, usecols=[column_buurt, energylabel_col],
+                         dtype=str, chunksize=chunksize)
+    for chunk in reader:
+        counts.append(rollup_counts(chunk, energylabel_col, (AggregateUnit.BUURT,)))
+    counts = merge_counts(pd.concat(counts, ignore_index=True))
+    counts["value"] = counts["value"].map(EnergyLabel.from_str, na_action="ignore")
+    return counts
+
+
+def join_buurten(shares: pd.DataFrame, path_buurten: PathLike,
+                 layer: str = "buurten") -> geopandas.GeoDataFrame:
+    """Join the label shares per buurt to the buurt polygons.
+
+    :param shares: The label shares, indexed on the buurtcode.
+    :param path_buurten: Path to the CBS wijken en buurten GeoPackage.
+    :returns: The buurten with labels, with the columns `gemeentenaam`,
+        `buurtnaam`, one column per energy label and the geometry. This is the layout
+        that the dashboard expects.
+    """
+    buurten = geopandas.read_file(path_buurten, layer=layer)[
+        COLUMNS_BUURTEN + ["geometry"]]
+    shares = shares.copy()
+    shares.columns = [str(label) for label in shares.columns]
+    joined = buurten.merge(shares, how="inner", left_on="buurtcode", right_index=True,
+                           validate="1:1")
+    return joined[["gemeentenaam", "buurtnaam"] + list(shares.columns) + ["geometry"]]
+
+
+def write_neighbourhoods(gdf: geopandas.GeoDataFrame, path_fgb: PathLike,
+                         path_geoparquet: PathLike = None):
+    """Write the buurten to a FlatGeobuf with a spatial index, and optionally to
+    GeoParquet."""
+    gdf.to_file(path_fgb, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+    if path_geoparquet is not None:
+        gdf.to_parquet(path_geoparquet)
+
+
+parser_neighbourhood = argparse.ArgumentParser(prog='wijklabels-neighbourhood')
+parser_neighbourhood.add_argument("labels",
+                                  help="Path to the individual labels CSV file, the output of wijklabels-process")
+parser_neighbourhood.add_argument("buurten",
+                                  help="Path to the CBS wijken en buurten GeoPackage")
+parser_neighbourhood.add_argument("output",
+                                  help="Path to the output FlatGeobuf file (labels_neighborhood_geom.fgb)")
+parser_neighbourhood.add_argument("--layer", default="buurten",
+                                  help="Layer of the buurten in the GeoPackage")
+parser_neighbourhood.add_argument('-e', '--energylabel', default="energylabel",
+                                  help="Name of the column that contains the energy labels.")
+parser_neighbourhood.add_argument("--geoparquet", default=None,
+                                  help="Also write the output to this GeoParquet file")
+parser_neighbourhood.add_argument("--chunksize", type=int, default=1_000_000,
+                                  help="Number of labels that are read at once")
+
+
+def neighbourhood_cli():
+    args = parser_neighbourhood.parse_args()
+    p_labels = Path(args.labels).resolve()
+    log.info(f"Counting the energy labels per buurt in {p_labels}")
+    counts = stream_label_counts(p_labels, energylabel_col=args.energylabel,
+                                 chunksize=args.chunksize)
+    shares = shares_from_counts(counts).droplevel("unit")
+    log.info(f"Joining the label shares of {len(shares)} buurten to the buurt polygons")
+    gdf = join_buurten(shares, Path(args.buurten).resolve(), layer=args.layer)
+    p_out = Path(args.output).resolve()
+    p_geoparquet = Path(args.geoparquet).resolve() if args.geoparquet else None
+    log.info(f"Writing {len(gdf)} buurten to {p_out}")
+    write_neighbourhoods(gdf, p_out, p_geoparquet)
+
+
+if __name__ == "__main__":
+    neighbourhood_cli()
@@ -1,22 +1,29 @@
+import functools
 import logging
-import random
 from pathlib import Path
 import argparse
-import itertools
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from time import perf_counter
 
+import numpy as np
 import pandas as pd
 import psycopg
 from psycopg.rows import dict_row
 
 from wijklabels import LabelEstimationMethod
-from wijklabels.load import ExcelLoader
+from wijklabels.load import ExcelLoader, load_sql, sql_table
+from wijklabels.identificatie import encode_one, decode_one, encode_reversible, \
+    PREFIX_PAND
 from wijklabels.vormfactor import calculate_surface_areas, vormfactor, \
     vormfactorclass
 from wijklabels.woningtype import distribute_vbo_on_floor, \
     classify_apartments, WoningtypePreNTA8800, Bouwperiode
 from wijklabels.labels import estimate_label, parse_energylabel_ditributions, \
     reshape_for_classification
+from wijklabels.timing import TimingOptions, NullTimer, NULL_TIMER, worker_timer, \
+    write_summary
+from wijklabels.progress import Progress, init_worker, add_busy
+from wijklabels.schedule import BatchScheduler, pand_cost
 
 
 log = logging.getLogger("main")
@@ -40,30 +47,186 @@ parser.add_argument('-j', '--jobs', type=int, default=4)
 parser.add_argument('-m', '--method', type=LabelEstimationMethod,
                     choices=list(map(str, LabelEstimationMethod)),
                     default="distribution")
+parser.add_argument('--seed', type=int, default=1,
+                    help="Seed of the random numbers. The random numbers of each Pand are derived from the seed and the Pand ID, thus the labels do not depend on the number of jobs or on the order of processing.")
+parser.add_argument('--batch-seconds', type=float, default=2.0,
+                    help="The panden are sent to the workers in batches that take about this many seconds, from the largest to the smallest Pand.")
+parser.add_argument('--progress-interval', type=float, default=60,
+                    help="Seconds between the progress reports.")
+parser.add_argument('--metrics',
+                    help="Write the progress metrics to this file at each report, in the Prometheus text format if the file name ends with .prom (for the textfile collector of the node exporter), otherwise as JSON.")
+parser.add_argument('--timing', action='store_true',
+                    help="Record the duration of each processing stage per Pand, and summarize them in timing/timing_summary.json in the output directory.")
+parser.add_argument('--profile', action='store_true',
+                    help="With --timing, also write the cProfile statistics of each worker.")
+parser.add_argument('--tracemalloc', action='store_true',
+                    help="With --timing, also record the peak memory per Pand and write the largest allocations of each worker.")
+
+# The stages of process_one_pand, in the order of processing
+STAGES = ["get_pand", "estimate_apartement_types", "convert_to_pre_nta8800",
+          "calculate_vormfactor", "determine_construction_period", "estimate_labels"]
+
+
+def pand_rng(seed: int, pand_identificatie: str | int) -> np.random.Generator:
+    """The random number generator of a Pand, derived from the seed of the run and the
+    `pand_identificatie`.
+
+    Each Pand has its own, independent stream of random numbers, so that the results
+    of a Pand are the same, regardless of the worker process that processes it, the
+    number of workers and the order in which the panden are processed.
+    """
+    return np.random.default_rng(
+        np.random.SeedSequence([seed, encode_one(pand_identificatie)]))
+
+
+# The columns that are required in the input table
+INPUT_COLUMNS = [
+    "pand_identificatie",
+    "oorspronkelijkbouwjaar",
+    "oppervlakte",
+    "vbo_identificatie",
+    "geometrie",
+    "woningtype",
+    "buurtcode",
+    "nr_floors",
+    "vbo_count",
+    "b3_opp_buitenmuur",
+    "b3_opp_dak_plat",
+    "b3_opp_dak_schuin",
+    "b3_opp_grond",
+    "b3_opp_scheidingsmuur"
+]
+COLUMNS_INDEX = ["pand_identificatie", "vbo_identificatie"]
+COLUMNS_EXCLUDED = ["geometrie"]
+
+
+def check_input_table(connection_string: str, table: str):
+    """Check that the input table has the required columns, raises a ValueError if
+    it does not."""
+    query_one = load_sql("select_input_one.sql", {"table": sql_table(table)})
+    with psycopg.connect(connection_string) as conn:
+        with conn.cursor(row_factory=dict_row) as cur:
+            cur.execute(query_one)
+            one = cur.fetchone()
+            missing = []
+            for col in INPUT_COLUMNS:
+                if col not in one:
+                    missing.append(col)
+            if len(missing) > 0:
+                raise ValueError(f"Some of the required columns ({missing}) are missing from the input database table {table}.")
 
-# Set seed for the random number generator that is used by the label estimation
-random.seed(1, version=2)
 
-def process_cli():
-    columns = [
-        "pand_identificatie",
-        "oorspronkelijkbouwjaar",
-        "oppervlakte",
-        "vbo_identificatie",
-        "geometrie",
-        "woningtype",
-        "buurtcode",
-        "nr_floors",
-        "vbo_count",
-        "b3_opp_buitenmuur",
-        "b3_opp_dak_plat",
-        "b3_opp_dak_schuin",
-        "b3_opp_grond",
-        "b3_opp_scheidingsmuur"
-    ]
-    columns_index = ["pand_identificatie", "vbo_identificatie"]
-    columns_excluded = ["geometrie"]
+def load_distributions(path_label_distributions: Path) -> pd.DataFrame:
+    """Load the energy label distributions in long-form."""
+    excelloader = ExcelLoader(file=path_label_distributions)
+    _d = parse_energylabel_ditributions(excelloader)
+    return reshape_for_classification(_d)
+
+
+def read_pand_identificatie(cursor) -> tuple[np.ndarray, np.ndarray]:
+    """Read the Pand IDs and their number of records from the result of a query with
+    these two columns.
+
+    Raises a ValueError if an ID is not in the form `NL.IMBAG.Pand.<16 digits>`.
+
+    :returns: The IDs, encoded as int64, and the number of records of each Pand.
+    """
+    # Keep the IDs as int64 in memory, they are decoded when they are passed to the
+    # workers, so they must decode to the IDs in the input table
+    pand_identificatie, vbo_count = [], []
+    for r in cursor:
+        pand_identificatie.append(encode_reversible(r[0], PREFIX_PAND))
+        vbo_count.append(r[1])
+    return (np.array(pand_identificatie, dtype=np.int64),
+            np.array(vbo_count, dtype=np.int64))
+
+
+# The energy label distributions of the worker process, see init_pool_worker
+_distributions: pd.DataFrame | None = None
+
+
+def init_pool_worker(busy, distributions: pd.DataFrame):
+    """Initializer of the worker processes, the distributions are sent to each worker
+    once, instead of with each Pand."""
+    global _distributions
+    _distributions = distributions
+    init_worker(busy)
+
+
+def process_batch(connection_str: str, table: str, pand_identificatie_batch: list[str],
+                  method: LabelEstimationMethod, seed: int,
+                  timing: TimingOptions = None) -> tuple[list, float]:
+    """Process a batch of panden with :py:func:`process_one_pand`, in a worker.
+
+    :returns: The result of each Pand and the duration of the batch in seconds.
+    """
+    start = perf_counter()
+    results = [process_one_pand(connection_str, table, pand_identificatie,
+                                COLUMNS_INDEX, COLUMNS_EXCLUDED, _distributions,
+                                method, seed, timing)
+               for pand_identificatie in pand_identificatie_batch]
+    return results, perf_counter() - start
+
+
+def process_panden(connection_string: str, table: str,
+                   pand_identificatie_all: np.ndarray, distributions: pd.DataFrame,
+                   method: LabelEstimationMethod, seed: int, jobs: int,
+                   vbo_count: np.ndarray = None, timing: TimingOptions = None,
+                   batch_seconds: float = 2.0, progress_interval: float = 60,
+                   path_metrics: Path = None) -> pd.DataFrame:
+    """Process the panden over a pool of worker processes.
+
+    The panden are sent to the workers in batches, from the largest to the smallest
+    Pand, see :py:class:`wijklabels.schedule.BatchScheduler`. A new batch is sent
+    when a batch is done, so that the batch size follows the throughput.
+
+    :param pand_identificatie_all: The IDs of the panden, encoded as int64.
+    :param vbo_count: The number of records of each Pand, for estimating its cost.
+        If None, all panden have the same cost.
+    :param batch_seconds: The duration of a batch that the batch size adapts to.
+    :returns: The individual labels of the panden that could be processed.
+    """
+    nr_pand = len(pand_identificatie_all)
+    if vbo_count is None:
+        vbo_count = np.ones(nr_pand, dtype=np.int64)
+    scheduler = BatchScheduler(pand_identificatie_all, pand_cost(vbo_count), jobs,
+                               target_seconds=batch_seconds)
+    progress = Progress(total=nr_pand, jobs=jobs, interval=progress_interval,
+                        path_metrics=path_metrics)
+    records = []
+    in_flight = {}
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_pool_worker,
+                             initargs=(progress.busy, distributions)) as executor, \
+            progress:
+
+        def submit():
+            batch = scheduler.next_batch()
+            if batch is not None:
+                future = executor.submit(
+                    process_batch, connection_string, table,
+                    [decode_one(int(pid), PREFIX_PAND)
+                     for pid in batch.pand_identificatie],
+                    method, seed, timing)
+                in_flight[future] = batch
+
+        # Two batches per worker, so that a worker does not wait for its next batch
+        for _ in range(2 * jobs):
+            submit()
+        # The results are consumed while they come in, so that the progress is live
+        while len(in_flight) > 0:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                results, seconds = future.result()
+                scheduler.observe(batch.cost, seconds)
+                for result in progress.track(results):
+                    if result is not None:
+                        records.extend(result)
+                submit()
+    return pd.DataFrame.from_records(records, index=COLUMNS_INDEX)
+
 
+def process_cli():
     args = parser.parse_args()
     connection_string = f"postgresql://{args.user}:{args.password}@{args.host}:{args.port}/{args.dbname}"
     path_label_distributions = Path(args.path_label_distributions).resolve()
@@ -73,49 +236,43 @@ def process_cli():
     path_output_aggregate = path_output_dir.joinpath("labels_neighbourhood").with_suffix(".csv")
     jobs = args.jobs
     table = args.table
+    timing = None
+    if args.timing:
+        timing = TimingOptions(directory=path_output_dir.joinpath("timing"),
+                               profile=args.profile, tracemalloc=args.tracemalloc)
+        # Remove the records of a previous run
+        for p in timing.directory.glob("worker-*"):
+            p.unlink()
 
-    query_one = f"SELECT * FROM {table} LIMIT 1;"
-    query_pid = f"SELECT DISTINCT pand_identificatie FROM {table};"
+    query_pid = load_sql("select_pand_vbo_count.sql", {"table": sql_table(table)})
 
     log.info(f"Testing database connection and input table")
-    with psycopg.connect(connection_string) as conn:
-        with conn.cursor(row_factory=dict_row) as cur:
-            cur.execute(query_one)
-            one = cur.fetchone()
-            missing = []
-            for col in columns:
-                if col not in one:
-                    missing.append(col)
-            if len(missing) > 0:
-                raise ValueError(f"Some of the required columns ({missing}) are missing from the input database table {table}.")
+    check_input_table(connection_string, table)
 
     log.info(f"Loading the energy label distributions from {path_label_distributions}")
-    excelloader = ExcelLoader(file=path_label_distributions)
-    _d = parse_energylabel_ditributions(excelloader)
-    distributions = reshape_for_classification(_d)
+    distributions = load_distributions(path_label_distributions)
 
     log.info("Loading the Pand IDs (identificatie) from the database")
     with psycopg.connect(connection_string) as conn:
         with conn.cursor() as cur:
             cur.execute(query_pid)
-            pand_identificatie_all = [r[0] for r in cur.fetchall()]
+            pand_identificatie_all, vbo_count = read_pand_identificatie(cur)
 
     log.info("Calculating attributes and estimating energy labels")
-    nr_pand = len(pand_identificatie_all)
-    with ProcessPoolExecutor(max_workers=jobs) as executor:
-        records = itertools.chain.from_iterable(
-            executor.map(
-                process_one_pand,
-                itertools.repeat(connection_string, nr_pand),
-                itertools.repeat(table, nr_pand),
-                pand_identificatie_all,
-                itertools.repeat(columns_index, nr_pand),
-                itertools.repeat(columns_excluded, nr_pand),
-                itertools.repeat(distributions, nr_pand),
-                itertools.repeat(args.method, nr_pand)
-            )
-        )
-    df_labels_individual = pd.DataFrame.from_records(records, index=columns_index)
+    path_metrics = Path(args.metrics).resolve() if args.metrics else None
+    df_labels_individual = process_panden(
+        connection_string, table, pand_identificatie_all, distributions, args.method,
+        args.seed, jobs, vbo_count=vbo_count, timing=timing,
+        batch_seconds=args.batch_seconds, progress_interval=args.progress_interval,
+        path_metrics=path_metrics)
+    if timing is not None:
+        summary = write_summary(timing.directory, STAGES)
+        if summary is not None:
+            for stage, stats in summary["stages"].items():
+                log.info(f"{stage}: {stats['total']:.1f}s in total, "
+                         f"p50 {stats['p50'] * 1000:.1f}ms, "
+                         f"p99 {stats['p99'] * 1000:.1f}ms")
+            log.info(f"Timing summary written to {timing.directory}")
 
     log.info(f"Writing individual labels to {path_output_individual}")
     df_labels_individual.to_csv(path_output_individual)
@@ -127,7 +284,9 @@ def process_one_pand(connection_str: str,
                      columns_index: list[str],
                      columns_excluded: list[str],
                      distributions: pd.DataFrame,
-                     method: LabelEstimationMethod) -> list[dict] | None:
+                     method: LabelEstimationMethod,
+                     seed: int = 1,
+                     timing: TimingOptions = None) -> list[dict] | None:
     """Compute some of the required attributes and then estimate the energy labels for
     the Verblijfsobjecten in one Pand.
 
@@ -142,55 +301,84 @@ def process_one_pand(connection_str: str,
     :param columns_index: Column names to use as index in the dataframe.
     :param columns_excluded: Column names to exclude from the dataframe.
     :param distributions: Energy label distributions in long-form.
+    :param seed: Seed of the random numbers of the run, see :py:func:`pand_rng`.
+    :param timing: Record the duration of the stages, if provided.
     :return: A list of dictionaries which included calculated attributes in addition to
         the input attributes. Returns `None` if the Pand cannot be processed.
     """
-    pand_rows = get_pand(connection_str, table, pand_identificatie)
+    start = perf_counter()
+    timer = worker_timer(timing)
+    timer.start(pand_identificatie)
+    with timer.stage("get_pand"):
+        pand_rows = get_pand(connection_str, table, pand_identificatie)
 
     pand_df = pd.DataFrame.from_records(pand_rows,
                                         index=columns_index,
                                         exclude=columns_excluded)
     try:
-        estimate_apartement_types(pand_df)
+        process_pand(pand_df, distributions, method, seed, timer)
+        timer.finish(rows=len(pand_df))
+        return pand_df.reset_index().to_dict("records")
+    except BaseException as e:
+        log.exception(f"Could not process the Pand {pand_identificatie}:\n{e}")
+        timer.finish(rows=len(pand_df), failed=True)
+        return None
+    finally:
+        add_busy(perf_counter() - start)
+
 
-        convert_to_pre_nta8800(pand_df)
+def process_pand(pand_df: pd.DataFrame, distributions: pd.DataFrame,
+                 method: LabelEstimationMethod, seed: int = 1,
+                 timer: NullTimer = NULL_TIMER) -> None:
+    """Run the processing stages on the records of one Pand, in-place.
 
+    The records are sorted on their index, so that the random numbers are drawn in
+    the same order, regardless of the order of the input.
+
+    :param seed: Seed of the random numbers of the run, see :py:func:`pand_rng`.
+    :param timer: Records the duration of each stage.
+    """
+    pand_df.sort_index(inplace=True)
+    rng = pand_rng(seed, pand_df.index.get_level_values("pand_identificatie")[0])
+    with timer.stage("estimate_apartement_types"):
+        estimate_apartement_types(pand_df, rng)
+
+    with timer.stage("convert_to_pre_nta8800"):
+        convert_to_pre_nta8800(pand_df, rng)
+
+    with timer.stage("calculate_vormfactor"):
         calculate_vormfactor(pand_df)
 
+    with timer.stage("determine_construction_period"):
         determine_construction_period(pand_df)
 
-        estimate_labels(pand_df, distributions, method)
-
-        return pand_df.reset_index().to_dict("records")
-    except BaseException as e:
-        log.exception(f"Could not process the Pand {pand_identificatie}:\n{e}")
-        return None
+    with timer.stage("estimate_labels"):
+        estimate_labels(pand_df, distributions, method, rng)
 
 
 def estimate_labels(pand_df, distributions: pd.DataFrame,
-                    method: LabelEstimationMethod) -> None:
+                    method: LabelEstimationMethod,
+                    rng: np.random.Generator = None) -> None:
     """Estimate the energy label for each Verblijfsobject in the Pand.
 
     Adds the 'energylabel' column to the input dataframe.
     """
-    pand_df["energylabel"] = pand_df.apply(
-        lambda row: estimate_label(df=distributions,
-                                   woningtype=row["woningtype_pre_nta8800"],
-                                   bouwperiode=row["bouwperiode"],
-                                   vormfactor=row["vormfactorclass"],
-                                   random_number=random.random(),
-                                   method=LabelEstimationMethod.DISTRIBUTION),
-        axis=1
-    )
-    pand_df["energylabel_max_prob"] = pand_df.apply(
-        lambda row: estimate_label(df=distributions,
-                                   woningtype=row["woningtype_pre_nta8800"],
-                                   bouwperiode=row["bouwperiode"],
-                                   vormfactor=row["vormfactorclass"],
-                                   random_number=random.random(),
-                                   method=LabelEstimationMethod.MAX_PROBABILITY),
-        axis=1
-    )
+    rng = np.random.default_rng() if rng is None else rng
+    random_numbers = rng.random(len(pand_df))
+    rows = list(zip(pand_df["woningtype_pre_nta8800"], pand_df["bouwperiode"],
+                    pand_df["vormfactorclass"], random_numbers))
+    pand_df["energylabel"] = [
+        estimate_label(df=distributions, woningtype=woningtype, bouwperiode=bouwperiode,
+                       vormfactor=vormfactor, random_number=random_number,
+                       method=LabelEstimationMethod.DISTRIBUTION)
+        for woningtype, bouwperiode, vormfactor, random_number in rows
+    ]
+    pand_df["energylabel_max_prob"] = [
+        estimate_label(df=distributions, woningtype=woningtype, bouwperiode=bouwperiode,
+                       vormfactor=vormfactor, random_number=random_number,
+                       method=LabelEstimationMethod.MAX_PROBABILITY)
+        for woningtype, bouwperiode, vormfactor, random_number in rows
+    ]
 
 
 def determine_construction_period(pand_df):
@@ -209,7 +397,7 @@ def determine_construction_period(pand_df):
         axis=1)
 
 
-def convert_to_pre_nta8800(pand_df):
+def convert_to_pre_nta8800(pand_df, rng: np.random.Generator = None):
     """Convert the dwelling type (woningtype) to the pre-NTA8800 classification, such as
     maisonette, portiek, galerij, flat.
 
@@ -217,7 +405,7 @@ def convert_to_pre_nta8800(pand_df):
     """
     pand_df["woningtype_pre_nta8800"] = pand_df.apply(
         lambda row: WoningtypePreNTA8800.from_nta8800(
-            row["woningtype"], row["oorspronkelijkbouwjaar"]),
+            row["woningtype"], row["oorspronkelijkbouwjaar"], rng),
         axis=1
     )
 
@@ -247,7 +435,8 @@ def calculate_vormfactor(pand_df):
     )
 
 
-def estimate_apartement_types(pand_df: pd.DataFrame) -> bool:
+def estimate_apartement_types(pand_df: pd.DataFrame,
+                              rng: np.random.Generator = None) -> bool:
     """Estimate the NTA8800 apartement types based on the number of floors in the
     Pand.
 
@@ -268,7 +457,7 @@ def estimate_apartement_types(pand_df: pd.DataFrame) -> bool:
             elif vbo_positions["_position"].isnull().sum() > 0:
                 log.error(
                     f"did not determine vbo positions for all vbo in {pand_identificatie}")
-            apartment_typen = classify_apartments(vbo_positions)
+            apartment_typen = classify_apartments(vbo_positions, rng)
             try:
                 nr_apartments = sum(1 for a in apartment_typen["woningtype"] if
                                     a is not pd.NA and "appartement" in a)
@@ -287,18 +476,37 @@ def estimate_apartement_types(pand_df: pd.DataFrame) -> bool:
             return False
 
 
+# Database connections of the worker process. The connection is reused for all the
+# Pand that are processed by the worker, so that the prepared statements persist.
+_connections: dict[str, psycopg.Connection] = {}
+
+
+def get_connection(connection_str: str) -> psycopg.Connection:
+    """Get the database connection of the current process, connect if needed."""
+    conn = _connections.get(connection_str)
+    if conn is None or conn.closed:
+        conn = psycopg.connect(connection_str, autocommit=True)
+        _connections[connection_str] = conn
+    return conn
+
+
+@functools.cache
+def query_select_pand(table: str):
+    return load_sql("select_pand.sql", {"table": sql_table(table)})
+
+
 def get_pand(connection_str: str, table: str, pand_identificatie: str) -> list[dict]:
     """Get the records from the database for the given pand identificatie.
 
+    The query is executed as a server-side prepared statement on the connection of
+    the process.
+
     Returns a list of rows as a dictionaries.
     """
-    with psycopg.connect(connection_str) as conn:
-        with conn.cursor(row_factory=dict_row) as cur:
-            cur.execute(
-                f"SELECT * FROM {table} WHERE pand_identificatie = %s",
-                (pand_identificatie,)
-            )
-            return cur.fetchall()
+    conn = get_connection(connection_str)
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(query_select_pand(table), (pand_identificatie,), prepare=True)
+        return cur.fetchall()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,181 @@
+"""Progress of long runs, with metrics export
+
+Tracks the completed and failed panden and the VBO of `wijklabels-process` while the
+results come in, and reports the throughput, the failure rate, the estimated time to
+completion and the utilization of the workers at a fixed interval. The report runs in
+a background thread, so that a stall, for instance a slow database, shows up as a
+drop in the throughput instead of a silence.
+
+The metrics are also written to a file that is replaced atomically at each report,
+either in the Prometheus text format (when the file name ends with `.prom`) for the
+textfile collector of the node exporter, or as JSON.
+
+Copyright 2023 3DGI
+"""
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from pathlib import Path
+from time import monotonic, time
+from typing import Iterable, Iterator
+
+log = logging.getLogger("PROGRESS")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+METRIC_PREFIX = "wijklabels_process"
+COUNTERS = ("panden_done", "panden_failed", "vbo_done")
+
+# The busy seconds of all workers together, shared with the worker processes
+_busy = None
+
+
+def init_worker(busy):
+    """Initializer of the worker processes, with the `busy` counter of :py:class:`Progress`."""
+    global _busy
+    _busy = busy
+
+
+def add_busy(seconds: float):
+    """Add the time that the worker spent on a Pand to the busy time of the workers."""
+    if _busy is not None:
+        with _busy.get_lock():
+            _busy.value += seconds
+
+
+class Progress:
+    """The progress of processing the panden.
+
+    :param total: The number of panden that will be processed.
+    :param jobs: The number of worker processes.
+    :param interval: Seconds between the reports.
+    :param path_metrics: Write the metrics to this file at each report.
+    """
+
+    def __init__(self, total: int, jobs: int, interval: float = 60.0,
+                 path_metrics: Path = None):
+        self.total = total
+        self.jobs = jobs
+        self.interval = interval
+        self.path_metrics = path_metrics
+        self.busy = multiprocessing.Value("d", 0.0)
+        self.panden = 0
+        self.failed = 0
+        self.vbo = 0
+        self.start_timestamp = time()
+        self._start = monotonic()
+        self._previous = (self._start, 0, 0.0)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def update(self, result: list | None):
+        """Count the result of one Pand, which is None if the Pand failed."""
+        with self._lock:
+            self.panden += 1
+            if result is None:
+                self.failed += 1
+            else:
+                self.vbo += len(result)
+
+    def track(self, results: Iterable) -> Iterator:
+        """Count the results while they are passed on."""
+        for result in results:
+            self.update(result)
+            yield result
+
+    def metrics(self) -> dict:
+        """The current metrics. The throughput and the utilization are over the last
+        interval, the ETA is from the throughput over the whole run."""
+        now = monotonic()
+        with self._lock:
+            panden, failed, vbo = self.panden, self.failed, self.vbo
+        busy = self.busy.value
+        previous_time, previous_panden, previous_busy = self._previous
+        self._previous = (now, panden, busy)
+        elapsed = now - self._start
+        window = now - previous_time
+        rate = panden / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - panden
+        return {
+            "panden_expected": self.total,
+            "panden_done": panden - failed,
+            "panden_failed": failed,
+            "vbo_done": vbo,
+            "failure_rate": failed / panden if panden > 0 else 0.0,
+            "elapsed_seconds": elapsed,
+            "throughput_panden_per_second": (panden - previous_panden) / window
+            if window > 0 else 0.0,
+            "eta_seconds": remaining / rate if rate > 0 else None,
+            # The busy time is added when a Pand is done, thus it can exceed the window
+            "worker_utilization": min((busy - previous_busy) / (window * self.jobs), 1.0)
+            if window > 0 else 0.0,
+            "start_timestamp_seconds": self.start_timestamp,
+            "last_update_timestamp_seconds": time(),
+        }
+
+    def report(self) -> dict:
+        """Log the progress and write the metrics file."""
+        m = self.metrics()
+        panden = m["panden_done"] + m["panden_failed"]
+        eta = "unknown" if m["eta_seconds"] is None else \
+            f"{m['eta_seconds'] / 60:.0f} min"
+        log.info(f"{panden}/{self.total} panden ({panden / max(self.total, 1):.1%}), "
+                 f"{m['panden_failed']} failed ({m['failure_rate']:.2%}), "
+                 f"{m['vbo_done']} VBO, "
+                 f"{m['throughput_panden_per_second']:.1f} panden/s, "
+                 f"workers {m['worker_utilization']:.0%} busy, ETA {eta}")
+        if self.path_metrics is not None:
+            write_metrics(m, self.path_metrics)
+        return m
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.report()
+            except Exception as e:
+                log.warning(f"Could not report the progress: {e}")
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        self.report()
+
+
+def format_prometheus(metrics: dict) -> str:
+    """Format the metrics in the Prometheus text exposition format."""
+    lines = []
+    for name, value in metrics.items():
+        if value is None:
+            continue
+        if name in COUNTERS:
+            metric, kind = f"{METRIC_PREFIX}_{name}_total", "counter"
+        else:
+            metric, kind = f"{METRIC_PREFIX}_{name}", "gauge"
+        lines.append(f"# TYPE {metric} {kind}")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(metrics: dict, path: Path):
+    """Write the metrics atomically, in the Prometheus text format if the file name
+    ends with `.prom`, otherwise as JSON."""
+    path = Path(path)
+    if path.suffix == ".prom":
+        text = format_prometheus(metrics)
+    else:
+        text = json.dumps(metrics, indent=2)
+    path_tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    path_tmp.write_text(text)
+    os.replace(path_tmp, path)
@@ -1,12 +1,31 @@
+import itertools
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 
+import matplotlib
 import numpy as np
 import pandas as pd
 from matplotlib import ticker as mtick, pyplot as plt
+from matplotlib.figure import Figure
 
 from wijklabels import AggregateUnit
+from wijklabels.aggregate import (aggregate_column_name, attach_units, label_shares,
+                                  distance_stats)
+from wijklabels.digest import digest_parts, is_unchanged, record
 from wijklabels.labels import EnergyLabel
 
+# Logger for the plotting messages
+log = logging.getLogger("REPORT")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
 COLORS = {"#1a9641": EnergyLabel.APPPP,
           "#52b151": EnergyLabel.APPP,
           "#8acc62": EnergyLabel.APP,
@@ -24,44 +43,17 @@ COLORS = {"#1a9641": EnergyLabel.APPPP,
 def calculate_distance_stats_for_area(validated: pd.DataFrame,
                                       aggregate_level: AggregateUnit,
                                       distance_column: str):
-    aggregate_id_column = aggregate_column_name(aggregate_level)
-    for aggregate_id in validated[aggregate_id_column].unique():
-        yield {
-            "unit": str(aggregate_level),
-            "unit_code": aggregate_id,
-            "woning_count": len(validated.loc[((validated[distance_column].notnull()) & (
-                        validated[aggregate_id_column] == aggregate_id)), :]),
-            "afwijking_median": validated.loc[
-                validated[aggregate_id_column] == aggregate_id, [
-                    distance_column]].median().values[0],
-            "afwijking_mean": validated.loc[
-                validated[aggregate_id_column] == aggregate_id, [
-                    distance_column]].mean().values[0],
-            "afwijking_std": validated.loc[
-                validated[aggregate_id_column] == aggregate_id, [
-                    distance_column]].std().values[0],
-            "afwijking_min": validated.loc[
-                validated[aggregate_id_column] == aggregate_id, [
-                    distance_column]].min().values[0],
-            "afwijking_max": validated.loc[
-                validated[aggregate_id_column] == aggregate_id, [
-                    distance_column]].max().values[0]
-        }
+    stats = distance_stats(validated, distance_column, (aggregate_level,))
+    yield from stats.reset_index()[
+        ["unit", "unit_code", "woning_count", "afwijking_median", "afwijking_mean",
+         "afwijking_std", "afwijking_min", "afwijking_max"]
+    ].to_dict("records")
 
 
 def aggregate_to_unit(validated: pd.DataFrame, energylabel_col: str,
                       aggregate_level: AggregateUnit) -> pd.DataFrame:
-    aggregate_id_column = aggregate_column_name(aggregate_level)
-    for aggregate_id in validated[aggregate_id_column].unique():
-        df_unit = validated.loc[((validated[energylabel_col].notnull()) & (validated[aggregate_id_column] == aggregate_id)), :]
-        cnt = len(df_unit)
-        dist = df_unit[energylabel_col].value_counts() / cnt
-        for label in EnergyLabel:
-            if label not in dist:
-                dist.loc[label] = np.nan
-        label_distribution = dist.sort_index(ascending=False).to_dict()
-        label_distribution["unit_code"] = aggregate_id
-        yield label_distribution
+    shares = label_shares(validated, energylabel_col, (aggregate_level,))
+    yield from shares.reset_index().to_dict("records")
 
 
 def plot_buurts(dir_plots: str, df: pd.DataFrame):
@@ -99,121 +91,219 @@ def plot_buurt(df: pd.DataFrame, buurt: str):
     return ax
 
 
+LABELS_PLOT_ORDER = [EnergyLabel.APPPP, EnergyLabel.APPP, EnergyLabel.APP,
+                     EnergyLabel.AP, EnergyLabel.A, EnergyLabel.B, EnergyLabel.C,
+                     EnergyLabel.D, EnergyLabel.E, EnergyLabel.F, EnergyLabel.G]
+PLOT_STYLE = 'seaborn-v0_8-muted'
+# Part of the digest of each plot. Increment it when the plots change, so that they
+# are regenerated.
+PLOT_VERSION = 1
+
+
+@dataclass
+class UnitPlot:
+    """The precomputed data for the plots of a single unit."""
+    aggregate_id: str
+    title: str
+    path: str
+    outputs: list[str]
+    shares: pd.DataFrame
+    distances: list[tuple[EnergyLabel, np.ndarray]] = None
+
+    def digest(self) -> str:
+        """The digest of the data that the plots are generated from."""
+        distances = itertools.chain.from_iterable(self.distances or [])
+        return digest_parts(PLOT_VERSION, self.title, self.outputs, self.shares,
+                            *distances)
+
+
 def plot_aggregate(validated: pd.DataFrame, dir_plots: Path,
-                    aggregate_level: AggregateUnit, column_energylabel="energylabel"):
-    """Plot the aggregated labels on the provided level."""
+                   aggregate_level: AggregateUnit, column_energylabel="energylabel",
+                   jobs: int = 1, force: bool = False):
+    """Plot the aggregated labels on the provided level.
+
+    :param jobs: The number of processes that render the plots.
+    :param force: Regenerate the plots of the units that have not changed.
+    """
     dir_plots.mkdir(exist_ok=True)
+    validated = attach_units(validated, (aggregate_level,))
     aggregate_id_column = aggregate_column_name(aggregate_level)
-    plt.style.use('seaborn-v0_8-muted')
-    for aggregate_id in validated[aggregate_id_column].unique():
-        # Plot both distributions side by side
-        b = validated.loc[
-            validated[aggregate_id_column] == aggregate_id,
-            [column_energylabel, ]
-        ]
-        estimated = b[column_energylabel].value_counts() / len(b) * 100
-        b_df = pd.DataFrame({"estimated": estimated},
-                            index=[EnergyLabel.APPPP, EnergyLabel.APPP, EnergyLabel.APP,
-                                   EnergyLabel.AP, EnergyLabel.A, EnergyLabel.B,
-                                   EnergyLabel.C, EnergyLabel.D,
-                                   EnergyLabel.E, EnergyLabel.F, EnergyLabel.G])
-        ax = b_df.plot(kind="bar",
-                       rot=0,
-                       color={"estimated": COLORS},
-                       xlabel="",
-                       zorder=3)
-        ax.yaxis.set_major_formatter(mtick.PercentFormatter(xmax=100, decimals=0))
-        ax.set_yticks([10, 20, 30, 40, 50, 60, 70, 80])
-        ax.get_legend().remove()
-        plt.style.use('seaborn-v0_8-muted')
-        plt.grid(visible=True, which="major", axis="y", zorder=0)
-        plt.title(f"{aggregate_id_column.title()}: {aggregate_id}\nNr. woningen: {len(b)}", fontsize=10)
-        plt.suptitle("Spreiding van energielabels", fontsize=14)
-        plt.tight_layout()
-        filename = ''.join(e for e in aggregate_id if e.isalnum())
-        plt.savefig(f"{dir_plots}/{aggregate_level}_{filename}_estimated.png")
-        plt.close()
+
+    def _units():
+        grouped = validated.groupby(aggregate_id_column, sort=False)[column_energylabel]
+        for aggregate_id, labels in grouped:
+            estimated = labels.value_counts() / len(labels) * 100
+            filename = ''.join(e for e in aggregate_id if e.isalnum())
+            path = f"{dir_plots}/{aggregate_level}_{filename}_estimated.png"
+            yield UnitPlot(
+                aggregate_id=aggregate_id,
+                title=f"{aggregate_id_column.title()}: {aggregate_id}\nNr. woningen: {len(labels)}",
+                path=path,
+                outputs=[path],
+                shares=pd.DataFrame({"estimated": estimated}, index=LABELS_PLOT_ORDER))
+
+    render_units(render_aggregate, _units(), jobs, force)
 
 
 def plot_comparison(validated: pd.DataFrame, dir_plots: Path,
-                    aggregate_level: AggregateUnit, woningtype=None):
-    # Compare estimated to groundtruth in plots
+                    aggregate_level: AggregateUnit, woningtype=None, jobs: int = 1,
+                    force: bool = False):
+    """Compare the estimated labels to the EP-Online labels in plots, for each unit on
+    the provided level.
+
+    :param jobs: The number of processes that render the plots.
+    :param force: Regenerate the plots of the units that have not changed.
+    """
     dir_plots.mkdir(exist_ok=True)
+    validated = attach_units(validated, (aggregate_level,))
     aggregate_id_column = aggregate_column_name(aggregate_level)
-    plt.style.use('seaborn-v0_8-muted')
     woningtype_subtitle = "Alle woningtypen" if woningtype is None else f"{woningtype.capitalize()} woningtypen"
-    for aggregate_id in validated[aggregate_id_column].unique():
-        # Plot both distributions side by side
-        b = validated.loc[
-            validated[aggregate_id_column] == aggregate_id,
-            ["energylabel", "energylabel_ep_online"]
-        ]
-        estimated = b["energylabel"].value_counts() / len(b) * 100
-        truth = b["energylabel_ep_online"].value_counts() / len(b) * 100
-        b_df = pd.DataFrame({"ep-online": truth, "geschat": estimated},
-                            index=[EnergyLabel.APPPP, EnergyLabel.APPP, EnergyLabel.APP,
-                                   EnergyLabel.AP, EnergyLabel.A, EnergyLabel.B,
-                                   EnergyLabel.C, EnergyLabel.D,
-                                   EnergyLabel.E, EnergyLabel.F, EnergyLabel.G])
-        ax = b_df.plot(kind="bar",
-                       rot=0,
-                       xlabel="",
-                       zorder=3)
-        ax.yaxis.set_major_formatter(mtick.PercentFormatter(xmax=100, decimals=0))
-        ax.set_yticks([10, 20, 30, 40, 50, 60, 70, 80])
-        plt.style.use('seaborn-v0_8-muted')
-        plt.grid(visible=True, which="major", axis="y", zorder=0)
-        plt.title(f"{woningtype_subtitle}\n{aggregate_id_column.title()}: {aggregate_id}\nNr. woningen: {len(b)}", fontsize=10)
-        plt.suptitle(f"Spreiding van energielabels", fontsize=14)
-        plt.tight_layout()
-        filename = ''.join(e for e in aggregate_id if e.isalnum())
-        plt.savefig(f"{dir_plots}/{aggregate_level}_{filename}.png")
-        plt.close()
-
-        # Plot distances
-        def _plot_dist(grouped, t):
-            fig, ax = plt.subplots(figsize=(8, 6))
-            boxplot = ax.boxplot(x=[group.values for name, group in grouped],
-                                 labels=grouped.groups.keys(),
-                                 patch_artist=True,
-                                 medianprops={'color': 'black'},
-                                 zorder=3)
-            ax.set_xticks(ticks=range(11, 0, -1), labels=list(reversed(EnergyLabel)))
-            ax.set_xlim(12, 0)
-            if t == "_ep_est":
-                ax.set_xlabel("Energielabel in EP-Online")
-                ax.set_ylabel("Afwijking geschat energielabel")
-            else:
-                ax.set_xlabel("Geschat energielabel")
-                ax.set_ylabel("Afwijking EP-Online")
-            ax.set_yticks(range(-10, 11, 1))
-            # Assign colors to each box in the boxplot
-            for box, color in zip(boxplot['boxes'], reversed(COLORS)):
-                box.set_facecolor(color)
-            plt.axhline(y=0.0, color='#154273', linestyle='-')
-            plt.grid(visible=True, which="major", axis="y", zorder=0)
-            plt.title(f"{woningtype_subtitle}\n{aggregate_id_column.title()}: {aggregate_id}\nNr. woningen: {len(b)}", fontsize=10)
-            plt.suptitle(f"Afwijking van de geschatte labels van de EP-Online labels", fontsize=14)
-            plt.tight_layout()
-            plt.savefig(f"{dir_plots}/{aggregate_level}_{filename}_dist{t}.png")
-            plt.close()
-
-        grouped_est_ep = validated.loc[
-            validated[aggregate_id_column] == aggregate_id,
-            ["energylabel", "energylabel_dist_est_ep"]
-        ].groupby("energylabel")["energylabel_dist_est_ep"]
-        _plot_dist(grouped_est_ep, "_est_ep")
-
-
-def aggregate_column_name(aggregate_level):
-    if aggregate_level == AggregateUnit.BUURT:
-        aggregate_id_column = "buurtcode"
-    elif aggregate_level == AggregateUnit.WIJK:
-        aggregate_id_column = "wijkcode"
-    elif aggregate_level == AggregateUnit.GEMEENTE:
-        aggregate_id_column = "gemeentecode"
-    elif aggregate_level == AggregateUnit.NL:
-        aggregate_id_column = "landcode"
+
+    def _units():
+        grouped = validated.groupby(aggregate_id_column, sort=False)[
+            ["energylabel", "energylabel_ep_online", "energylabel_dist_est_ep"]]
+        for aggregate_id, b in grouped:
+            estimated = b["energylabel"].value_counts() / len(b) * 100
+            truth = b["energylabel_ep_online"].value_counts() / len(b) * 100
+            distances = [(label, group.to_numpy(dtype=float)) for label, group in
+                         b.groupby("energylabel")["energylabel_dist_est_ep"]]
+            filename = ''.join(e for e in aggregate_id if e.isalnum())
+            path = f"{dir_plots}/{aggregate_level}_{filename}"
+            yield UnitPlot(
+                aggregate_id=aggregate_id,
+                title=f"{woningtype_subtitle}\n{aggregate_id_column.title()}: {aggregate_id}\nNr. woningen: {len(b)}",
+                path=path,
+                outputs=[f"{path}.png", f"{path}_dist_est_ep.png"],
+                shares=pd.DataFrame({"ep-online": truth, "geschat": estimated},
+                                    index=LABELS_PLOT_ORDER),
+                distances=distances)
+
+    render_units(render_comparison, _units(), jobs, force)
+
+
+def render_units(render, units, jobs: int = 1, force: bool = False):
+    """Render the plots of the units, either in this process or fanned out over a pool
+    of `jobs` processes. Each process reuses its figures for all of its units.
+
+    The units whose plots were already generated from the same data are skipped,
+    unless `force` is set. The digest of the data is recorded next to the plots.
+
+    :param render: The function that renders a :py:class:`UnitPlot`.
+    :param units: An iterable of :py:class:`UnitPlot`.
+    """
+    changed = []
+    nr_skipped = 0
+    for unit in units:
+        digest = unit.digest()
+        if not force and is_unchanged(unit.outputs, digest):
+            nr_skipped += 1
+        else:
+            changed.append((unit, digest))
+    if nr_skipped > 0:
+        log.info(f"Skipping {nr_skipped} units with unchanged plots")
+    nr_units = len(changed)
+    if nr_units == 0:
+        return
+    units = [unit for unit, digest in changed]
+    log_every = max(1, nr_units // 20)
+    time_start = time.perf_counter()
+    if jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=init_renderer)
+        chunksize = max(1, min(64, nr_units // (jobs * 4)))
+        rendered = executor.map(render, units, chunksize=chunksize)
     else:
-        raise ValueError(f"Unknown aggregate level: {aggregate_level}")
-    return aggregate_id_column
\ No newline at end of file
+        executor = None
+        init_renderer(use_agg=False)
+        rendered = map(render, units)
+    try:
+        for i, (aggregate_id, (unit, digest)) in enumerate(zip(rendered, changed),
+                                                           start=1):
+            record(unit.outputs, digest)
+            if i % log_every == 0 or i == nr_units:
+                elapsed = time.perf_counter() - time_start
+                log.info(f"Rendered the plots of {i}/{nr_units} units "
+                         f"({round(i / elapsed, 1)} units/s)")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+_figures = {}
+
+
+def init_renderer(use_agg: bool = True):
+    """Prepare a process for rendering the plots."""
+    if use_agg:
+        matplotlib.use("Agg")
+    plt.style.use(PLOT_STYLE)
+
+
+def _figure(name: str, figsize=None) -> tuple[Figure, plt.Axes]:
+    """Return the figure of this process with the given name, with its axes cleared.
+    The figures are created on the first use and reused afterwards."""
+    if name not in _figures:
+        fig = Figure(figsize=figsize)
+        _figures[name] = (fig, fig.add_subplot())
+    fig, ax = _figures[name]
+    ax.clear()
+    fig.suptitle("")
+    return fig, ax
+
+
+def render_aggregate(unit: UnitPlot) -> str:
+    fig, ax = _figure("aggregate")
+    unit.shares.plot(kind="bar",
+                     ax=ax,
+                     rot=0,
+                     color={"estimated": COLORS},
+                     xlabel="",
+                     legend=False,
+                     zorder=3)
+    ax.yaxis.set_major_formatter(mtick.PercentFormatter(xmax=100, decimals=0))
+    ax.set_yticks([10, 20, 30, 40, 50, 60, 70, 80])
+    ax.grid(visible=True, which="major", axis="y", zorder=0)
+    ax.set_title(unit.title, fontsize=10)
+    fig.suptitle("Spreiding van energielabels", fontsize=14)
+    fig.tight_layout()
+    fig.savefig(unit.path)
+    return unit.aggregate_id
+
+
+def render_comparison(unit: UnitPlot) -> str:
+    fig, ax = _figure("comparison")
+    unit.shares.plot(kind="bar",
+                     ax=ax,
+                     rot=0,
+                     xlabel="",
+                     zorder=3)
+    ax.yaxis.set_major_formatter(mtick.PercentFormatter(xmax=100, decimals=0))
+    ax.set_yticks([10, 20, 30, 40, 50, 60, 70, 80])
+    ax.grid(visible=True, which="major", axis="y", zorder=0)
+    ax.set_title(unit.title, fontsize=10)
+    fig.suptitle(f"Spreiding van energielabels", fontsize=14)
+    fig.tight_layout()
+    fig.savefig(f"{unit.path}.png")
+
+    # Plot distances
+    fig, ax = _figure("distances", figsize=(8, 6))
+    boxplot = ax.boxplot(x=[values for label, values in unit.distances],
+                         labels=[label for label, values in unit.distances],
+                         patch_artist=True,
+                         medianprops={'color': 'black'},
+                         zorder=3)
+    ax.set_xticks(ticks=range(11, 0, -1), labels=list(reversed(EnergyLabel)))
+    ax.set_xlim(12, 0)
+    ax.set_xlabel("Geschat energielabel")
+    ax.set_ylabel("Afwijking EP-Online")
+    ax.set_yticks(range(-10, 11, 1))
+    # Assign colors to each box in the boxplot
+    for box, color in zip(boxplot['boxes'], reversed(COLORS)):
+        box.set_facecolor(color)
+    ax.axhline(y=0.0, color='#154273', linestyle='-')
+    ax.grid(visible=True, which="major", axis="y", zorder=0)
+    ax.set_title(unit.title, fontsize=10)
+    fig.suptitle(f"Afwijking van de geschatte labels van de EP-Online labels",
+                 fontsize=14)
+    fig.tight_layout()
+    fig.savefig(f"{unit.path}_dist_est_ep.png")
+    return unit.aggregate_id
@@ -0,0 +1,104 @@
+"""Scheduling of the panden over the worker processes
+
+The processing time of a Pand grows with its number of verblijfsobjecten, and a few
+large apartment buildings take as long as thousands of single houses. The panden are
+dispatched in batches, to reduce the overhead of sending each Pand to a worker, and
+the most expensive panden are dispatched first, so that no worker is still busy with
+a large Pand at the end of the run while the others are idle.
+
+The cost of a Pand is estimated from its number of verblijfsobjecten. The size of
+the batches adapts to the observed throughput of the workers, so that each batch
+takes about `target_seconds`, and the batches shrink towards the end of the run, so
+that the remaining work is divided evenly over the workers (guided self-scheduling).
+
+Copyright 2023 3DGI
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+# The cost of a Pand without verblijfsobjecten, relative to the cost per
+# verblijfsobject, which is mainly the database query
+PAND_OVERHEAD = 1.0
+# The cost of the first batches, before the throughput is known
+INITIAL_BATCH_COST = 20.0
+# The weight of the last batch in the estimate of the throughput
+THROUGHPUT_SMOOTHING = 0.2
+# The remaining work is divided into at least this many batches per worker
+TAIL_BATCHES_PER_WORKER = 4
+
+
+def pand_cost(vbo_count: np.ndarray) -> np.ndarray:
+    """The estimated processing cost of the panden, from their number of
+    verblijfsobjecten."""
+    return PAND_OVERHEAD + np.asarray(vbo_count, dtype=float)
+
+
+@dataclass
+class Batch:
+    pand_identificatie: np.ndarray
+    cost: float
+
+
+class BatchScheduler:
+    """Divides the panden into batches, from the most to the least expensive Pand.
+
+    :param pand_identificatie: The IDs of the panden.
+    :param cost: The estimated cost of each Pand, see :py:func:`pand_cost`.
+    :param jobs: The number of worker processes.
+    :param target_seconds: The duration of a batch that the batch size adapts to.
+    """
+
+    def __init__(self, pand_identificatie: np.ndarray, cost: np.ndarray, jobs: int,
+                 target_seconds: float = 2.0):
+        order = np.argsort(-np.asarray(cost, dtype=float), kind="stable")
+        self.pand_identificatie = np.asarray(pand_identificatie)[order]
+        self.cumulative_cost = np.cumsum(np.asarray(cost, dtype=float)[order])
+        self.total_cost = float(self.cumulative_cost[-1]) if len(order) > 0 else 0.0
+        self.jobs = jobs
+        self.target_seconds = target_seconds
+        self.position = 0
+        # Cost per second of one worker
+        self.throughput = None
+
+    def __len__(self):
+        """The number of panden that are not dispatched yet."""
+        return len(self.pand_identificatie) - self.position
+
+    @property
+    def remaining_cost(self) -> float:
+        done = self.cumulative_cost[self.position - 1] if self.position > 0 else 0.0
+        return self.total_cost - done
+
+    def observe(self, cost: float, seconds: float):
+        """Update the throughput with the duration of a batch in a worker."""
+        if seconds <= 0:
+            return
+        throughput = cost / seconds
+        if self.throughput is None:
+            self.throughput = throughput
+        else:
+            self.throughput = (THROUGHPUT_SMOOTHING * throughput
+                               + (1 - THROUGHPUT_SMOOTHING) * self.throughput)
+
+    def batch_cost(self) -> float:
+        """The cost of the next batch."""
+        if self.throughput is None:
+            cost = INITIAL_BATCH_COST
+        else:
+            cost = self.throughput * self.target_seconds
+        return min(cost, self.remaining_cost / (self.jobs * TAIL_BATCHES_PER_WORKER))
+
+    def next_batch(self) -> Batch | None:
+        """The next batch, which has at least one Pand, or None if all panden are
+        dispatched."""
+        if len(self) == 0:
+            return None
+        start = self.position
+        done = self.cumulative_cost[start - 1] if start > 0 else 0.0
+        end = int(np.searchsorted(self.cumulative_cost, done + self.batch_cost(),
+                                  side="right"))
+        end = min(max(end, start + 1), len(self.pand_identificatie))
+        self.position = end
+        return Batch(pand_identificatie=self.pand_identificatie[start:end],
+                     cost=float(self.cumulative_cost[end - 1] - done))
@@ -0,0 +1,406 @@
+"""Work-stealing shard queue for processing on several machines
+
+A national run is split into shards, which are ranges of Pand IDs or of buurtcodes
+with about the same number of panden. The coordinator registers the shards in a
+queue table in the input database (`wijklabels-shards init`). Then any number of
+worker nodes (`wijklabels-shards work`) claim the shards one by one with
+`SELECT ... FOR UPDATE SKIP LOCKED`, so that no two nodes claim the same shard and a
+node never waits for another. A node processes the panden of its shard over its own
+pool of processes, writes the labels of the shard to
+`labels_individual-<run>-<shard>.csv` and their mergeable summaries to the
+`summaries/<run>` directory (see :py:mod:`wijklabels.merge`) in the output directory
+and marks the shard as done. The run ID is assigned when the queue is initialised,
+so the outputs of a queue that is reset are not mixed with those of the previous
+queue. `wijklabels-shards merge` merges the outputs of the shards that are done.
+
+A node holds a lease on its shard, which it renews while it is processing the shard.
+When a node is lost, its lease expires and the shard is claimed again by another
+node, up to `--max-attempts` times. Because the random numbers of each Pand are
+derived from the seed and the Pand ID, a shard that is processed twice gives the
+same labels. Nodes can be added at any time during the run.
+
+Copyright 2023 3DGI
+"""
+import argparse
+import logging
+import os
+import socket
+import threading
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from time import sleep
+
+import numpy as np
+import pandas as pd
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+
+from wijklabels import LabelEstimationMethod
+from wijklabels.identificatie import encode_reversible, decode_one, PREFIX_PAND
+from wijklabels.load import load_sql, sql_table
+from wijklabels.merge import write_summary, individual_path, replace_atomic, \
+    merge_outputs
+from wijklabels.process import check_input_table, load_distributions, \
+    process_panden, read_pand_identificatie
+
+log = logging.getLogger("SHARDS")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+SHARD_BY = ("pand", "buurt")
+QUERY_PANDEN = {
+    "pand": "select_pand_identificatie_range.sql",
+    "buurt": "select_pand_identificatie_buurt_range.sql",
+}
+
+
+def split_ranges(keys: np.ndarray, counts: np.ndarray,
+                 shard_size: int) -> list[tuple[int, int, int]]:
+    """Split the sorted keys into contiguous ranges of about `shard_size` panden. A key
+    is never split over two ranges, so a key with more than `shard_size` panden is a
+    range on its own.
+
+    :param keys: The sorted keys.
+    :param counts: The number of panden of each key.
+    :returns: The ranges, as the position of the first and the last key, and the
+        number of panden.
+    """
+    if len(keys) == 0:
+        return []
+    counts = np.asarray(counts, dtype=np.int64)
+    before = np.cumsum(counts) - counts
+    shard = before // shard_size
+    starts = np.flatnonzero(np.r_[True, shard[1:] != shard[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    sizes = np.add.reduceat(counts, starts)
+    return list(zip(starts.tolist(), ends.tolist(), sizes.tolist()))
+
+
+def list_shards(connection_string: str, table: str, shard_by: str,
+                shard_size: int) -> list[tuple[str, str, int]]:
+    """Divide the panden of the input table into shards.
+
+    :returns: The shards, as the first and the last key of the range, and the number
+        of panden.
+    """
+    with psycopg.connect(connection_string) as conn:
+        if shard_by == "pand":
+            query = load_sql("select_pand_identificatie.sql", {"table": sql_table(table)})
+            keys = np.sort(np.fromiter((encode_reversible(r[0], PREFIX_PAND)
+                                        for r in conn.execute(query)),
+                                       dtype=np.int64))
+            ranges = split_ranges(keys, np.ones(len(keys), dtype=np.int64), shard_size)
+            return [(decode_one(int(keys[first]), PREFIX_PAND),
+                     decode_one(int(keys[last]), PREFIX_PAND), nr_pand)
+                    for first, last, nr_pand in ranges]
+        elif shard_by == "buurt":
+            query = load_sql("count_pand_per_buurt.sql", {"table": sql_table(table)})
+            rows = conn.execute(query).fetchall()
+            keys = np.array([r[0] for r in rows], dtype=object)
+            ranges = split_ranges(keys, np.array([r[1] for r in rows]), shard_size)
+            return [(keys[first], keys[last], nr_pand) for first, last, nr_pand in ranges]
+        else:
+            raise ValueError(f"Unknown shard key {shard_by}, must be one of {SHARD_BY}")
+
+
+def init_queue(connection_string: str, table: str, queue: str, shard_by: str = "pand",
+               shard_size: int = 10_000, reset: bool = False) -> int:
+    """Create the queue table and register the shards of the input table.
+
+    :param reset: Replace the queue table if it exists, otherwise an existing queue is
+        an error, because its shards could be in progress.
+    :returns: The number of shards.
+    """
+    shards = list_shards(connection_string, table, shard_by, shard_size)
+    run_id = datetime.now().strftime("%Y%m%dT%H%M%S")
+    with psycopg.connect(connection_string) as conn:
+        if reset:
+            conn.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(
+                sql_table(queue)))
+        conn.execute(load_sql("create_shard_queue.sql", {"queue": sql_table(queue)}))
+        if conn.execute(sql.SQL("SELECT count(*) FROM {}").format(
+                sql_table(queue))).fetchone()[0] > 0:
+            raise ValueError(f"The queue {queue} already has shards, use --reset to "
+                             f"replace them")
+        with conn.cursor() as cur:
+            cur.executemany(
+                load_sql("insert_shard.sql", {"queue": sql_table(queue)}),
+                [(shard_id, run_id, shard_by, first, last, nr_pand)
+                 for shard_id, (first, last, nr_pand) in enumerate(shards)])
+    return len(shards)
+
+
+class ShardQueue:
+    """The shard queue of a worker node.
+
+    :param connection_string: PostgreSQL connection string.
+    :param queue: The name of the queue table.
+    :param lease: Seconds that a shard is held by the worker without renewing the
+        lease.
+    :param max_attempts: A shard is not claimed again after this many attempts.
+    """
+
+    def __init__(self, connection_string: str, queue: str, lease: float = 900,
+                 max_attempts: int = 3):
+        self.connection_string = connection_string
+        self.queue = sql_table(queue)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+
+    def _execute(self, filename: str, params: dict, fetch: bool = False):
+        with psycopg.connect(self.connection_string, autocommit=True) as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(load_sql(filename, {"queue": self.queue}),
+                            {"worker": self.worker, "lease": self.lease, **params})
+                return cur.fetchall() if fetch else cur.rowcount
+
+    def claim(self) -> dict | None:
+        """Claim the next shard, or None if there is no shard to claim."""
+        rows = self._execute("claim_shard.sql", {"max_attempts": self.max_attempts},
+                             fetch=True)
+        return rows[0] if len(rows) > 0 else None
+
+    def renew(self, shard_id: int) -> bool:
+        """Renew the lease, returns False if the shard is not held anymore."""
+        return self._execute("renew_shard_lease.sql", {"shard_id": shard_id}) == 1
+
+    def complete(self, shard_id: int, output: Path, nr_done: int, nr_failed: int) -> bool:
+        """Mark the shard as done, returns False if the shard is not held anymore."""
+        return self._execute("complete_shard.sql", {
+            "shard_id": shard_id, "output": str(output), "nr_done": nr_done,
+            "nr_failed": nr_failed}) == 1
+
+    def release(self, shard_id: int, error: str):
+        """Put the shard back in the queue, after the worker failed to process it."""
+        self._execute("release_shard.sql", {"shard_id": shard_id, "error": error})
+
+    def status(self) -> pd.DataFrame:
+        with psycopg.connect(self.connection_string) as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(load_sql("select_shard_status.sql", {"queue": self.queue}))
+                return pd.DataFrame(cur.fetchall())
+
+    def in_progress(self) -> bool:
+        """There are shards that are claimed by other workers with a valid lease, which
+        can still be re-queued."""
+        status = self.status()
+        if status.empty:
+            return False
+        return bool(((status["status"] == "claimed") & ~status["expired"]).any())
+
+
+class Lease:
+    """Renews the lease on a shard in a background thread, while the shard is
+    processed."""
+
+    def __init__(self, queue: ShardQueue, shard_id: int):
+        self.queue = queue
+        self.shard_id = shard_id
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.queue.lease / 3):
+            try:
+                if not self.queue.renew(self.shard_id):
+                    self.lost = True
+                    log.warning(f"Lost the lease on shard {self.shard_id}")
+            except Exception as e:
+                log.warning(f"Could not renew the lease on shard {self.shard_id}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def shard_panden(connection_string: str, table: str,
+                 shard: dict) -> tuple[np.ndarray, np.ndarray]:
+    """The IDs of the panden in the shard, encoded as int64, and their number of
+    records."""
+    query = load_sql(QUERY_PANDEN[shard["shard_by"]], {"table": sql_table(table)})
+    with psycopg.connect(connection_string) as conn:
+        cur = conn.execute(query, {"first_key": shard["first_key"],
+                                   "last_key": shard["last_key"]})
+        return read_pand_identificatie(cur)
+
+
+def work(queue: ShardQueue, table: str, path_output_dir: Path,
+         distributions: pd.DataFrame, method: LabelEstimationMethod, seed: int,
+         jobs: int, poll_interval: float = 30, **kwargs) -> int:
+    """Claim and process shards until all shards are done.
+
+    When there is no shard to claim but other workers are still processing shards,
+    the worker waits for their leases to expire, so that it takes over the shards of
+    lost workers.
+
+    :param kwargs: Passed on to :py:func:`wijklabels.process.process_panden`.
+    :returns: The number of shards that this worker completed.
+    """
+    completed = 0
+    while True:
+        shard = queue.claim()
+        if shard is None:
+            if queue.in_progress():
+                sleep(poll_interval)
+                continue
+            break
+        shard_id = shard["shard_id"]
+        log.info(f"Processing shard {shard_id} ({shard['first_key']} - "
+                 f"{shard['last_key']}, {shard['nr_pand']} panden, attempt "
+                 f"{shard['attempts']})")
+        try:
+            with Lease(queue, shard_id) as lease:
+                pand_identificatie_all, vbo_count = shard_panden(
+                    queue.connection_string, table, shard)
+                df = process_panden(queue.connection_string, table,
+                                    pand_identificatie_all, distributions, method,
+                                    seed, jobs, vbo_count=vbo_count, **kwargs)
+                path_output = individual_path(path_output_dir, shard["run_id"],
+                                              shard_id)
+                replace_atomic(path_output, df.to_csv)
+                if len(df) > 0:
+                    write_summary(df, path_output_dir, shard["run_id"], shard_id)
+        except Exception as e:
+            log.exception(f"Could not process shard {shard_id}")
+            queue.release(shard_id, repr(e))
+            continue
+        nr_done = df.index.get_level_values("pand_identificatie").nunique() \
+            if len(df) > 0 else 0
+        if lease.lost or not queue.complete(shard_id, path_output, nr_done,
+                                            len(pand_identificatie_all) - nr_done):
+            # The output is the same, because the random numbers are derived from the
+            # Pand IDs, so it does not matter which worker wrote it
+            log.warning(f"Shard {shard_id} was taken over by another worker")
+            continue
+        completed += 1
+        log.info(f"Completed shard {shard_id}, {nr_done} panden")
+    return completed
+
+
+def merge_queue(queue: ShardQueue, path_output_dir: Path, individual: bool = False):
+    """Merge the outputs of the shards that are done in the queue, see
+    :py:func:`wijklabels.merge.merge_outputs`."""
+    status = queue.status()
+    if status.empty:
+        raise ValueError("The queue is empty")
+    done = status.loc[status["status"] == "done"]
+    if len(done) < len(status):
+        log.warning(f"{len(status) - len(done)} of {len(status)} shards are not done, "
+                    f"their panden are not in the merged output")
+    # The shards without labels do not have summaries
+    shard_ids = done.loc[done["nr_done"] > 0, "shard_id"].tolist()
+    merge_outputs(path_output_dir, status["run_id"].iloc[0], shard_ids, individual)
+
+
+def log_status(status: pd.DataFrame, max_attempts: int):
+    if status.empty:
+        log.info("The queue is empty")
+        return
+    failed = (status["status"] != "done") & (status["attempts"] >= max_attempts) & \
+        ((status["status"] == "queued") | status["expired"])
+    counts = Counter(status.loc[~failed, "status"])
+    counts["failed"] = int(failed.sum())
+    done = status["status"] == "done"
+    log.info(f"{len(status)} shards: " + ", ".join(
+        f"{n} {s}" for s, n in counts.items()) +
+             f"; {int(status.loc[done, 'nr_done'].sum())} of "
+             f"{int(status['nr_pand'].sum())} panden done")
+    for row in status.loc[failed].itertuples():
+        log.warning(f"Shard {row.shard_id} failed after {row.attempts} attempts: "
+                    f"{row.error}")
+
+
+parser_database = argparse.ArgumentParser(add_help=False)
+parser_database.add_argument('dbname')
+parser_database.add_argument('user')
+parser_database.add_argument('password')
+parser_database.add_argument('--host', default='localhost')
+parser_database.add_argument('--port', type=int, default=5432)
+parser_database.add_argument('--table', default='wijklabels.input',
+                             help="The input table")
+parser_database.add_argument('--queue', default='wijklabels.shard_queue',
+                             help="The queue table")
+parser_database.add_argument('--max-attempts', type=int, default=3,
+                             help="A shard is not claimed again after this many attempts")
+
+parser_shards = argparse.ArgumentParser(prog='wijklabels-shards')
+subparsers = parser_shards.add_subparsers(dest="command", required=True)
+parser_init = subparsers.add_parser("init", parents=[parser_database],
+                                    help="Register the shards of the input table in the queue")
+parser_init.add_argument('--shard-by', choices=SHARD_BY, default="pand",
+                         help="Split the panden into ranges of Pand IDs or of buurtcodes")
+parser_init.add_argument('--shard-size', type=int, default=10_000,
+                         help="The approximate number of panden per shard")
+parser_init.add_argument('--reset', action='store_true',
+                         help="Replace the queue if it exists")
+parser_work = subparsers.add_parser("work", parents=[parser_database],
+                                    help="Claim and process shards until all are done")
+parser_work.add_argument('path_output_dir')
+parser_work.add_argument('path_label_distributions')
+parser_work.add_argument('-j', '--jobs', type=int, default=4)
+parser_work.add_argument('-m', '--method', type=LabelEstimationMethod,
+                         choices=list(map(str, LabelEstimationMethod)),
+                         default="distribution")
+parser_work.add_argument('--seed', type=int, default=1,
+                         help="Seed of the random numbers, must be the same on all nodes")
+parser_work.add_argument('--lease', type=float, default=900,
+                         help="Seconds after which the shard of a lost worker is claimed again")
+parser_work.add_argument('--poll-interval', type=float, default=30,
+                         help="Seconds between checks for expired shards, when there is nothing to claim")
+parser_work.add_argument('--batch-seconds', type=float, default=2.0,
+                         help="The panden are sent to the workers in batches that take about this many seconds.")
+parser_work.add_argument('--progress-interval', type=float, default=60,
+                         help="Seconds between the progress reports.")
+subparsers.add_parser("status", parents=[parser_database],
+                      help="Report the state of the shards")
+parser_merge = subparsers.add_parser("merge", parents=[parser_database],
+                                     help="Merge the outputs of the shards that are done")
+parser_merge.add_argument('path_output_dir')
+parser_merge.add_argument("--individual", action="store_true",
+                          help="Also concatenate the individual labels of the shards into labels_individual.csv")
+
+
+def shards_cli():
+    args = parser_shards.parse_args()
+    connection_string = f"postgresql://{args.user}:{args.password}@{args.host}:{args.port}/{args.dbname}"
+    if args.command == "init":
+        check_input_table(connection_string, args.table)
+        nr_shards = init_queue(connection_string, args.table, args.queue,
+                               shard_by=args.shard_by, shard_size=args.shard_size,
+                               reset=args.reset)
+        log.info(f"Registered {nr_shards} shards in {args.queue}")
+    elif args.command == "work":
+        path_output_dir = Path(args.path_output_dir).resolve()
+        path_output_dir.mkdir(parents=True, exist_ok=True)
+        distributions = load_distributions(Path(args.path_label_distributions).resolve())
+        queue = ShardQueue(connection_string, args.queue, lease=args.lease,
+                           max_attempts=args.max_attempts)
+        completed = work(queue, args.table, path_output_dir, distributions,
+                         args.method, args.seed, args.jobs,
+                         poll_interval=args.poll_interval,
+                         batch_seconds=args.batch_seconds,
+                         progress_interval=args.progress_interval)
+        log.info(f"Worker {queue.worker} completed {completed} shards")
+        log_status(queue.status(), args.max_attempts)
+    elif args.command == "status":
+        log_status(ShardQueue(connection_string, args.queue).status(),
+                   args.max_attempts)
+    elif args.command == "merge":
+        merge_queue(ShardQueue(connection_string, args.queue),
+                    Path(args.path_output_dir).resolve(), individual=args.individual)
+
+
+if __name__ == "__main__":
+    shards_cli()
@@ -0,0 +1,16 @@
+-- Claim the first shard that is queued, or whose lease expired because its worker was
+-- lost. The shards that are claimed by other workers are skipped, without waiting.
+UPDATE ${queue} AS q
+SET status      = 'claimed',
+    worker      = %(worker)s,
+    attempts    = q.attempts + 1,
+    claimed_at  = now(),
+    lease_until = now() + make_interval(secs => %(lease)s)
+WHERE q.shard_id = (SELECT s.shard_id
+                    FROM ${queue} AS s
+                    WHERE (s.status = 'queued'
+                        OR (s.status = 'claimed' AND s.lease_until < now()))
+                      AND s.attempts < %(max_attempts)s
+                    ORDER BY s.shard_id
+                    LIMIT 1 FOR UPDATE SKIP LOCKED)
+RETURNING q.shard_id, q.run_id, q.shard_by, q.first_key, q.last_key, q.nr_pand, q.attempts;
@@ -0,0 +1,11 @@
+UPDATE ${queue}
+SET status      = 'done',
+    done_at     = now(),
+    lease_until = NULL,
+    output      = %(output)s,
+    nr_done     = %(nr_done)s,
+    nr_failed   = %(nr_failed)s,
+    error       = NULL
+WHERE shard_id = %(shard_id)s
+  AND worker = %(worker)s
+  AND status = 'claimed';
@@ -0,0 +1,8 @@
+-- The number of panden per buurt. A Pand with verblijfsobjecten in several buurten is
+-- counted in the first of them, so that it is in exactly one shard.
+SELECT p.buurtcode, count(*) AS nr_pand
+FROM (SELECT pand_identificatie, min(coalesce(buurtcode, '')) AS buurtcode
+      FROM ${table}
+      GROUP BY pand_identificatie) AS p
+GROUP BY p.buurtcode
+ORDER BY p.buurtcode;
@@ -0,0 +1,19 @@
+CREATE TABLE IF NOT EXISTS ${queue}
+(
+    shard_id    integer PRIMARY KEY,
+    run_id      text        NOT NULL,
+    shard_by    text        NOT NULL,
+    first_key   text        NOT NULL,
+    last_key    text        NOT NULL,
+    nr_pand     integer     NOT NULL,
+    status      text        NOT NULL DEFAULT 'queued',
+    worker      text,
+    attempts    integer     NOT NULL DEFAULT 0,
+    claimed_at  timestamptz,
+    lease_until timestamptz,
+    done_at     timestamptz,
+    output      text,
+    nr_done     integer,
+    nr_failed   integer,
+    error       text
+);
@@ -0,0 +1,25 @@
+/* Table with the layout of wijklabels.input, for the synthetic input data of the
+   benchmarks. See wijklabels.synthetic.
+   */
+DROP TABLE IF EXISTS ${table};
+
+CREATE TABLE ${table}
+(
+    pand_identificatie     text,
+    vbo_identificatie      text,
+    oorspronkelijkbouwjaar int4,
+    oppervlakte            int4,
+    geometrie              geometry(Polygon, 28992),
+    woningtype             text,
+    landcode               text,
+    gemeentecode           text,
+    wijkcode               text,
+    buurtcode              text,
+    nr_floors              int4,
+    vbo_count              int8,
+    b3_opp_buitenmuur      float8,
+    b3_opp_dak_plat        float8,
+    b3_opp_dak_schuin      float8,
+    b3_opp_grond           float8,
+    b3_opp_scheidingsmuur  float8
+);
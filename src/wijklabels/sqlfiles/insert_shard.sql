@@ -0,0 +1,2 @@
+INSERT INTO ${queue} (shard_id, run_id, shard_by, first_key, last_key, nr_pand)
+VALUES (%s, %s, %s, %s, %s, %s);
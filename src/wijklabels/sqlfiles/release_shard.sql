@@ -0,0 +1,8 @@
+UPDATE ${queue}
+SET status      = 'queued',
+    worker      = NULL,
+    lease_until = NULL,
+    error       = %(error)s
+WHERE shard_id = %(shard_id)s
+  AND worker = %(worker)s
+  AND status = 'claimed';
@@ -0,0 +1,5 @@
+UPDATE ${queue}
+SET lease_until = now() + make_interval(secs => %(lease)s)
+WHERE shard_id = %(shard_id)s
+  AND worker = %(worker)s
+  AND status = 'claimed';
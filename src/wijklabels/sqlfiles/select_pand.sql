@@ -0,0 +1,3 @@
+SELECT *
+FROM ${table}
+WHERE pand_identificatie = %s;
@@ -0,0 +1,2 @@
+SELECT DISTINCT pand_identificatie
+FROM ${table};
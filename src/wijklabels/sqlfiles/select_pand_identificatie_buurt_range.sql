@@ -0,0 +1,12 @@
+-- The panden of a range of buurten. A Pand with verblijfsobjecten in several buurten
+-- belongs to the first of them, like in count_pand_per_buurt.sql. The vbo_count is
+-- the number of records of the Pand in all of its buurten, also outside the range.
+SELECT i.pand_identificatie, count(*) AS vbo_count
+FROM ${table} AS i
+WHERE i.pand_identificatie IN (SELECT s.pand_identificatie
+                               FROM ${table} AS s
+                               WHERE coalesce(s.buurtcode, '')
+                                         BETWEEN %(first_key)s AND %(last_key)s)
+GROUP BY i.pand_identificatie
+HAVING min(coalesce(i.buurtcode, '')) >= %(first_key)s
+ORDER BY i.pand_identificatie;
@@ -0,0 +1,5 @@
+SELECT pand_identificatie, count(*) AS vbo_count
+FROM ${table}
+WHERE pand_identificatie BETWEEN %(first_key)s AND %(last_key)s
+GROUP BY pand_identificatie
+ORDER BY pand_identificatie;
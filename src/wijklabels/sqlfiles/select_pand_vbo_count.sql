@@ -0,0 +1,3 @@
+SELECT pand_identificatie, count(*) AS vbo_count
+FROM ${table}
+GROUP BY pand_identificatie;
@@ -0,0 +1,13 @@
+SELECT shard_id,
+       run_id,
+       status,
+       worker,
+       attempts,
+       coalesce(lease_until < now(), FALSE) AS expired,
+       nr_pand,
+       nr_done,
+       nr_failed,
+       output,
+       error
+FROM ${queue}
+ORDER BY shard_id;
@@ -0,0 +1,222 @@
+"""Synthetic input data for the benchmarks
+
+Generates data in the layout of the `wijklabels.input` table, with a realistic mix of
+the dwelling types, the number of VBO per Pand, the number of floors, the construction
+years and the surface areas of the Dutch building stock. The values are not real, but
+they exercise the same code paths as the real data, at any scale.
+
+The data is written to a CSV or Parquet file, or it is loaded into a PostGIS database,
+such as the one in `docker/docker-compose.yaml`, so that `wijklabels-process` can run
+on it.
+
+Copyright 2023 3DGI
+"""
+import argparse
+import io
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import psycopg
+from psycopg import sql
+
+from wijklabels.load import load_sql, sql_table
+from wijklabels.identificatie import PREFIX_PAND, PREFIX_VBO
+from wijklabels.woningtype import Woningtype
+
+log = logging.getLogger("SYNTHETIC")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+COLUMNS = ["pand_identificatie", "vbo_identificatie", "oorspronkelijkbouwjaar",
+           "oppervlakte", "geometrie", "woningtype", "landcode", "gemeentecode",
+           "wijkcode", "buurtcode", "nr_floors", "vbo_count", "b3_opp_buitenmuur",
+           "b3_opp_dak_plat", "b3_opp_dak_schuin", "b3_opp_grond",
+           "b3_opp_scheidingsmuur"]
+
+# The woningtype of the Pand, which is determined from its neighbours
+WONINGTYPE_SHARES = {
+    Woningtype.VRIJSTAAND: 0.15,
+    Woningtype.TWEE_ONDER_EEN_KAP: 0.13,
+    Woningtype.RIJWONING_HOEK: 0.22,
+    Woningtype.RIJWONING_TUSSEN: 0.50,
+}
+# Share of the panden with more than one VBO, these are the apartment buildings
+SHARE_MULTI_VBO = 0.08
+# The construction periods of the building stock, with their share
+BOUWJAAR_SHARES = {
+    (1850, 1945): 0.20,
+    (1945, 1965): 0.13,
+    (1965, 1975): 0.14,
+    (1975, 1992): 0.20,
+    (1992, 2006): 0.17,
+    (2006, 2015): 0.09,
+    (2015, 2024): 0.07,
+}
+FLOOR_HEIGHT = 3.0
+PANDEN_PER_BUURT = 400
+BUURTEN_PER_WIJK = 5
+WIJKEN_PER_GEMEENTE = 6
+# Extent of the synthetic buurten in EPSG:28992
+ORIGIN = (10000.0, 300000.0)
+BUURT_SIZE = 1000.0
+
+
+def generate_input(nr_pand: int, seed: int = 1) -> pd.DataFrame:
+    """Generate synthetic input data, one row per VBO.
+
+    :param nr_pand: The number of panden.
+    :param seed: The seed of the random number generator, the same seed gives the
+        same data.
+    :returns: A DataFrame with the columns of the `wijklabels.input` table. The
+        geometry is EWKT.
+    """
+    rng = np.random.default_rng(seed)
+    pand = np.arange(nr_pand)
+    woningtypen = np.array([str(w) for w in WONINGTYPE_SHARES])
+    woningtype = rng.choice(woningtypen, size=nr_pand,
+                            p=list(WONINGTYPE_SHARES.values()))
+
+    multi = rng.random(nr_pand) < SHARE_MULTI_VBO
+    vbo_count = np.where(
+        multi, np.clip(np.round(rng.lognormal(2.0, 0.9, nr_pand)), 2, 400), 1
+    ).astype(np.int64)
+    nr_floors = np.where(
+        multi,
+        np.clip(np.round(vbo_count / rng.uniform(2.0, 6.0, nr_pand)), 2, 20),
+        rng.choice([1, 2, 3], size=nr_pand, p=[0.15, 0.6, 0.25])
+    ).astype(np.int64)
+
+    periods = list(BOUWJAAR_SHARES)
+    period = rng.choice(len(periods), size=nr_pand, p=list(BOUWJAAR_SHARES.values()))
+    start = np.array([p[0] for p in periods])[period]
+    end = np.array([p[1] for p in periods])[period]
+    bouwjaar = rng.integers(start, end)
+
+    # The usable surface of the dwellings and the footprint of the Pand
+    oppervlakte_vbo_mean = np.where(multi, 75.0, 120.0)
+    footprint = np.maximum(
+        oppervlakte_vbo_mean * vbo_count / nr_floors * rng.uniform(0.9, 1.3, nr_pand),
+        20.0)
+    width = np.sqrt(footprint * rng.uniform(0.4, 1.0, nr_pand))
+    depth = footprint / width
+    height = nr_floors * FLOOR_HEIGHT
+    walls = 2 * (width + depth) * height
+    shared_walls = {str(Woningtype.VRIJSTAAND): 0, str(Woningtype.TWEE_ONDER_EEN_KAP): 1,
+                    str(Woningtype.RIJWONING_HOEK): 1, str(Woningtype.RIJWONING_TUSSEN): 2}
+    nr_shared = np.vectorize(shared_walls.get)(woningtype)
+    scheidingsmuur = nr_shared * depth * height
+    flat_roof = rng.random(nr_pand) < np.where(multi, 0.9, 0.3)
+    dak_plat = np.where(flat_roof, footprint, 0.0)
+    dak_schuin = np.where(flat_roof, 0.0, footprint * 1.3)
+
+    # The panden are spread over the buurten, in a grid
+    buurt = pand // PANDEN_PER_BUURT
+    wijk = buurt // BUURTEN_PER_WIJK
+    gemeente = wijk // WIJKEN_PER_GEMEENTE
+    grid = int(np.ceil(np.sqrt(buurt.max() + 1))) if nr_pand > 0 else 1
+    x = ORIGIN[0] + (buurt % grid) * BUURT_SIZE + rng.uniform(0, BUURT_SIZE - 50,
+                                                              nr_pand)
+    y = ORIGIN[1] + (buurt // grid) * BUURT_SIZE + rng.uniform(0, BUURT_SIZE - 50,
+                                                               nr_pand)
+    geometrie = [
+        f"SRID=28992;POLYGON(({x0:.2f} {y0:.2f},{x0 + w:.2f} {y0:.2f},"
+        f"{x0 + w:.2f} {y0 + d:.2f},{x0:.2f} {y0 + d:.2f},{x0:.2f} {y0:.2f}))"
+        for x0, y0, w, d in zip(x.tolist(), y.tolist(), width.tolist(), depth.tolist())
+    ]
+    gemeentecode = np.char.mod("%04d", gemeente % 9999 + 1)
+    pandnr = np.char.mod("%010d", pand)
+
+    pand_df = pd.DataFrame({
+        "pand_identificatie": np.char.add(
+            np.char.add(PREFIX_PAND, gemeentecode), np.char.add("10", pandnr)),
+        "oorspronkelijkbouwjaar": bouwjaar,
+        "geometrie": geometrie,
+        "woningtype": woningtype,
+        "landcode": "NL",
+        "gemeentecode": np.char.add("GM", gemeentecode),
+        "wijkcode": np.char.add(np.char.add("WK", gemeentecode),
+                                np.char.mod("%02d", wijk % WIJKEN_PER_GEMEENTE)),
+        "buurtcode": np.char.add(
+            np.char.add("BU", gemeentecode),
+            np.char.mod("%04d", buurt % (WIJKEN_PER_GEMEENTE * BUURTEN_PER_WIJK))),
+        "nr_floors": nr_floors,
+        "vbo_count": vbo_count,
+        "b3_opp_buitenmuur": np.round(walls - scheidingsmuur, 2),
+        "b3_opp_dak_plat": np.round(dak_plat, 2),
+        "b3_opp_dak_schuin": np.round(dak_schuin, 2),
+        "b3_opp_grond": np.round(footprint, 2),
+        "b3_opp_scheidingsmuur": np.round(scheidingsmuur, 2),
+    })
+    # One row per VBO
+    rows = np.repeat(pand, vbo_count)
+    df = pand_df.iloc[rows].reset_index(drop=True)
+    vbonr = np.char.mod("%010d", np.arange(len(df)))
+    df["vbo_identificatie"] = np.char.add(
+        np.char.add(PREFIX_VBO, df["gemeentecode"].str[2:].to_numpy().astype(str)),
+        np.char.add("01", vbonr))
+    df["oppervlakte"] = np.maximum(
+        np.round(rng.lognormal(np.log(oppervlakte_vbo_mean[rows]), 0.35)), 15
+    ).astype(np.int64)
+    return df[COLUMNS]
+
+
+def write_input(df: pd.DataFrame, path: Path):
+    """Write the synthetic input to a CSV or Parquet file, by the file extension."""
+    if path.suffix == ".parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def load_input_postgres(df: pd.DataFrame, connection_str: str,
+                        table: str = "wijklabels.input_synthetic",
+                        chunksize: int = 100_000):
+    """Load the synthetic input into a PostGIS table, which is replaced. The table is
+    indexed on the `pand_identificatie`, like `wijklabels.input`."""
+    with psycopg.connect(connection_str) as conn:
+        conn.execute(load_sql("create_synthetic_input.sql", {"table": sql_table(table)}))
+        copy = sql.SQL("COPY {} FROM STDIN WITH (FORMAT csv)").format(
+            sql_table(table))
+        with conn.cursor() as cur, cur.copy(copy) as c:
+            for start in range(0, len(df), chunksize):
+                buffer = io.StringIO()
+                df.iloc[start:start + chunksize].to_csv(buffer, index=False,
+                                                        header=False)
+                c.write(buffer.getvalue())
+        conn.execute(sql.SQL("CREATE INDEX ON {} (pand_identificatie)").format(
+            sql_table(table)))
+
+
+parser_synthetic = argparse.ArgumentParser(prog='wijklabels-synthetic')
+parser_synthetic.add_argument("nr_pand", type=int, help="Number of panden")
+parser_synthetic.add_argument("--output",
+                              help="Write the data to this CSV or Parquet file")
+parser_synthetic.add_argument("--database",
+                              help="Load the data into this PostgreSQL database, as a connection string")
+parser_synthetic.add_argument("--table", default="wijklabels.input_synthetic",
+                              help="The table in the database, it is replaced")
+parser_synthetic.add_argument("--seed", type=int, default=1)
+
+
+def synthetic_cli():
+    args = parser_synthetic.parse_args()
+    if args.output is None and args.database is None:
+        raise ValueError("Either --output or --database must be provided")
+    log.info(f"Generating {args.nr_pand} panden")
+    df = generate_input(args.nr_pand, seed=args.seed)
+    log.info(f"Generated {len(df)} VBO")
+    if args.output is not None:
+        write_input(df, Path(args.output).resolve())
+    if args.database is not None:
+        load_input_postgres(df, args.database, args.table)
+        log.info(f"Loaded the data into {args.table}")
+
+
+if __name__ == "__main__":
+    synthetic_cli()
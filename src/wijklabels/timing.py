@@ -0,0 +1,189 @@
+"""Timing and profiling of the processing stages
+
+Opt-in instrumentation of `wijklabels-process` (`--timing`). Each worker process
+records the duration of each processing stage per Pand, with the number of rows of
+the Pand, to its own JSON-lines file `worker-<pid>.jsonl` in the timing directory. The
+`get_pand` stage is the time that the worker waits for the database. At the end of
+the run the records of all workers are summarized in `timing_summary.json`.
+
+Optionally, each worker also writes its cProfile statistics (`worker-<pid>.prof`,
+readable with `pstats` or snakeviz) and the largest memory allocations from
+tracemalloc (`worker-<pid>.tracemalloc.txt`) when it exits.
+
+Copyright 2023 3DGI
+"""
+import cProfile
+import json
+import os
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing.util import Finalize
+from pathlib import Path
+from time import perf_counter
+
+import pandas as pd
+
+PERCENTILES = (0.5, 0.9, 0.99)
+NR_SLOWEST = 20
+NR_TRACEMALLOC_STATS = 50
+
+
+@dataclass(frozen=True)
+class TimingOptions:
+    """What to record in the workers.
+
+    :param directory: The directory of the timing records and profiles.
+    :param profile: Profile the workers with cProfile.
+    :param tracemalloc: Trace the memory allocations of the workers.
+    """
+    directory: Path
+    profile: bool = False
+    tracemalloc: bool = False
+
+
+class NullTimer:
+    """The timer when the timing is not enabled, it records nothing."""
+
+    def start(self, pand_identificatie: str):
+        pass
+
+    @contextmanager
+    def stage(self, name: str):
+        yield
+
+    def finish(self, rows: int, failed: bool = False):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class StageTimer(NullTimer):
+    """Records the duration of the stages of each Pand, in a worker process."""
+
+    def __init__(self, options: TimingOptions):
+        self.options = options
+        options.directory.mkdir(parents=True, exist_ok=True)
+        path = options.directory.joinpath(f"worker-{os.getpid()}")
+        # Line-buffered, because the workers do not flush their files when they exit
+        self.file = path.with_suffix(".jsonl").open("a", buffering=1)
+        self.record = {}
+        self.start_pand = 0.0
+        self.profiler = None
+        if options.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if options.tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # Runs when the worker process exits
+        Finalize(self, StageTimer._close, args=(self.file, self.profiler, path),
+                 exitpriority=10)
+
+    def start(self, pand_identificatie: str):
+        self.record = {"pand_identificatie": pand_identificatie, "worker": os.getpid()}
+        if self.options.tracemalloc:
+            tracemalloc.reset_peak()
+        self.start_pand = perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record[name] = perf_counter() - start
+
+    def finish(self, rows: int, failed: bool = False):
+        self.record["total"] = perf_counter() - self.start_pand
+        self.record["rows"] = rows
+        self.record["failed"] = failed
+        if self.options.tracemalloc:
+            self.record["memory_peak"] = tracemalloc.get_traced_memory()[1]
+        self.file.write(json.dumps(self.record) + "\n")
+
+    @staticmethod
+    def _close(file, profiler: cProfile.Profile | None, path: Path):
+        file.close()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(path.with_suffix(".prof"))
+        if tracemalloc.is_tracing():
+            stats = tracemalloc.take_snapshot().statistics("lineno")
+            with path.with_suffix(".tracemalloc.txt").open("w") as f:
+                for stat in stats[:NR_TRACEMALLOC_STATS]:
+                    f.write(f"{stat}\n")
+            tracemalloc.stop()
+
+
+_timer: NullTimer | None = None
+
+
+def worker_timer(options: TimingOptions | None) -> NullTimer:
+    """The timer of the current worker process, which is created on its first use."""
+    global _timer
+    if _timer is None:
+        _timer = NULL_TIMER if options is None else StageTimer(options)
+    return _timer
+
+
+def read_records(directory: Path) -> pd.DataFrame:
+    """Read the timing records of all workers."""
+    frames = [pd.read_json(path, lines=True, dtype={"pand_identificatie": str})
+              for path in sorted(directory.glob("worker-*.jsonl"))
+              if path.stat().st_size > 0]
+    if len(frames) == 0:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def summarize(records: pd.DataFrame, stages: list[str]) -> dict:
+    """Summarize the timing records.
+
+    :param stages: The names of the stages, in the order of processing.
+    :returns: The number of panden, rows and failures, the totals and percentiles of
+        the duration of each stage (in seconds), the totals per worker and the
+        slowest panden.
+    """
+    stages = [s for s in stages if s in records.columns] + ["total"]
+    durations = records[stages]
+    total = durations["total"].sum()
+    per_stage = {}
+    for stage in stages:
+        d = durations[stage].dropna()
+        per_stage[stage] = {
+            "total": d.sum(),
+            "share": d.sum() / total if total > 0 else None,
+            "mean": d.mean(),
+            **{f"p{round(p * 100)}": d.quantile(p) for p in PERCENTILES},
+            "max": d.max(),
+        }
+    per_worker = records.groupby("worker")[stages].sum()
+    per_worker["panden"] = records.groupby("worker").size()
+    columns_slowest = ["pand_identificatie", "rows"] + stages
+    slowest = records.nlargest(NR_SLOWEST, "total")[columns_slowest]
+    summary = {
+        "panden": len(records),
+        "rows": int(records["rows"].sum()),
+        "failed": int(records["failed"].sum()),
+        "stages": per_stage,
+        "workers": per_worker.reset_index().to_dict("records"),
+        "slowest": slowest.to_dict("records"),
+    }
+    if "memory_peak" in records.columns:
+        summary["memory_peak"] = int(records["memory_peak"].max())
+    return summary
+
+
+def write_summary(directory: Path, stages: list[str]) -> dict | None:
+    """Summarize the records of the workers into `timing_summary.json`.
+
+    :returns: The summary, or None if there are no records.
+    """
+    records = read_records(directory)
+    if records.empty:
+        return None
+    summary = summarize(records, stages)
+    directory.joinpath("timing_summary.json").write_text(
+        json.dumps(summary, indent=2, default=float))
+    return summary
@@ -0,0 +1,116 @@
+"""Mapping tables from the verblijfsobjecten to additional aggregate units
+
+Units such as postcode-4 areas, energy regions or user-defined polygons are not in the
+input of `wijklabels-process`. Their mapping table assigns each verblijfsobject to a
+unit with a spatial join, which is done once. The table is stored as Parquet with the
+digest of its inputs next to it, so that it is only rebuilt when the verblijfsobjecten
+or the units change. See :py:func:`wijklabels.aggregate.register_unit` for using the
+mapping tables in the aggregation, and `wijklabels-validate --unit`.
+
+Requires the `geo` optional dependencies.
+
+Copyright 2023 3DGI
+"""
+import argparse
+import logging
+from os import PathLike
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import geopandas
+except ImportError as e:
+    raise ImportError("wijklabels.units requires the `geo` optional dependencies, "
+                      "install them with `pip install wijklabels[geo]`") from e
+
+from wijklabels.digest import digest_file, digest_parts, is_unchanged, record
+from wijklabels.identificatie import encode_identificatie
+
+# Logger for the unit mapping messages
+log = logging.getLogger("UNITS")
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+ch.setFormatter(formatter)
+log.addHandler(ch)
+
+
+def build_unit_mapping(vbo: geopandas.GeoDataFrame, units: geopandas.GeoDataFrame,
+                       vbo_id_col: str = "identificatie",
+                       unit_code_col: str = "code") -> pd.DataFrame:
+    """Assign the verblijfsobjecten to the units that contain them.
+
+    A verblijfsobject on the shared boundary of two units is assigned to only one of
+    them. Verblijfsobjecten outside all units are not in the mapping.
+
+    :returns: The mapping table, with the columns `vbo_identificatie` (int64) and
+        `unit_code`.
+    """
+    points = geopandas.GeoDataFrame({
+        "vbo_identificatie": encode_identificatie(vbo[vbo_id_col]),
+        "geometry": vbo.geometry.representative_point()}, crs=vbo.crs)
+    units = units[[unit_code_col, "geometry"]].to_crs(points.crs)
+    joined = geopandas.sjoin(points, units, how="inner", predicate="intersects")
+    mapping = joined.drop_duplicates("vbo_identificatie")[
+        ["vbo_identificatie", unit_code_col]].rename(columns={unit_code_col: "unit_code"})
+    mapping["unit_code"] = mapping["unit_code"].astype(str)
+    return mapping.reset_index(drop=True)
+
+
+def write_unit_mapping(path_vbo: PathLike, path_units: PathLike, path_output: PathLike,
+                       vbo_layer: str = None, units_layer: str = None,
+                       vbo_id_col: str = "identificatie", unit_code_col: str = "code",
+                       force: bool = False) -> bool:
+    """Build the mapping table and write it to Parquet, unless the inputs did not
+    change since it was built.
+
+    :returns: True if the mapping table was built.
+    """
+    digest = digest_parts(digest_file(path_vbo), digest_file(path_units), vbo_layer,
+                          units_layer, vbo_id_col, unit_code_col)
+    if not force and is_unchanged([path_output], digest):
+        log.info(f"The mapping table {path_output} is up to date")
+        return False
+    vbo = geopandas.read_file(path_vbo, layer=vbo_layer)
+    units = geopandas.read_file(path_units, layer=units_layer)
+    mapping = build_unit_mapping(vbo, units, vbo_id_col=vbo_id_col,
+                                 unit_code_col=unit_code_col)
+    log.info(f"Assigned {len(mapping)} of {len(vbo)} verblijfsobjecten to "
+             f"{mapping['unit_code'].nunique()} units")
+    mapping.to_parquet(path_output, index=False)
+    record([path_output], digest)
+    return True
+
+
+parser_units = argparse.ArgumentParser(prog='wijklabels-units')
+parser_units.add_argument("verblijfsobjecten",
+                          help="Path to a file with the verblijfsobject points, e.g. a GeoPackage")
+parser_units.add_argument("units",
+                          help="Path to a file with the polygons of the units, e.g. the postcode-4 areas")
+parser_units.add_argument("output", help="Path to the output Parquet file")
+parser_units.add_argument("--code-column", default="code",
+                          help="Name of the column of the unit codes")
+parser_units.add_argument("--vbo-id", default="identificatie",
+                          help="Name of the identifier column of the verblijfsobjecten")
+parser_units.add_argument("--vbo-layer", default=None,
+                          help="Layer of the verblijfsobjecten in the file")
+parser_units.add_argument("--units-layer", default=None,
+                          help="Layer of the units in the file")
+parser_units.add_argument("--force", action="store_true",
+                          help="Rebuild the mapping table, also if the inputs did not change")
+
+
+def units_cli():
+    args = parser_units.parse_args()
+    p_out = Path(args.output).resolve()
+    write_unit_mapping(Path(args.verblijfsobjecten).resolve(),
+                       Path(args.units).resolve(), p_out,
+                       vbo_layer=args.vbo_layer, units_layer=args.units_layer,
+                       vbo_id_col=args.vbo_id, unit_code_col=args.code_column,
+                       force=args.force)
+
+
+if __name__ == "__main__":
+    units_cli()
@@ -1,18 +1,22 @@
 import argparse
 import csv
-import itertools
 from pathlib import Path
 import logging
 from dataclasses import dataclass, asdict
 
+import numpy as np
 import pandas as pd
 
 from wijklabels import AggregateUnit
-from wijklabels.report import (aggregate_to_unit, plot_comparison,
-                               calculate_distance_stats_for_area)
+from wijklabels.aggregate import label_shares, distance_stats, AGGREGATE_LEVELS, \
+    UNIT_INDEX, register_unit, read_unit_mapping
+from wijklabels.report import plot_comparison
 from wijklabels.load import EPLoader, ExcelLoader
+from wijklabels.labelstore import EPLabelStore
+from wijklabels.identificatie import encode_index, decode_index
+from wijklabels.digest import write_csv_if_changed
 from wijklabels.labels import parse_energylabel_ditributions, \
-    reshape_for_classification, EnergyLabel
+    reshape_for_classification, EnergyLabel, energylabel_codes, LongLabels
 from wijklabels.vormfactor import VormfactorClass
 from wijklabels.woningtype import WoningtypePreNTA8800, Bouwperiode
 
@@ -35,8 +39,17 @@ class Accuracy:
 
 
 def join_with_ep_online(estimated_labels: pd.DataFrame,
-                        ep_online: pd.DataFrame) -> pd.DataFrame:
-    """Join the the dataframe with the estimated labels onto the EP-Online dataframe."""
+                        ep_online: pd.DataFrame | EPLabelStore) -> pd.DataFrame:
+    """Join the the dataframe with the estimated labels onto the EP-Online dataframe.
+    Both dataframes are indexed on the int64 encoded BAG identifiers.
+
+    If `ep_online` is a label store, only the labels of the Verblijfsobjecten in
+    `estimated_labels` are queried from the store.
+    """
+    if isinstance(ep_online, EPLabelStore):
+        ep_online = ep_online.load(
+            vbo_identificatie=estimated_labels.index.get_level_values(
+                "vbo_identificatie").unique())
     groundtruth = ep_online.loc[ep_online["energylabel"].notna(), :]
     _v = estimated_labels.join(groundtruth["energylabel"], how="left",
                                rsuffix="_ep_online", validate="1:m")
@@ -45,34 +58,122 @@ def join_with_ep_online(estimated_labels: pd.DataFrame,
     return validated
 
 
-def mark_dwelling_type(df: pd.DataFrame, woningtype=None):
+def label_distance(df: pd.DataFrame, column_from: str, column_to: str) -> pd.Series:
+    """Compute the signed distance from the labels in `column_from` to the labels in
+    `column_to`, as in :py:meth:`EnergyLabel.distance`."""
+    return energylabel_codes(df[column_to]) - energylabel_codes(df[column_from])
+
+
+def ep_online_label_in_distributions(df: pd.DataFrame,
+                                     distributions: LongLabels) -> pd.Series:
+    """Test if the EP-Online label of each address has a probability in the label
+    distribution of its woningtype, bouwperiode and vormfactor class.
+
+    The addresses are merged once with the long distribution table. Addresses without
+    a matching distribution are False.
+    """
+    keys = ["woningtype_pre_nta8800", "bouwperiode", "vormfactorclass",
+            "energylabel_code"]
+    possible = distributions.reset_index().rename(
+        columns={"vormfactor": "vormfactorclass"})
+    possible["energylabel_code"] = energylabel_codes(possible["energylabel"])
+    possible = possible.drop_duplicates(subset=keys, keep="first")
+    possible["in_distributions"] = possible["probability"].notna()
+    addresses = df[keys[:-1]].assign(
+        energylabel_code=energylabel_codes(df["energylabel_ep_online"]))
+    complete = addresses.notna().all(axis=1)
+    merged = addresses.loc[complete].merge(possible[keys + ["in_distributions"]],
+                                           how="left", on=keys)
+    in_distributions = pd.Series(False, index=df.index)
+    in_distributions[complete.to_numpy()] = merged["in_distributions"].fillna(
+        False).to_numpy(dtype=bool)
+    return in_distributions
+
+
+def confusion_counts(df_with_truth: pd.DataFrame) -> pd.Series:
+    """Count the addresses per woningtype, bouwperiode, plausibility of the EP-Online
+    label, estimated label and EP-Online label, in a single pass.
+
+    Every accuracy figure and confusion matrix of the validation is read from these
+    counts, see :py:func:`calculate_accuracy` and :py:func:`confusion_matrix`.
+
+    :returns: A Series of counts, indexed on `woningtype`, `bouwperiode`,
+        `ep_online_label_in_distributions`, `energylabel` and `energylabel_ep_online`.
+        The labels are the integer codes of :py:func:`energylabel_codes`.
+    """
+    keys = pd.DataFrame({
+        "woningtype": df_with_truth["woningtype"],
+        "bouwperiode": df_with_truth["bouwperiode"],
+        "ep_online_label_in_distributions": df_with_truth[
+            "ep_online_label_in_distributions"],
+        "energylabel": energylabel_codes(df_with_truth["energylabel"]),
+        "energylabel_ep_online": energylabel_codes(
+            df_with_truth["energylabel_ep_online"]),
+    })
+    keys = keys.loc[keys["energylabel"].notna() & keys["energylabel_ep_online"].notna()]
+    return keys.groupby(list(keys.columns), dropna=False, sort=False,
+                        observed=True).size().rename("count")
+
+
+def select_counts(counts: pd.Series, woningtype=None,
+                  only_possible_labels=False) -> pd.Series:
+    """Select the counts of :py:func:`confusion_counts` for a woningtype and/or only
+    the EP-Online labels that are possible in the Voorbeeldwoningen 2022 data."""
+    mask = mark_dwelling_type(counts.index.get_level_values("woningtype"), woningtype)
+    if only_possible_labels:
+        mask &= counts.index.get_level_values(
+            "ep_online_label_in_distributions") == True
+    return counts.loc[mask]
+
+
+def mark_dwelling_type(woningtype_values, woningtype=None):
+    is_appartement = pd.Series(woningtype_values).astype("string").str.contains(
+        "appartement", na=False).to_numpy(dtype=bool)
     if woningtype is None:
-        return df.apply(lambda row: True, axis=1)
+        return np.ones(len(is_appartement), dtype=bool)
     elif woningtype == "eengezins":
-        return ~df["woningtype"].str.contains("appartement")
+        return ~is_appartement
     elif woningtype == "meergezins":
-        return df["woningtype"].str.contains("appartement")
+        return is_appartement
     else:
         raise NotImplementedError
 
 
-def calculate_accuracy(df_with_truth: pd.DataFrame, within, woningtype=None):
-    """Calculate the accuracy within the given label range (e.g. +/-1 label)."""
-    matches = df_with_truth.apply(
-        lambda row: row.energylabel.within(row.energylabel_ep_online, within), axis=1)
-    types_mask = mark_dwelling_type(df_with_truth, woningtype)
-    subset = df_with_truth.loc[types_mask, :]
-    nr_matches = (matches & types_mask).sum()
-    nr_total = len(subset.loc[subset["energylabel_ep_online"].notnull()])
+def calculate_accuracy(counts: pd.Series, within, woningtype=None,
+                       only_possible_labels=False):
+    """Calculate the accuracy within the given label range (e.g. +/-1 label), from the
+    counts of :py:func:`confusion_counts`."""
+    subset = select_counts(counts, woningtype, only_possible_labels)
+    distance = (subset.index.get_level_values("energylabel_ep_online").to_numpy() -
+                subset.index.get_level_values("energylabel").to_numpy())
+    nr_matches = subset.loc[abs(distance) <= within].sum()
+    nr_total = subset.sum()
     return nr_matches / nr_total
 
 
-def accuracy_per_type_and_range(df, accuracies, only_possible_labels):
+def confusion_matrix(counts: pd.Series, woningtype=None,
+                     only_possible_labels=False) -> pd.DataFrame:
+    """The confusion matrix of the EP-Online labels (rows) and the estimated labels
+    (columns), from the counts of :py:func:`confusion_counts`."""
+    subset = select_counts(counts, woningtype, only_possible_labels)
+    labels = list(reversed(range(len(EnergyLabel))))
+    matrix = subset.groupby(level=["energylabel_ep_online", "energylabel"]).sum(
+    ).unstack("energylabel", fill_value=0).reindex(
+        index=labels, columns=labels, fill_value=0)
+    members = EnergyLabel._member_list()
+    matrix.index = pd.Index([members[i] for i in matrix.index],
+                            name="energylabel_ep_online")
+    matrix.columns = pd.Index([members[i] for i in matrix.columns], name="energylabel")
+    return matrix
+
+
+def accuracy_per_type_and_range(counts, accuracies, only_possible_labels):
     _possible = "all labels" if not only_possible_labels else "only possible labels"
     for within_range in (0, 1):
         for woningtype in (None, "eengezins", "meergezins"):
-            accuracy = calculate_accuracy(df, within=within_range,
-                                          woningtype=woningtype)
+            accuracy = calculate_accuracy(counts, within=within_range,
+                                          woningtype=woningtype,
+                                          only_possible_labels=only_possible_labels)
             _wt = "all" if woningtype is None else woningtype
             accuracies.append(
                 Accuracy(accuracy=accuracy, woningtype=_wt, label_range=within_range,
@@ -82,9 +183,26 @@ def accuracy_per_type_and_range(df, accuracies, only_possible_labels):
     return accuracies
 
 
+def parse_unit(value: str) -> tuple[str, Path]:
+    """Parse the NAME=MAPPING value of --unit."""
+    name, sep, path_mapping = value.partition("=")
+    if not sep or not name or not path_mapping:
+        raise argparse.ArgumentTypeError(
+            f"'{value}' is not NAME=MAPPING, e.g. pc4=pc4_mapping.parquet")
+    path_mapping = Path(path_mapping).resolve()
+    if not path_mapping.is_file():
+        raise argparse.ArgumentTypeError(f"The mapping table {path_mapping} of the "
+                                         f"unit {name} does not exist")
+    return name, path_mapping
+
+
 parser_validate = argparse.ArgumentParser(prog='wijklabels-validate')
 parser_validate.add_argument("--labels", help="Path to the estimated energy labels CSV file")
 parser_validate.add_argument("--ep-online", help="Path to the EP-Online labels CSV file")
+parser_validate.add_argument("--ep-online-store",
+                             help="Path to the EP-Online label store, which is used instead of the EP-Online CSV file. See wijklabels-ep-store.")
+parser_validate.add_argument("--ep-online-cache",
+                             help="Directory for caching the parsed EP-Online labels. The cache is reused as long as the EP-Online CSV file does not change.")
 parser_validate.add_argument("--distributions", help="Path to the energy label distributions Excel file of the Voorbeeldwooningen 2022 study")
 parser_validate.add_argument("--output", help="Path to the output directory")
 parser_validate.add_argument('-e', '--energylabel', default="energylabel",
@@ -100,22 +218,36 @@ parser_validate.add_argument('--plot-buurt', action='store_true',
 parser_validate.add_argument("--woningtype", choices=["eengezins", "meergezins"],
                              default=None,
                              help="Run the analysis on only the provided dwelling type. If not specified, all dwellings are included.")
+parser_validate.add_argument("--unit", action="append", default=[],
+                             type=parse_unit, metavar="NAME=MAPPING",
+                             help="Also aggregate to an additional unit, with the mapping table of the verblijfsobjecten to the units that is built by wijklabels-units. Can be repeated.")
+parser_validate.add_argument('-j', '--jobs', type=int, default=1,
+                             help="Number of processes for rendering the plots.")
+parser_validate.add_argument('--force', action='store_true',
+                             help="Regenerate all plots, also the plots of the units whose data did not change since the previous run.")
 
 
 def validate_cli():
     args = parser_validate.parse_args()
-    p_ep = Path(args.ep_online).resolve()
+    if args.ep_online is None and args.ep_online_store is None:
+        raise ValueError("Either --ep-online or --ep-online-store must be provided")
     p_el = Path(args.labels).resolve()
     p_dist = Path(args.distributions).resolve()
     PATH_OUTPUT_DIR = Path(args.output).resolve()
     PATH_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+    aggregate_levels = AGGREGATE_LEVELS
+    for name, path_mapping in args.unit:
+        register_unit(name, read_unit_mapping(path_mapping))
+        aggregate_levels += (name,)
+
     log.info("Loading data")
     estimated_labels_df = pd.read_csv(p_el, converters={
         args.energylabel: EnergyLabel.from_str, "bouwperiode": Bouwperiode.from_str,
         "vormfactorclass": VormfactorClass.from_str,
         "woningtype_pre_nta8800": WoningtypePreNTA8800.from_str}).set_index(
         ["vbo_identificatie", "pand_identificatie"])
+    encode_index(estimated_labels_df)
     if args.energylabel not in estimated_labels_df.columns:
         raise ValueError(
             f"Did not find the required energy label column {args.energylabel} in the input")
@@ -126,15 +258,19 @@ def validate_cli():
         estimated_labels_df.rename(columns={args.energylabel: "energylabel"},
                                    inplace=True)
 
-    ep_online_df = EPLoader(file=p_ep).load()
+    if args.ep_online_store is not None:
+        ep_online_df = EPLabelStore(Path(args.ep_online_store).resolve())
+    else:
+        ep_online_df = EPLoader(file=Path(args.ep_online).resolve(),
+                                cache_dir=args.ep_online_cache).load()
     df_with_truth_all = join_with_ep_online(estimated_labels=estimated_labels_df,
                                             ep_online=ep_online_df)
     del ep_online_df
 
     log.info("Computing estimated label distance to EP-Online labels")
     distance_column = "energylabel_dist_est_ep"
-    df_with_truth_all.loc[:, distance_column] = df_with_truth_all.apply(
-        lambda row: row["energylabel_ep_online"].distance(row["energylabel"]), axis=1)
+    df_with_truth_all[distance_column] = label_distance(
+        df_with_truth_all, "energylabel_ep_online", "energylabel")
 
     log.info(
         "Comparing the EP-Online labels to the Voorbeeldwoningen 2022 distributions")
@@ -143,30 +279,22 @@ def validate_cli():
     distributions = reshape_for_classification(_d)
 
     # Compare individual addresses
-    def _ep_in_dist(df_dist, row):
-        el_ep_online = row['energylabel_ep_online']
-        try:
-            return df_dist.loc[(row["woningtype_pre_nta8800"], row["bouwperiode"],
-                                row["vormfactorclass"]), :].query(
-                "energylabel == @el_ep_online").probability.notnull().values[0]
-        except KeyError:
-            return False
-
-    df_with_truth_all["ep_online_label_in_distributions"] = df_with_truth_all.apply(
-        lambda row: _ep_in_dist(distributions, row), axis=1)
+    df_with_truth_all["ep_online_label_in_distributions"] = \
+        ep_online_label_in_distributions(df_with_truth_all, distributions)
 
     p_out = PATH_OUTPUT_DIR.joinpath("labels_individual_ep_online").with_suffix(".csv")
     log.info(f"Writing output to {p_out}")
-    df_with_truth_all.to_csv(p_out)
+    write_csv_if_changed(decode_index(df_with_truth_all), p_out)
 
     nr_no_label = estimated_labels_df["energylabel"].isnull().sum()
     nr_total = len(estimated_labels_df)
     log.info(
         f"Missing energy label because of gap in energy label distributions in Voorbeeldwoningen 2022: {round(nr_no_label / nr_total * 100)}%")
 
+    counts = confusion_counts(df_with_truth_all)
     accuracies = []
     only_possible_labels = False
-    accuracies = accuracy_per_type_and_range(df_with_truth_all, accuracies,
+    accuracies = accuracy_per_type_and_range(counts, accuracies,
                                              only_possible_labels)
 
     nr_impossible_labels = len(df_with_truth_all[df_with_truth_all[
@@ -174,10 +302,8 @@ def validate_cli():
     nr_total = len(df_with_truth_all)
     log.info(f"Labels in EP-Online that do not have a corresponding probability in the Voorbeeldwoningen 2022 data: {round(nr_impossible_labels / nr_total * 100)}%")
 
-    possible_labels = df_with_truth_all[
-        df_with_truth_all["ep_online_label_in_distributions"] == True]
     only_possible_labels = True
-    accuracies = accuracy_per_type_and_range(possible_labels, accuracies,
+    accuracies = accuracy_per_type_and_range(counts, accuracies,
                                              only_possible_labels)
     p_out = PATH_OUTPUT_DIR.joinpath("accuracies").with_suffix(".csv")
     with p_out.open("w") as fo:
@@ -185,6 +311,18 @@ def validate_cli():
         csvwriter.writeheader()
         csvwriter.writerows(asdict(a) for a in accuracies)
 
+    p_out = PATH_OUTPUT_DIR.joinpath("confusion_counts").with_suffix(".csv")
+    log.info(f"Writing output to {p_out}")
+    members = EnergyLabel._member_list()
+    write_csv_if_changed(counts.reset_index().assign(
+        energylabel=lambda df: df["energylabel"].map(members.__getitem__),
+        energylabel_ep_online=lambda df: df["energylabel_ep_online"].map(
+            members.__getitem__)
+    ), p_out, index=False)
+    p_out = PATH_OUTPUT_DIR.joinpath("confusion_matrix").with_suffix(".csv")
+    log.info(f"Writing output to {p_out}")
+    write_csv_if_changed(confusion_matrix(counts, woningtype=args.woningtype), p_out)
+
     if args.woningtype == "eengezins":
         log.info(f"Selecting only {args.woningtype} woningtype")
         df_with_truth_subset = df_with_truth_all[~df_with_truth_all["woningtype"].str.contains(
@@ -201,53 +339,27 @@ def validate_cli():
 
     # Aggregate per buurt
     log.info("Aggregating the neigbourhoods")
-    gen_dist_nl = aggregate_to_unit(df_with_truth_subset, "energylabel",
-                                    AggregateUnit.NL)
-    gen_dist_gem = aggregate_to_unit(df_with_truth_subset, "energylabel",
-                                     AggregateUnit.GEMEENTE)
-    gen_dist_wij = aggregate_to_unit(df_with_truth_subset, "energylabel",
-                                     AggregateUnit.WIJK)
-    gen_dist_buu = aggregate_to_unit(df_with_truth_subset, "energylabel",
-                                     AggregateUnit.BUURT)
-    df_distributions_units = pd.DataFrame.from_records(
-        itertools.chain(gen_dist_nl, gen_dist_gem, gen_dist_wij, gen_dist_buu),
-        index="unit_code")
-    ## ep-online
-    gen_dist_nl = aggregate_to_unit(df_with_truth_subset, "energylabel_ep_online",
-                                    AggregateUnit.NL)
-    gen_dist_gem = aggregate_to_unit(df_with_truth_subset, "energylabel_ep_online",
-                                     AggregateUnit.GEMEENTE)
-    gen_dist_wij = aggregate_to_unit(df_with_truth_subset, "energylabel_ep_online",
-                                     AggregateUnit.WIJK)
-    gen_dist_buu = aggregate_to_unit(df_with_truth_subset, "energylabel_ep_online",
-                                     AggregateUnit.BUURT)
-    df_distributions_units_ep_online = pd.DataFrame.from_records(
-        itertools.chain(gen_dist_nl, gen_dist_gem, gen_dist_wij, gen_dist_buu),
-        index="unit_code")
+    df_distributions_units = label_shares(df_with_truth_subset, "energylabel",
+                                          aggregate_levels)
+    df_distributions_units_ep_online = label_shares(df_with_truth_subset,
+                                                    "energylabel_ep_online",
+                                                    aggregate_levels)
 
     log.info("Analysing estimated and EP-Online deviations (per address)")
-    gen_nl = calculate_distance_stats_for_area(df_with_truth_subset, AggregateUnit.NL,
-                                               distance_column)
-    gen_gem = calculate_distance_stats_for_area(df_with_truth_subset,
-                                                AggregateUnit.GEMEENTE, distance_column)
-    gen_wij = calculate_distance_stats_for_area(df_with_truth_subset,
-                                                AggregateUnit.WIJK, distance_column)
-    gen_buu = calculate_distance_stats_for_area(df_with_truth_subset,
-                                                AggregateUnit.BUURT, distance_column)
-    df_distance_stats = pd.DataFrame.from_records(
-        itertools.chain(gen_nl, gen_gem, gen_wij, gen_buu), index="unit_code")
+    df_distance_stats = distance_stats(df_with_truth_subset, distance_column,
+                                       aggregate_levels)
 
     log.info("Analysing estimated and EP-Online deviations (aggregated)")
     df_dist_long_est = pd.melt(df_distributions_units.reset_index(),
-                               id_vars=["unit_code"], value_vars=list(EnergyLabel),
+                               id_vars=UNIT_INDEX, value_vars=list(EnergyLabel),
                                var_name="energylabel",
                                value_name="probability").set_index(
-        ["unit_code", "energylabel"])
+        UNIT_INDEX + ["energylabel"])
     df_dist_long_ep = pd.melt(df_distributions_units_ep_online.reset_index(),
-                              id_vars=["unit_code"], value_vars=list(EnergyLabel),
+                              id_vars=UNIT_INDEX, value_vars=list(EnergyLabel),
                               var_name="energylabel",
                               value_name="probability").set_index(
-        ["unit_code", "energylabel"])
+        UNIT_INDEX + ["energylabel"])
     df_dist_long = df_dist_long_est.join(df_dist_long_ep, rsuffix="_ep_online")
     df_dist_long["difference"] = df_dist_long["probability"] - df_dist_long[
         "probability_ep_online"]
@@ -255,36 +367,21 @@ def validate_cli():
     p_out = PATH_OUTPUT_DIR.joinpath("labels_neighbourhood_ep_online").with_suffix(
         ".csv")
     log.info(f"Writing output to {p_out}")
-    df_distance_stats.join(df_distributions_units).to_csv(p_out)
+    write_csv_if_changed(df_distance_stats.join(df_distributions_units), p_out)
 
     # Possible labels only
     log.info("Aggregating the neigbourhoods of possible labels")
-    gen_dist_nl = aggregate_to_unit(possible_labels, "energylabel", AggregateUnit.NL)
-    gen_dist_gem = aggregate_to_unit(possible_labels, "energylabel",
-                                     AggregateUnit.GEMEENTE)
-    gen_dist_wij = aggregate_to_unit(possible_labels, "energylabel", AggregateUnit.WIJK)
-    gen_dist_buu = aggregate_to_unit(possible_labels, "energylabel",
-                                     AggregateUnit.BUURT)
-    df_distributions_units = pd.DataFrame.from_records(
-        itertools.chain(gen_dist_nl, gen_dist_gem, gen_dist_wij, gen_dist_buu),
-        index="unit_code")
+    df_distributions_units = label_shares(possible_labels, "energylabel",
+                                          aggregate_levels)
 
     log.info("Analysing estimated and EP-Online deviations")
-    gen_nl = calculate_distance_stats_for_area(possible_labels, AggregateUnit.NL,
-                                               distance_column)
-    gen_gem = calculate_distance_stats_for_area(possible_labels, AggregateUnit.GEMEENTE,
-                                                distance_column)
-    gen_wij = calculate_distance_stats_for_area(possible_labels, AggregateUnit.WIJK,
-                                                distance_column)
-    gen_buu = calculate_distance_stats_for_area(possible_labels, AggregateUnit.BUURT,
-                                                distance_column)
-    df_distance_stats = pd.DataFrame.from_records(
-        itertools.chain(gen_nl, gen_gem, gen_wij, gen_buu), index="unit_code")
+    df_distance_stats = distance_stats(possible_labels, distance_column,
+                                       aggregate_levels)
 
     p_out = PATH_OUTPUT_DIR.joinpath(
         "labels_neighbourhood_ep_online_possible").with_suffix(".csv")
     log.info(f"Writing output to {p_out}")
-    df_distance_stats.join(df_distributions_units).to_csv(p_out)
+    write_csv_if_changed(df_distance_stats.join(df_distributions_units), p_out)
 
     if any([args.plot_nl, args.plot_gemeente, args.plot_wijk, args.plot_buurt]):
         p = PATH_OUTPUT_DIR.joinpath("plots")
@@ -293,21 +390,25 @@ def validate_cli():
         if args.plot_nl:
             log.info(f"Writing plot of the Netherlands to {p}")
             plot_comparison(df_with_truth_subset, p, aggregate_level=AggregateUnit.NL,
-                            woningtype=args.woningtype)
+                            woningtype=args.woningtype,
+                            jobs=args.jobs, force=args.force)
         if args.plot_gemeente:
             log.info(f"Writing plots of municipalities to {p}")
             plot_comparison(df_with_truth_subset, p,
                             aggregate_level=AggregateUnit.GEMEENTE,
-                            woningtype=args.woningtype)
+                            woningtype=args.woningtype,
+                            jobs=args.jobs, force=args.force)
         if args.plot_wijk:
             log.info(f"Writing plots of wijken to {p}")
             plot_comparison(df_with_truth_subset, p, aggregate_level=AggregateUnit.WIJK,
-                            woningtype=args.woningtype)
+                            woningtype=args.woningtype,
+                            jobs=args.jobs, force=args.force)
         if args.plot_buurt:
             log.info(f"Writing plots of neighborhoods to {p}")
             plot_comparison(df_with_truth_subset, p,
                             aggregate_level=AggregateUnit.BUURT,
-                            woningtype=args.woningtype)
+                            woningtype=args.woningtype,
+                            jobs=args.jobs, force=args.force)
 
         p = PATH_OUTPUT_DIR.joinpath("plots_possible")
         p.mkdir(parents=True, exist_ok=True)
@@ -315,19 +416,23 @@ def validate_cli():
         if args.plot_nl:
             log.info(f"Writing plot of the Netherlands to {p}")
             plot_comparison(possible_labels, p, aggregate_level=AggregateUnit.NL,
-                            woningtype=args.woningtype)
+                            woningtype=args.woningtype,
+                            jobs=args.jobs, force=args.force)
         if args.plot_gemeente:
             log.info(f"Writing plots of municipalities to {p}")
             plot_comparison(possible_labels, p, aggregate_level=AggregateUnit.GEMEENTE,
-                            woningtype=args.woningtype)
+                            woningtype=args.woningtype,
+                            jobs=args.jobs, force=args.force)
         if args.plot_wijk:
             log.info(f"Writing plots of wijken to {p}")
             plot_comparison(possible_labels, p, aggregate_level=AggregateUnit.WIJK,
-                            woningtype=args.woningtype)
+                            woningtype=args.woningtype,
+                            jobs=args.jobs, force=args.force)
         if args.plot_buurt:
             log.info(f"Writing plots of neighborhoods to {p}")
             plot_comparison(possible_labels, p, aggregate_level=AggregateUnit.BUURT,
-                            woningtype=args.woningtype)
+                            woningtype=args.woningtype,
+                            jobs=args.jobs, force=args.force)
 
 
 if __name__ == "__main__":
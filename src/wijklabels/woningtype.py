@@ -3,10 +3,10 @@
 Copyright 2023 3DGI
 """
 from enum import StrEnum
-import random
 import logging
 import itertools
 
+import numpy as np
 import pandas as pd
 from pandas import NA
 
@@ -58,8 +58,12 @@ class WoningtypePreNTA8800(StrEnum):
     OVERIG = "overig"
 
     @classmethod
-    def from_nta8800(cls, woningtype: Woningtype, oorspronkelijkbouwjaar: int):
-        """Map an NTA8800 Woningtype to a pre-NTA8800 Woningtype"""
+    def from_nta8800(cls, woningtype: Woningtype, oorspronkelijkbouwjaar: int,
+                     rng: np.random.Generator = None):
+        """Map an NTA8800 Woningtype to a pre-NTA8800 Woningtype
+
+        :param rng: The random number generator for choosing the apartement type.
+        """
         if woningtype is pd.NA:
             return pd.NA
         elif woningtype == Woningtype.VRIJSTAAND:
@@ -74,13 +78,13 @@ class WoningtypePreNTA8800(StrEnum):
             # Choose one of the apartement types from a distribution that was
             # calculated from the EP-Online data.
             if oorspronkelijkbouwjaar <= 1964:
-                return random.choice(APARTEMENTS_DISTRIBUTION_PRE_NTA8800[(0, 1964)])
+                return choose(APARTEMENTS_DISTRIBUTION_PRE_NTA8800[(0, 1964)], rng)
             elif 1965 <= oorspronkelijkbouwjaar <= 1974:
-                return random.choice(APARTEMENTS_DISTRIBUTION_PRE_NTA8800[(1965, 1974)])
+                return choose(APARTEMENTS_DISTRIBUTION_PRE_NTA8800[(1965, 1974)], rng)
             elif 1975 <= oorspronkelijkbouwjaar <= 1991:
-                return random.choice(APARTEMENTS_DISTRIBUTION_PRE_NTA8800[(1975, 1991)])
+                return choose(APARTEMENTS_DISTRIBUTION_PRE_NTA8800[(1975, 1991)], rng)
             elif 1992 <= oorspronkelijkbouwjaar:
-                return random.choice(APARTEMENTS_DISTRIBUTION_PRE_NTA8800[(1992, 9999)])
+                return choose(APARTEMENTS_DISTRIBUTION_PRE_NTA8800[(1992, 9999)], rng)
             else:
                 raise ValueError(
                     f"cannot determine apartement type from {oorspronkelijkbouwjaar=}, {woningtype=}")
@@ -366,7 +370,14 @@ def distribute_vbo_on_floor(group: pd.DataFrame) -> pd.DataFrame | None:
     return group_copy
 
 
-def classify_apartments(group: pd.DataFrame) -> pd.DataFrame | None:
+def choose(options: list, rng: np.random.Generator = None):
+    """Choose one of the options with equal probability."""
+    rng = np.random.default_rng() if rng is None else rng
+    return options[rng.integers(len(options))]
+
+
+def classify_apartments(group: pd.DataFrame,
+                        rng: np.random.Generator = None) -> pd.DataFrame | None:
     group_copy = group.copy()
     woningtype = group["woningtype"].values[0]
 
@@ -393,7 +404,8 @@ def classify_apartments(group: pd.DataFrame) -> pd.DataFrame | None:
     # An improved version would take into account the shape of the footprint to
     # determine the most likely layout.
     # 1 is double row, 0 is single row
-    double_row = random.binomialvariate()
+    rng = np.random.default_rng() if rng is None else rng
+    double_row = rng.integers(2)
     if vbo_per_floor <= 3:
         double_row = False
     nr_hoek = None
@@ -2,7 +2,7 @@ import pytest
 from pathlib import Path
 import pandas as pd
 
-from wijklabels.load import ExcelLoader
+from wijklabels.load import ExcelLoader, EPLoader
 
 @pytest.fixture(scope='session')
 def data_dir():
@@ -19,4 +19,20 @@ def vbo_df(data_dir):
 @pytest.fixture(scope='session')
 def excelloader(data_dir):
     file = data_dir / "input" / "energielabel_spreiding_subset.xlsx"
-    return ExcelLoader(file=file)
\ No newline at end of file
+    return ExcelLoader(file=file)
+
+
+@pytest.fixture
+def ep_online_csv(tmp_path):
+    """A small extract of the EP-Online CSV"""
+    path = tmp_path / "ep_online.csv"
+    header = ";".join(EPLoader.columns + ["Pand_status"])
+    rows = [
+        "20230115;NTA 8800:2022;A;2511AA;12;;;0518010000769873;0518100000203280;Rijwoning tussen;;1",
+        "20230116;NTA 8800:2022;C;2511AA;14;b;;0518010000765811;0518100000203249;Appartement;Tussendak;1",
+        "20220101;NTA 8800:2020;B+;2511AB;3;;;0518010000000001;0518100000000001;Twee-onder-één-kap;;1",
+        "20190101;NEN 7120;B;2511AB;5;;;0518010000000002;0518100000000002;Vrijstaande woning;;1",
+        "20230117;NTA 8800:2022;D;2511AB;7;;;;0518100000000003;Vrijstaande woning;;1",
+    ]
+    path.write_text("\n".join([header, *rows]) + "\n")
+    yield path
@@ -0,0 +1,95 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from wijklabels import AggregateUnit
+from wijklabels import aggregate
+from wijklabels.aggregate import label_shares, distance_stats
+from wijklabels.labels import EnergyLabel
+from wijklabels.validate import parse_unit
+
+
+def _validated():
+    return pd.DataFrame({
+        "landcode": ["NL"] * 6,
+        "gemeentecode": ["GM1", "GM1", "GM1", "GM2", "GM2", "GM2"],
+        "wijkcode": ["WK10", "WK10", "WK11", "WK20", "WK20", "WK20"],
+        "buurtcode": ["BU100", "BU100", "BU110", "BU200", "BU200", "BU201"],
+        "energylabel": [EnergyLabel.A, EnergyLabel.B, EnergyLabel.B, EnergyLabel.C,
+                        pd.NA, EnergyLabel.C],
+        "distance": [0, 1, -2, 3, np.nan, 1],
+    })
+
+
+def test_label_shares():
+    shares = label_shares(_validated(), "energylabel").droplevel("unit")
+    assert list(shares.index) == ["NL", "GM1", "GM2", "WK10", "WK11", "WK20",
+                                  "BU100", "BU110", "BU200", "BU201"]
+    assert list(shares.columns) == list(reversed(EnergyLabel))
+    assert shares.loc["NL", EnergyLabel.C] == 0.4
+    assert shares.loc["GM1", EnergyLabel.B] == 2 / 3
+    assert shares.loc["BU200", EnergyLabel.C] == 1.0
+    assert np.isnan(shares.loc["BU200", EnergyLabel.A])
+
+
+def test_distance_stats():
+    df = _validated()
+    stats = distance_stats(df, "distance",
+                           (AggregateUnit.NL, AggregateUnit.GEMEENTE)).droplevel("unit")
+    expected = df["distance"].dropna()
+    assert stats.loc["NL", "woning_count"] == 5
+    assert stats.loc["NL", "afwijking_median"] == expected.median()
+    assert stats.loc["NL", "afwijking_mean"] == expected.mean()
+    assert np.isclose(stats.loc["NL", "afwijking_std"], expected.std())
+    assert stats.loc["GM2", "afwijking_min"] == 1
+    assert stats.loc["GM2", "afwijking_median"] == 2
+
+
+def test_register_unit(monkeypatch):
+    monkeypatch.setattr("wijklabels.aggregate.UNIT_COLUMNS",
+                        dict(aggregate.UNIT_COLUMNS))
+    monkeypatch.setattr("wijklabels.aggregate.UNIT_MAPPINGS", {})
+    df = _validated()
+    df["vbo_identificatie"] = pd.array(range(6), dtype="Int64")
+    mapping = pd.DataFrame({"vbo_identificatie": pd.array([0, 1, 2, 3, 4], dtype="Int64"),
+                            "unit_code": ["2611", "2611", "2612", "2612", "2612"]})
+    aggregate.register_unit("pc4", mapping)
+    assert aggregate.aggregate_column_name("pc4") == "pc4code"
+    shares = label_shares(df.set_index("vbo_identificatie"), "energylabel",
+                          (AggregateUnit.GEMEENTE, "pc4"))
+    assert shares.loc[("pc4", "2611"), EnergyLabel.A] == 0.5
+    assert shares.loc[("pc4", "2612"), EnergyLabel.C] == 0.5
+    assert shares.loc[("gemeente", "GM2"), EnergyLabel.C] == 1.0
+    with pytest.raises(ValueError):
+        aggregate.aggregate_column_name("energieregio")
+
+
+def test_overlapping_unit_codes(monkeypatch):
+    monkeypatch.setattr("wijklabels.aggregate.UNIT_COLUMNS",
+                        dict(aggregate.UNIT_COLUMNS))
+    df = _validated()
+    # Two registered units whose codes overlap
+    df["pc4code"] = ["1", "1", "1", "2", "2", "2"]
+    df["polygoncode"] = ["1", "2", "2", "2", "2", "2"]
+    aggregate.register_unit("pc4")
+    aggregate.register_unit("polygon")
+    levels = ("pc4", "polygon")
+    shares = label_shares(df, "energylabel", levels)
+    assert len(shares) == 4
+    assert shares.loc[("pc4", "1"), EnergyLabel.B] == 2 / 3
+    assert shares.loc[("polygon", "1"), EnergyLabel.A] == 1.0
+    stats = distance_stats(df, "distance", levels)
+    assert stats.loc[("pc4", "1"), "woning_count"] == 3
+    assert stats.loc[("polygon", "1"), "woning_count"] == 1
+    assert stats.loc[("polygon", "2"), "afwijking_median"] == 1
+
+
+def test_parse_unit(tmp_path):
+    path_mapping = tmp_path / "pc4.parquet"
+    path_mapping.touch()
+    assert parse_unit(f"pc4={path_mapping}") == ("pc4", path_mapping)
+    for value in ("pc4", f"={path_mapping}", "pc4=", f"pc4={tmp_path / 'missing'}"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_unit(value)
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+geopandas = pytest.importorskip("geopandas")
+shapely = pytest.importorskip("shapely")
+from shapely.geometry import Point, box
+
+from wijklabels.area import AreaIndex, load_area_index, parse_query
+
+
+def test_area_distribution(tmp_path):
+    p_labels = tmp_path / "labels_individual.csv"
+    pd.DataFrame({
+        "pand_identificatie": ["NL.IMBAG.Pand.0503100000000001"] * 5,
+        "vbo_identificatie": [f"NL.IMBAG.Verblijfsobject.050301000000000{i}"
+                              for i in range(5)],
+        "woningtype": ["vrijstaande woning", "appartement", "appartement",
+                       "appartement", "vrijstaande woning"],
+        "bouwperiode": ["1965-1974"] * 5,
+        "energylabel": ["A", "B", "B", None, "C"],
+    }).to_csv(p_labels, index=False)
+    p_vbo = tmp_path / "verblijfsobjecten.gpkg"
+    geopandas.GeoDataFrame({
+        "identificatie": [f"050301000000000{i}" for i in range(5)],
+        "geometry": [Point(0.5, 0.5), Point(1.5, 0.5), Point(1.5, 0.6),
+                     Point(1.6, 0.5), Point(5, 5)],
+    }, crs="EPSG:28992").to_file(p_vbo, driver="GPKG")
+
+    index = load_area_index(p_labels, p_vbo)
+    assert len(index) == 5
+    result = index.distribution(box(0, 0, 2, 1))
+    assert result["nr_dwellings"] == 4
+    assert result["nr_without_label"] == 1
+    assert result["counts"]["B"] == 2
+    assert result["shares"]["A"] == 1 / 3
+    assert list(result["counts"])[0] == "A++++"
+
+    apartments = index.distribution(box(0, 0, 2, 1), woningtype=["appartement"])
+    assert apartments["nr_dwellings"] == 3
+    assert apartments["counts"]["A"] == 0
+
+    empty = index.distribution(box(10, 10, 11, 11))
+    assert empty["nr_dwellings"] == 0
+    assert empty["shares"]["A"] is None
+
+
+def test_parse_query():
+    area, filters = parse_query({"bbox": "0,0,2,1", "woningtype": "appartement"})
+    assert shapely.equals(area, box(0, 0, 2, 1))
+    assert filters == {"woningtype": ["appartement"], "bouwperiode": None}
+    area, _ = parse_query({"geometry": {"type": "Point", "coordinates": [1, 2]}})
+    assert shapely.equals(area, Point(1, 2))
+
+
+def test_area_index_vectorized():
+    rng = np.random.default_rng(1)
+    xy = rng.uniform(0, 100, size=(1000, 2))
+    labels = pd.DataFrame({"energylabel": rng.choice(["A", "B", "G"], size=1000)})
+    index = AreaIndex(labels, shapely.points(xy))
+    result = index.distribution(box(0, 0, 50, 50))
+    inside = (xy[:, 0] <= 50) & (xy[:, 1] <= 50)
+    assert result["nr_dwellings"] == inside.sum()
+    assert result["counts"]["G"] == (labels["energylabel"][inside] == "G").sum()
+
+
+def test_area_select_unknown_value():
+    labels = pd.DataFrame({"energylabel": ["A", "B", "C"],
+                           "woningtype": ["appartement", None, "vrijstaande woning"],
+                           "bouwperiode": [None, "1965-1974", "1965-1974"]})
+    index = AreaIndex(labels, shapely.points([(0, 0), (1, 1), (2, 2)]))
+    area = box(0, 0, 2, 2)
+    assert len(index.select(area, woningtype=["apartement"])) == 0
+    assert len(index.select(area, bouwperiode=["1965-1975"])) == 0
+    assert list(index.select(area, woningtype=["apartement", "appartement"])) == [0]
+    assert len(index.select(area, woningtype=None)) == 3
@@ -0,0 +1,28 @@
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+from wijklabels.charts import render_svg, write_svg_charts, write_sprite_sheet, LABELS
+from wijklabels.labels import EnergyLabel
+
+
+def test_render_svg():
+    shares = pd.Series({EnergyLabel.A: 0.25, EnergyLabel.B: 0.75})
+    svg = ET.fromstring(render_svg(shares, "BU01"))
+    bars = svg.findall("{http://www.w3.org/2000/svg}rect")
+    assert len(bars) == 2
+    assert bars[0].find("{http://www.w3.org/2000/svg}title").text == "A: 25.0%"
+
+
+def test_write_charts(tmp_path):
+    shares = pd.DataFrame([[np.nan] * 10 + [1.0], [0.5] + [np.nan] * 9 + [0.5]],
+                          columns=LABELS,
+                          index=pd.Index(["BU01", "BU02"], name="unit_code"))
+    assert write_svg_charts(shares, tmp_path / "svg") == 2
+    assert sorted(p.name for p in (tmp_path / "svg").iterdir()) == ["BU01.svg",
+                                                                     "BU02.svg"]
+    write_sprite_sheet(shares, tmp_path / "charts.html")
+    html = (tmp_path / "charts.html").read_text()
+    assert '<symbol id="BU02"' in html
+    assert '<use href="#BU01"/>' in html
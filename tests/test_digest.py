@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from wijklabels.digest import digest_parts, digest_frame, is_unchanged, record, \
+    write_csv_if_changed
+from wijklabels.labels import EnergyLabel
+
+
+def test_digest_parts():
+    a = digest_parts("BU01", np.array([1.0, 2.0]), pd.Series([0.5, 0.5]))
+    assert a == digest_parts("BU01", np.array([1.0, 2.0]), pd.Series([0.5, 0.5]))
+    assert a != digest_parts("BU01", np.array([1.0, 3.0]), pd.Series([0.5, 0.5]))
+    assert digest_parts("ab", "c") != digest_parts("a", "bc")
+
+
+def test_record(tmp_path):
+    output = tmp_path / "plot.png"
+    assert not is_unchanged([output], "abc")
+    output.write_bytes(b"")
+    record([output], "abc")
+    assert is_unchanged([output], "abc")
+    assert not is_unchanged([output], "abd")
+
+
+def test_write_csv_if_changed(tmp_path):
+    output = tmp_path / "labels.csv"
+    df = pd.DataFrame({"energylabel": ["A", "B"]})
+    assert write_csv_if_changed(df, output)
+    assert not write_csv_if_changed(df, output)
+    df.loc[1, "energylabel"] = "C"
+    assert write_csv_if_changed(df, output)
+    assert pd.read_csv(output, index_col=0).equals(df)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["labels.csv",
+                                                         "labels.csv.digest"]
+
+
+def test_digest_frame():
+    df = pd.DataFrame({"energylabel": [EnergyLabel.A, pd.NA], "distance": [1.0, np.nan]},
+                      index=pd.MultiIndex.from_tuples([(1, 2), (1, 3)],
+                                                      names=["pand", "vbo"]))
+    a = digest_frame(df)
+    assert a == digest_frame(df.copy())
+    assert a != digest_frame(df.rename(columns={"distance": "afstand"}))
+    assert a != digest_frame(df.rename_axis(["pand_identificatie", "vbo"]))
+    assert a != digest_frame(df.astype({"distance": "float32"}))
+    assert a != digest_frame(df, [("index", False)])
+    changed = df.copy()
+    changed.iloc[1, 0] = EnergyLabel.B
+    assert a != digest_frame(changed)
+
+
+def test_write_csv_if_changed_options(tmp_path):
+    output = tmp_path / "labels.csv"
+    df = pd.DataFrame({"energylabel": ["A", "B"]})
+    assert write_csv_if_changed(df, output)
+    # The same DataFrame, but another CSV
+    assert write_csv_if_changed(df, output, index=False)
+    assert list(pd.read_csv(output).columns) == ["energylabel"]
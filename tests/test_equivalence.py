@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+from wijklabels.equivalence import reference_engine, check_equivalence, \
+    compare_distributions, COLUMNS_INDEX
+from wijklabels.labels import parse_energylabel_ditributions, reshape_for_classification
+from wijklabels.synthetic import generate_input
+
+
+@pytest.fixture(scope="module")
+def distributions(excelloader):
+    return reshape_for_classification(parse_energylabel_ditributions(excelloader))
+
+
+@pytest.fixture(scope="module")
+def synthetic_input():
+    return generate_input(40).drop(columns=["geometrie"]).set_index(COLUMNS_INDEX)
+
+
+def labels(counts: dict, gemeentecode="GM0001") -> pd.DataFrame:
+    values = [label for label, count in counts.items() for _ in range(count)]
+    return pd.DataFrame({"energylabel": values, "landcode": "NL",
+                         "gemeentecode": gemeentecode, "wijkcode": "WK000100"})
+
+
+def test_check_equivalence(distributions, synthetic_input):
+    report = check_equivalence(synthetic_input, reference_engine(distributions),
+                               reference_engine(distributions), exact_apartments=True)
+    assert report.equivalent
+    assert report.exact == {"vormfactor": 0, "vormfactorclass": 0, "bouwperiode": 0}
+
+
+def test_check_equivalence_exact(distributions, synthetic_input):
+    def candidate(df):
+        out = reference_engine(distributions, seed=2)(df)
+        out["vormfactor"] = out["vormfactor"] + 0.01
+        return out
+
+    report = check_equivalence(synthetic_input, reference_engine(distributions),
+                               candidate)
+    assert not report.equivalent
+    assert report.exact["vormfactor"] == (synthetic_input["vbo_count"] == 1).sum()
+    assert report.exact["bouwperiode"] == 0
+
+
+def test_compare_distributions():
+    reference = labels({"A": 500, "B": 300, "C": 200})
+    similar = labels({"A": 490, "B": 310, "C": 200})
+    different = labels({"A": 300, "B": 300, "C": 400})
+    result = compare_distributions(reference, similar, "energylabel")
+    assert len(result) == 3
+    assert not result["failed"].any()
+    result = compare_distributions(reference, different, "energylabel")
+    assert result["failed"].all()
+    assert result["max_share_difference"].iloc[0] == pytest.approx(0.2)
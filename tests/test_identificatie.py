@@ -0,0 +1,26 @@
+import pandas as pd
+
+from wijklabels.identificatie import encode_identificatie, decode_identificatie, \
+    encode_index, decode_index, PREFIX_PAND
+
+
+def test_encode_decode_identificatie():
+    ids = pd.Series(["NL.IMBAG.Pand.0363100012345678", None, "0518100000203280"])
+    encoded = encode_identificatie(ids)
+    assert encoded.dtype == "Int64"
+    assert encoded.iloc[0] == 363100012345678
+    assert encoded.iloc[1] is pd.NA
+    decoded = decode_identificatie(encoded, PREFIX_PAND)
+    assert decoded.iloc[0] == "NL.IMBAG.Pand.0363100012345678"
+    assert decoded.iloc[2] == "NL.IMBAG.Pand.0518100000203280"
+
+
+def test_encode_decode_index():
+    index = pd.MultiIndex.from_tuples(
+        [("NL.IMBAG.Verblijfsobject.0363010000123456",
+          "NL.IMBAG.Pand.0363100012345678")],
+        names=["vbo_identificatie", "pand_identificatie"])
+    df = pd.DataFrame({"oppervlakte": [80]}, index=index)
+    encode_index(df)
+    assert df.index[0] == (363010000123456, 363100012345678)
+    assert decode_index(df).index.equals(index)
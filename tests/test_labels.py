@@ -1,6 +1,7 @@
+import pandas as pd
 from pytest import mark
 from wijklabels.labels import parse_energylabel_ditributions, \
-    reshape_for_classification, EnergyLabel
+    reshape_for_classification, EnergyLabel, energylabel_codes
 
 
 def test_parse_energy_label_distributions(excelloader):
@@ -43,4 +44,14 @@ def test_within(_self, other, range, result):
     )
 )
 def test_distance(_self, other, result):
-    assert _self.distance(other) == result
\ No newline at end of file
+    assert _self.distance(other) == result
+
+
+def test_energylabel_codes():
+    labels = pd.Series([EnergyLabel.G, EnergyLabel.B, pd.NA, EnergyLabel.APPPP])
+    codes = energylabel_codes(labels)
+    assert codes.iloc[0] == 0
+    assert codes.iloc[1] == 5
+    assert codes.iloc[2] is pd.NA
+    assert codes.iloc[3] == 10
+    assert codes.iloc[1] - codes.iloc[0] == EnergyLabel.G.distance(EnergyLabel.B)
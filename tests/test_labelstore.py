@@ -0,0 +1,80 @@
+from wijklabels.labels import EnergyLabel
+from wijklabels.labelstore import EPLabelStore
+from wijklabels.load import EPLoader
+
+
+def test_labelstore_initialize(tmp_path, ep_online_csv):
+    store = EPLabelStore(tmp_path / "ep_online.sqlite")
+    assert store.initialize(ep_online_csv) == 3
+    ep_df = store.load()
+    ep_df_csv = EPLoader(file=ep_online_csv).load()
+    assert sorted(ep_df.index) == sorted(ep_df_csv.index)
+    assert (ep_df.loc[ep_df_csv.index, "woningtype"] == ep_df_csv["woningtype"]).all()
+
+
+def test_labelstore_mutations(tmp_path, ep_online_csv):
+    store = EPLabelStore(tmp_path / "ep_online.sqlite")
+    store.initialize(ep_online_csv)
+    path_mutations = tmp_path / "ep_online_mutations.csv"
+    header = ";".join(EPLoader.columns + ["Pand_status"])
+    rows = [
+        # update
+        "20240115;NTA 8800:2022;A+;2511AA;12;;;0518010000769873;0518100000203280;Rijwoning tussen;;1",
+        # withdrawal
+        "20240116;NTA 8800:2022;C;2511AA;14;b;;0518010000765811;0518100000203249;Appartement;Tussendak;ingetrokken",
+        # insert
+        "20240117;NTA 8800:2022;B;2511AC;1;;;0518010000000009;0518100000000009;Vrijstaande woning;;1",
+    ]
+    path_mutations.write_text("\n".join([header, *rows]) + "\n")
+    counts = store.apply_mutations(path_mutations, withdrawn_column="Pand_status",
+                                   withdrawn_values=("ingetrokken",))
+    assert counts == {"upserted": 2, "withdrawn": 1}
+    # Applying the same mutations twice is a no-op
+    assert store.apply_mutations(path_mutations)["upserted"] == 0
+    ep_df = store.load()
+    assert len(ep_df) == 3
+    assert ep_df.loc[(518100000203280, 518010000769873), "energylabel"] == EnergyLabel.AP
+    subset = store.load(vbo_identificatie=[518010000000009])
+    assert len(subset) == 1
+
+
+def test_labelstore_mutations_file_order(tmp_path, ep_online_csv):
+    store = EPLabelStore(tmp_path / "ep_online.sqlite")
+    store.initialize(ep_online_csv)
+    path_mutations = tmp_path / "ep_online_mutations.csv"
+    header = ";".join(EPLoader.columns + ["Pand_status"])
+    rows = [
+        # insert, then withdraw
+        "20240117;NTA 8800:2022;B;2511AC;1;;;0518010000000009;0518100000000009;Vrijstaande woning;;1",
+        "20240118;NTA 8800:2022;B;2511AC;1;;;0518010000000009;0518100000000009;Vrijstaande woning;;ingetrokken",
+        # withdraw, then insert
+        "20240116;NTA 8800:2022;C;2511AA;14;b;;0518010000765811;0518100000203249;Appartement;Tussendak;ingetrokken",
+        "20240119;NTA 8800:2022;B;2511AA;14;b;;0518010000765811;0518100000203249;Appartement;Tussendak;1",
+        # replaced by a label of another method
+        "20240120;NEN 7120;B;2511AA;12;;;0518010000769873;0518100000203280;Rijwoning tussen;;1",
+    ]
+    path_mutations.write_text("\n".join([header, *rows]) + "\n")
+    store.apply_mutations(path_mutations, withdrawn_column="Pand_status",
+                          withdrawn_values=("ingetrokken",))
+    ep_df = store.load()
+    vbo_identificatie = ep_df.index.get_level_values("vbo_identificatie")
+    assert 518010000000009 not in vbo_identificatie
+    assert 518010000769873 not in vbo_identificatie
+    assert ep_df.loc[(518100000203249, 518010000765811), "energylabel"] == EnergyLabel.B
+
+
+def test_labelstore_mutations_pand_changed(tmp_path, ep_online_csv):
+    store = EPLabelStore(tmp_path / "ep_online.sqlite")
+    store.initialize(ep_online_csv)
+    path_mutations = tmp_path / "ep_online_mutations.csv"
+    header = ";".join(EPLoader.columns)
+    rows = [
+        # The Verblijfsobject is now in another Pand
+        "20240119;NTA 8800:2022;A;2511AA;14;b;;0518010000765811;0518100000000077;Appartement;Tussendak",
+    ]
+    path_mutations.write_text("\n".join([header, *rows]) + "\n")
+    store.apply_mutations(path_mutations)
+    ep_df = store.load()
+    labels = ep_df.xs(518010000765811, level="vbo_identificatie")
+    assert list(labels.index) == [518100000000077]
+    assert labels["energylabel"].tolist() == [EnergyLabel.A]
@@ -1,5 +1,11 @@
-from wijklabels.load import CityJSONLoader, VBOLoader, EPLoader
+import os
+
+from wijklabels.load import CityJSONLoader, VBOLoader, EPLoader, SharedWallsLoader, \
+    load_sql, sql_table, sql_template
 from wijklabels.woningtype import Woningtype
+from wijklabels.labels import EnergyLabel
+import pandas as pd
+import pytest
 
 
 def test_cityjsonloader_files(data_dir):
@@ -30,5 +36,103 @@ def test_vbo_load_file(data_dir):
 def test_eploader():
     path_csv = "/data/energylabel-ep-online/v20231101_v2_csv_subset.csv"
     ep_df = EPLoader(file=path_csv).load()
-    assert (ep_df.loc[("NL.IMBAG.Pand.0518100000203280", "NL.IMBAG.Verblijfsobject.0518010000769873"), "woningtype"] == Woningtype.RIJWONING_TUSSEN).all()
-    assert (ep_df.loc[("NL.IMBAG.Pand.0518100000203249", "NL.IMBAG.Verblijfsobject.0518010000765811"), "woningtype"] == Woningtype.APPARTEMENT_TUSSENDAK).all()
+    assert (ep_df.loc[(518100000203280, 518010000769873), "woningtype"] == Woningtype.RIJWONING_TUSSEN).all()
+    assert (ep_df.loc[(518100000203249, 518010000765811), "woningtype"] == Woningtype.APPARTEMENT_TUSSENDAK).all()
+
+
+def test_sharedwallsloader_cache(tmp_path):
+    path_csv = tmp_path / "shared_walls.csv"
+    path_csv.write_text(
+        "identificatie,_betrouwbaar,b3_opp_buitenmuur,b3_opp_scheidingsmuur\n"
+        "NL.IMBAG.Pand.0363100000000003,True,30.0,3.0\n"
+        "NL.IMBAG.Pand.0363100000000001,True,10.0,1.0\n"
+        "NL.IMBAG.Pand.0363100000000002,False,20.0,2.0\n"
+    )
+    loader = SharedWallsLoader(file=path_csv)
+    path_cache = loader.build_cache()
+    assert path_cache.exists()
+    df = loader.load(columns=["b3_opp_buitenmuur"])
+    assert list(df.columns) == ["b3_opp_buitenmuur"]
+    assert df.index.is_monotonic_increasing
+    one = loader.get("NL.IMBAG.Pand.0363100000000002",
+                     columns=["b3_opp_scheidingsmuur"])
+    assert len(one) == 1
+    assert one.loc[363100000000002, "b3_opp_scheidingsmuur"] == 2.0
+    assert len(loader.get("NL.IMBAG.Pand.0363100000000009")) == 0
+
+
+def test_sharedwallsloader_stale_cache(tmp_path):
+    path_csv = tmp_path / "shared_walls.csv"
+    header = "identificatie,_betrouwbaar,b3_opp_buitenmuur,b3_opp_scheidingsmuur\n"
+    path_csv.write_text(header + "NL.IMBAG.Pand.0363100000000001,True,10.0,1.0\n")
+    SharedWallsLoader(file=path_csv).build_cache()
+    # The CSV is exported again
+    path_csv.write_text(header + "NL.IMBAG.Pand.0363100000000001,True,15.0,1.0\n")
+    loader = SharedWallsLoader(file=path_csv)
+    assert loader.load().loc[363100000000001, "b3_opp_buitenmuur"] == 15.0
+    with pytest.raises(ValueError):
+        loader.get("NL.IMBAG.Pand.0363100000000001")
+    loader.build_cache()
+    assert loader.get("NL.IMBAG.Pand.0363100000000001").loc[
+               363100000000001, "b3_opp_buitenmuur"] == 15.0
+
+
+def test_sharedwallsloader_cache_stat(tmp_path, monkeypatch):
+    path_csv = tmp_path / "shared_walls.csv"
+    path_csv.write_text(
+        "identificatie,_betrouwbaar,b3_opp_buitenmuur,b3_opp_scheidingsmuur\n"
+        "NL.IMBAG.Pand.0363100000000001,True,10.0,1.0\n")
+    SharedWallsLoader(file=path_csv).build_cache()
+
+    def no_digest(file):
+        raise AssertionError("The CSV must not be hashed")
+
+    # The size and modification time are the same, the CSV is not hashed
+    monkeypatch.setattr("wijklabels.load.digest_file", no_digest)
+    assert len(SharedWallsLoader(file=path_csv).get(
+        "NL.IMBAG.Pand.0363100000000001")) == 1
+    # Another size, the cache is stale without hashing the CSV
+    path_csv.write_text(path_csv.read_text()
+                        + "NL.IMBAG.Pand.0363100000000002,True,20.0,2.0\n")
+    with pytest.raises(ValueError):
+        SharedWallsLoader(file=path_csv).get("NL.IMBAG.Pand.0363100000000001")
+    monkeypatch.undo()
+    # The same contents with another modification time, the cache is still valid
+    loader = SharedWallsLoader(file=path_csv)
+    loader.build_cache()
+    stat = path_csv.stat()
+    os.utime(path_csv, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert len(SharedWallsLoader(file=path_csv).get(
+        "NL.IMBAG.Pand.0363100000000002")) == 1
+
+
+def test_eploader_vectorized(ep_online_csv):
+    ep_df = EPLoader(file=ep_online_csv, chunksize=2).load()
+    assert len(ep_df) == 3
+    assert ep_df.loc[(518100000203280, 518010000769873), "woningtype"] == Woningtype.RIJWONING_TUSSEN
+    assert ep_df.loc[(518100000203249, 518010000765811), "woningtype"] == Woningtype.APPARTEMENT_TUSSENDAK
+    assert ep_df.loc[(518100000000001, 518010000000001), "woningtype"] == Woningtype.TWEE_ONDER_EEN_KAP
+    assert ep_df.loc[(518100000203249, 518010000765811), "energylabel"] == EnergyLabel.C
+    assert ep_df.loc[(518100000000001, 518010000000001), "energylabel"] is pd.NA
+
+
+def test_eploader_cache(tmp_path, ep_online_csv):
+    loader = EPLoader(file=ep_online_csv, cache_dir=tmp_path / "cache")
+    ep_df = loader.load()
+    assert loader.cache_path().exists()
+    ep_df_cached = loader.load()
+    pd.testing.assert_frame_equal(ep_df, ep_df_cached)
+
+
+def test_eploader_cache_format(tmp_path, ep_online_csv, monkeypatch):
+    loader = EPLoader(file=ep_online_csv, cache_dir=tmp_path / "cache")
+    path_cache = loader.cache_path()
+    monkeypatch.setattr(EPLoader, "CACHE_FORMAT", EPLoader.CACHE_FORMAT + 1)
+    # The cache of another format is not used
+    assert loader.cache_path() != path_cache
+
+
+def test_load_sql_composed():
+    query = load_sql("select_pand.sql", {"table": sql_table("wijklabels.input")})
+    assert sql_table("wijklabels.input") in list(query)
+    assert sql_template("select_pand.sql") is sql_template("select_pand.sql")
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from wijklabels.aggregate import label_shares, distance_stats
+from wijklabels.labels import EnergyLabel
+from wijklabels.merge import write_summary, read_summaries, neighbourhood_tables, \
+    concatenate_individual, individual_path, select_run
+
+
+@pytest.fixture
+def labels():
+    rng = np.random.default_rng(1)
+    n = 600
+    df = pd.DataFrame({
+        "vbo_identificatie": np.arange(n),
+        "landcode": "NL",
+        "gemeentecode": rng.choice(["GM0001", "GM0002"], n),
+        "energylabel": rng.choice([str(label) for label in EnergyLabel] + [None], n),
+        "energylabel_dist_est_ep": rng.integers(-3, 4, n).astype(float),
+        "vormfactor": rng.uniform(0.5, 3.0, n).round(2),
+    })
+    df["wijkcode"] = df["gemeentecode"].str.replace("GM", "WK") + rng.choice(
+        ["00", "01"], n)
+    df["buurtcode"] = df["wijkcode"].str.replace("WK", "BU") + "00"
+    df["energylabel"] = df["energylabel"].map(EnergyLabel.from_str, na_action="ignore")
+    return df
+
+
+def test_merge_shards(tmp_path, labels):
+    for shard_id, shard in enumerate(np.array_split(labels, 3)):
+        write_summary(shard, tmp_path, "run", shard_id)
+    tables = neighbourhood_tables(*read_summaries(tmp_path, select_run(tmp_path)))
+
+    neighbourhood = tables["labels_neighbourhood"]
+    shares = label_shares(labels, "energylabel")
+    pd.testing.assert_frame_equal(neighbourhood[shares.columns], shares)
+    vormfactor = labels.groupby("gemeentecode")["vormfactor"].agg(["mean", "std"])
+    gemeenten = neighbourhood.loc["gemeente"].loc[vormfactor.index]
+    assert gemeenten["vormfactor_mean"].to_numpy() == \
+           pytest.approx(vormfactor["mean"].to_numpy())
+    assert gemeenten["vormfactor_std"].to_numpy() == \
+           pytest.approx(vormfactor["std"].to_numpy())
+
+    stats = distance_stats(labels, "energylabel_dist_est_ep")
+    merged = tables["labels_neighbourhood_ep_online"]
+    pd.testing.assert_frame_equal(merged[stats.columns], stats)
+
+
+def test_concatenate_individual(tmp_path, labels):
+    for shard_id, shard in enumerate(np.array_split(labels, 3)):
+        shard.to_csv(individual_path(tmp_path, "run", shard_id), index=False)
+    p_out = tmp_path / "labels_individual.csv"
+    assert concatenate_individual(tmp_path, p_out, "run") == 3
+    merged = pd.read_csv(p_out)
+    assert len(merged) == len(labels)
+    assert merged["vbo_identificatie"].tolist() == labels["vbo_identificatie"].tolist()
+
+
+def test_merge_runs(tmp_path, labels):
+    # A previous run with other shards in the same output directory
+    for shard_id, shard in enumerate(np.array_split(labels, 4)):
+        write_summary(shard, tmp_path, "previous", shard_id)
+    for shard_id, shard in enumerate(np.array_split(labels, 2)):
+        write_summary(shard, tmp_path, "current", shard_id)
+    with pytest.raises(ValueError):
+        select_run(tmp_path)
+    counts, _ = read_summaries(tmp_path, select_run(tmp_path, "current"), [0, 1])
+    estimated = counts.loc[(counts["column"] == "energylabel")
+                           & (counts["unit_code"] == "NL")]
+    assert estimated["count"].sum() == labels["energylabel"].notna().sum()
+    # A done shard without summaries
+    with pytest.raises(ValueError):
+        read_summaries(tmp_path, "current", [0, 1, 2])
+    assert not list(tmp_path.rglob("*.tmp"))
@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+geopandas = pytest.importorskip("geopandas")
+from shapely.geometry import box
+
+from wijklabels.labels import EnergyLabel
+from wijklabels.aggregate import shares_from_counts
+from wijklabels.neighbourhood import stream_label_counts, join_buurten, \
+    write_neighbourhoods
+
+
+def test_neighbourhood(tmp_path):
+    p_labels = tmp_path / "labels_individual.csv"
+    pd.DataFrame({
+        "vbo_identificatie": range(5),
+        "buurtcode": ["BU01", "BU01", "BU01", "BU02", "BU02"],
+        "energylabel": ["A", "B", "B", "C", None],
+    }).to_csv(p_labels, index=False)
+    p_buurten = tmp_path / "wijkenbuurten.gpkg"
+    geopandas.GeoDataFrame({
+        "buurtcode": ["BU01", "BU02", "BU03"],
+        "buurtnaam": ["Centrum", "Noord", "Water"],
+        "gemeentenaam": ["Delft"] * 3,
+        "geometry": [box(0, 0, 1, 1), box(1, 0, 2, 1), box(2, 0, 3, 1)],
+    }, crs="EPSG:28992").to_file(p_buurten, layer="buurten", driver="GPKG")
+
+    counts = stream_label_counts(p_labels, chunksize=2)
+    shares = shares_from_counts(counts).droplevel("unit")
+    assert shares.loc["BU01", EnergyLabel.B] == 2 / 3
+    assert shares.loc["BU02", EnergyLabel.C] == 1.0
+
+    gdf = join_buurten(shares, p_buurten)
+    assert list(gdf.columns) == ["gemeentenaam", "buurtnaam"] + [
+        str(label) for label in reversed(EnergyLabel)] + ["geometry"]
+    assert list(gdf["buurtnaam"]) == ["Centrum", "Noord"]
+
+    p_fgb = tmp_path / "labels_neighborhood_geom.fgb"
+    write_neighbourhoods(gdf, p_fgb, tmp_path / "labels_neighborhood_geom.parquet")
+    in_bbox = geopandas.read_file(p_fgb, bbox=(1.5, 0.2, 1.8, 0.8))
+    assert list(in_bbox["buurtnaam"]) == ["Noord"]
+    assert len(geopandas.read_parquet(tmp_path / "labels_neighborhood_geom.parquet")) == 2
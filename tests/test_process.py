@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+from wijklabels import LabelEstimationMethod
+from wijklabels.labels import parse_energylabel_ditributions, reshape_for_classification
+from wijklabels.process import process_pand, pand_rng, read_pand_identificatie
+from wijklabels.synthetic import generate_input
+
+
+@pytest.fixture(scope="module")
+def distributions(excelloader):
+    return reshape_for_classification(parse_energylabel_ditributions(excelloader))
+
+
+def process(df: pd.DataFrame, distributions, seed: int) -> pd.DataFrame:
+    processed = []
+    for _, pand_df in df.groupby(level="pand_identificatie", sort=False):
+        pand_df = pand_df.copy()
+        process_pand(pand_df, distributions, LabelEstimationMethod.DISTRIBUTION, seed)
+        processed.append(pand_df)
+    return pd.concat(processed).sort_index()
+
+
+def test_pand_rng():
+    assert pand_rng(1, "NL.IMBAG.Pand.0503100000000001").random() == \
+           pand_rng(1, 503100000000001).random()
+    assert pand_rng(1, 503100000000001).random() != pand_rng(2, 503100000000001).random()
+    assert pand_rng(1, 503100000000001).random() != pand_rng(1, 503100000000002).random()
+
+
+def test_read_pand_identificatie():
+    pand_identificatie, vbo_count = read_pand_identificatie(
+        [("NL.IMBAG.Pand.0503100000000001", 3), ("NL.IMBAG.Pand.0503100000000002", 1)])
+    assert pand_identificatie.tolist() == [503100000000001, 503100000000002]
+    assert vbo_count.tolist() == [3, 1]
+    # IDs that would not decode to the IDs in the input table
+    for pid in ("0503100000000001", "NL.IMBAG.Pand.503100000000001",
+                "NL.IMBAG.Verblijfsobject.0503010000000001", "NL.IMBAG.Pand.x"):
+        with pytest.raises(ValueError):
+            read_pand_identificatie([(pid, 1)])
+
+
+def test_process_pand_reproducible(distributions):
+    df = generate_input(60).drop(columns=["geometrie"]).set_index(
+        ["pand_identificatie", "vbo_identificatie"])
+    columns = ["woningtype", "woningtype_pre_nta8800", "vormfactor", "energylabel"]
+    expected = process(df, distributions, seed=1)[columns]
+    # The order of the panden and of their records does not change the results
+    shuffled = df.sample(frac=1.0, random_state=3)
+    pd.testing.assert_frame_equal(process(shuffled, distributions, seed=1)[columns],
+                                  expected)
+    assert not process(df, distributions, seed=2)[columns].equals(expected)
@@ -0,0 +1,27 @@
+import json
+
+from wijklabels.progress import Progress, format_prometheus, write_metrics
+
+
+def test_progress(tmp_path):
+    progress = Progress(total=10, jobs=2, path_metrics=tmp_path / "metrics.json")
+    results = [[{"vbo": 1}, {"vbo": 2}], None, [{"vbo": 3}]]
+    assert list(progress.track(results)) == results
+    metrics = progress.report()
+    assert metrics["panden_done"] == 2
+    assert metrics["panden_failed"] == 1
+    assert metrics["vbo_done"] == 3
+    assert metrics["failure_rate"] == 1 / 3
+    assert metrics["eta_seconds"] > 0
+    assert json.loads((tmp_path / "metrics.json").read_text())["vbo_done"] == 3
+
+
+def test_write_metrics_prometheus(tmp_path):
+    path = tmp_path / "wijklabels.prom"
+    write_metrics({"panden_done": 5, "eta_seconds": None, "failure_rate": 0.5}, path)
+    text = path.read_text()
+    assert text == format_prometheus({"panden_done": 5, "failure_rate": 0.5})
+    assert "wijklabels_process_panden_done_total 5\n" in text
+    assert "# TYPE wijklabels_process_failure_rate gauge\n" in text
+    assert "eta" not in text
+    assert list(tmp_path.iterdir()) == [path]
@@ -0,0 +1,20 @@
+import pandas as pd
+
+from wijklabels import AggregateUnit
+from wijklabels.labels import EnergyLabel
+from wijklabels.report import plot_comparison, plot_aggregate
+
+
+def test_plot_comparison(tmp_path):
+    df = pd.DataFrame({
+        "buurtcode": ["BU01", "BU01", "BU02"],
+        "energylabel": [EnergyLabel.A, EnergyLabel.C, EnergyLabel.B],
+        "energylabel_ep_online": [EnergyLabel.B, EnergyLabel.C, EnergyLabel.E],
+    })
+    df["energylabel_dist_est_ep"] = [ep.distance(est) for est, ep in
+                                     zip(df["energylabel"], df["energylabel_ep_online"])]
+    plot_comparison(df, tmp_path, AggregateUnit.BUURT)
+    plot_aggregate(df, tmp_path, AggregateUnit.BUURT)
+    assert sorted(p.name for p in tmp_path.glob("*.png")) == [
+        "buurt_BU01.png", "buurt_BU01_dist_est_ep.png", "buurt_BU01_estimated.png",
+        "buurt_BU02.png", "buurt_BU02_dist_est_ep.png", "buurt_BU02_estimated.png"]
@@ -0,0 +1,42 @@
+import numpy as np
+
+from wijklabels.schedule import BatchScheduler, pand_cost, INITIAL_BATCH_COST
+
+
+def batches(scheduler: BatchScheduler) -> list:
+    result = []
+    while (batch := scheduler.next_batch()) is not None:
+        result.append(batch)
+    return result
+
+
+def test_batch_scheduler_longest_first():
+    rng = np.random.default_rng(1)
+    vbo_count = np.where(rng.random(1000) < 0.05, rng.integers(2, 200, 1000), 1)
+    pand_identificatie = np.arange(1000)
+    scheduler = BatchScheduler(pand_identificatie, pand_cost(vbo_count), jobs=4)
+    result = batches(scheduler)
+    dispatched = np.concatenate([b.pand_identificatie for b in result])
+    # Each Pand is dispatched once, from the most to the least expensive
+    assert sorted(dispatched.tolist()) == pand_identificatie.tolist()
+    assert (np.diff(vbo_count[dispatched]) <= 0).all()
+    assert sum(b.cost for b in result) == pand_cost(vbo_count).sum()
+    assert len(scheduler) == 0
+    # A Pand that is more expensive than a batch is a batch on its own
+    assert len(result[0].pand_identificatie) == 1
+    assert all(b.cost <= INITIAL_BATCH_COST or len(b.pand_identificatie) == 1
+               for b in result)
+
+
+def test_batch_scheduler_adapts():
+    scheduler = BatchScheduler(np.arange(10_000), pand_cost(np.ones(10_000)), jobs=2,
+                               target_seconds=1.0)
+    first = scheduler.next_batch()
+    assert first.cost == INITIAL_BATCH_COST
+    # The workers process 100 cost units per second
+    scheduler.observe(first.cost, first.cost / 100)
+    assert scheduler.next_batch().cost == 100
+    # The batches shrink at the end of the run
+    result = batches(scheduler)
+    assert result[-1].cost < 100
+    assert result[-1].cost <= result[-2].cost
@@ -0,0 +1,147 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from wijklabels import shards
+from wijklabels.labels import EnergyLabel
+from wijklabels.shards import split_ranges
+
+
+def test_split_ranges():
+    keys = np.arange(10)
+    ranges = split_ranges(keys, np.ones(10), 4)
+    assert ranges == [(0, 3, 4), (4, 7, 4), (8, 9, 2)]
+    assert split_ranges(keys[:0], np.ones(0), 4) == []
+
+
+def test_split_ranges_large_key():
+    keys = np.array(["BU00010000", "BU00010001", "BU00010002", "BU00010003"],
+                    dtype=object)
+    ranges = split_ranges(keys, np.array([3, 10, 1, 2]), 4)
+    # A buurt is never split over two shards
+    assert ranges == [(0, 1, 13), (2, 3, 3)]
+    assert sum(nr_pand for _, _, nr_pand in ranges) == 16
+
+
+class FakeShardQueue:
+    """The shard queue in memory, with the transitions of the SQL of ShardQueue."""
+
+    def __init__(self, nr_shards: int, lease: float = 60, max_attempts: int = 3):
+        self.connection_string = None
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.worker = "worker-1"
+        self.shards = {i: {"shard_id": i, "run_id": "run", "shard_by": "pand",
+                           "first_key": str(i), "last_key": str(i), "nr_pand": 2,
+                           "status": "queued", "worker": None, "attempts": 0,
+                           "expired": False, "error": None}
+                       for i in range(nr_shards)}
+
+    def claim(self):
+        for shard in self.shards.values():
+            claimable = shard["status"] == "queued" or (
+                    shard["status"] == "claimed" and shard["expired"])
+            if claimable and shard["attempts"] < self.max_attempts:
+                shard.update(status="claimed", worker=self.worker, expired=False,
+                             attempts=shard["attempts"] + 1)
+                return dict(shard)
+        return None
+
+    def _held(self, shard_id):
+        shard = self.shards[shard_id]
+        return shard["status"] == "claimed" and shard["worker"] == self.worker
+
+    def renew(self, shard_id):
+        return self._held(shard_id)
+
+    def complete(self, shard_id, output, nr_done, nr_failed):
+        if not self._held(shard_id):
+            return False
+        self.shards[shard_id].update(status="done", nr_done=nr_done, error=None)
+        return True
+
+    def release(self, shard_id, error):
+        if self._held(shard_id):
+            self.shards[shard_id].update(status="queued", worker=None, error=error)
+
+    def in_progress(self):
+        return any(s["status"] == "claimed" and not s["expired"]
+                   for s in self.shards.values())
+
+
+def fake_labels(pand_identificatie):
+    index = pd.MultiIndex.from_product([pand_identificatie, [1, 2]],
+                                       names=["pand_identificatie", "vbo_identificatie"])
+    return pd.DataFrame({"landcode": "NL", "energylabel": EnergyLabel.B,
+                         "vormfactor": 1.0}, index=index)
+
+
+@pytest.fixture
+def fake_database(monkeypatch):
+    """Process the shards without the database."""
+    monkeypatch.setattr(shards, "shard_panden", lambda connection_string, table, shard: (
+        np.array([int(shard["first_key"]) * 10, int(shard["first_key"]) * 10 + 1]),
+        np.array([2, 2])))
+    monkeypatch.setattr(shards, "process_panden", lambda connection_string, table,
+                        pand_identificatie, *args, **kwargs: fake_labels(
+        pand_identificatie))
+
+
+def test_work(tmp_path, fake_database):
+    queue = FakeShardQueue(3)
+    assert shards.work(queue, "input", tmp_path, None, None, 1, 1) == 3
+    assert all(s["status"] == "done" and s["nr_done"] == 2
+               for s in queue.shards.values())
+    assert len(list(tmp_path.glob("labels_individual-run-*.csv"))) == 3
+    assert len(list(tmp_path.joinpath("summaries", "run").glob("counts-*"))) == 3
+
+
+def test_work_lost_lease(tmp_path, fake_database, monkeypatch):
+    queue = FakeShardQueue(1, lease=0.03)
+
+    def taken_over(connection_string, table, pand_identificatie, *args, **kwargs):
+        # The lease expired and another worker claimed the shard
+        queue.shards[0]["worker"] = "worker-2"
+        time.sleep(0.1)
+        return fake_labels(pand_identificatie)
+
+    monkeypatch.setattr(shards, "process_panden", taken_over)
+    monkeypatch.setattr(queue, "in_progress", lambda: False)
+    assert shards.work(queue, "input", tmp_path, None, None, 1, 1) == 0
+    assert queue.shards[0]["status"] == "claimed"
+    assert queue.shards[0]["worker"] == "worker-2"
+
+
+def test_work_release_max_attempts(tmp_path, fake_database, monkeypatch):
+    queue = FakeShardQueue(2, max_attempts=2)
+
+    def fail_first_shard(connection_string, table, pand_identificatie, *args,
+                         **kwargs):
+        if pand_identificatie[0] == 0:
+            raise RuntimeError("worker failed")
+        return fake_labels(pand_identificatie)
+
+    monkeypatch.setattr(shards, "process_panden", fail_first_shard)
+    # The loop ends when the failing shard was attempted max_attempts times
+    assert shards.work(queue, "input", tmp_path, None, None, 1, 1) == 1
+    failed = queue.shards[0]
+    assert failed["status"] == "queued"
+    assert failed["worker"] is None
+    assert failed["attempts"] == 2
+    assert "worker failed" in failed["error"]
+    assert queue.shards[1]["status"] == "done"
+
+
+def test_work_takes_over_expired_shard(tmp_path, fake_database, monkeypatch):
+    queue = FakeShardQueue(1)
+    # The shard of a lost worker, whose lease expired
+    queue.shards[0].update(status="claimed", worker="lost-worker", attempts=1,
+                           expired=True)
+    sleeps = []
+    monkeypatch.setattr(shards, "sleep", sleeps.append)
+    assert shards.work(queue, "input", tmp_path, None, None, 1, 1) == 1
+    assert queue.shards[0]["status"] == "done"
+    assert queue.shards[0]["attempts"] == 2
+    assert sleeps == []
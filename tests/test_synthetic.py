@@ -0,0 +1,39 @@
+from wijklabels import LabelEstimationMethod
+from wijklabels.identificatie import PREFIX_VBO
+from wijklabels.labels import parse_energylabel_ditributions, reshape_for_classification
+from wijklabels.process import process_pand
+from wijklabels.synthetic import COLUMNS, generate_input, write_input
+
+
+def test_generate_input():
+    df = generate_input(1000, seed=3)
+    assert list(df.columns) == COLUMNS
+    assert df["pand_identificatie"].nunique() == 1000
+    assert df["vbo_identificatie"].is_unique
+    assert df["vbo_identificatie"].str.removeprefix(PREFIX_VBO).str.len().eq(16).all()
+    vbo_count = df.groupby("pand_identificatie")["vbo_count"].agg(["first", "size"])
+    assert (vbo_count["first"] == vbo_count["size"]).all()
+    assert (vbo_count["first"] > 1).any()
+    assert generate_input(1000, seed=3).equals(df)
+
+
+def test_write_input(tmp_path):
+    df = generate_input(10)
+    write_input(df, tmp_path / "input.parquet")
+    write_input(df, tmp_path / "input.csv")
+    assert (tmp_path / "input.parquet").exists()
+    assert (tmp_path / "input.csv").read_text().startswith(",".join(COLUMNS))
+
+
+def test_process_pand_synthetic(excelloader):
+    distributions = reshape_for_classification(
+        parse_energylabel_ditributions(excelloader))
+    df = generate_input(20).drop(columns=["geometrie"]).set_index(
+        ["pand_identificatie", "vbo_identificatie"])
+    labels = []
+    for _, pand_df in df.groupby(level="pand_identificatie"):
+        pand_df = pand_df.copy()
+        process_pand(pand_df, distributions, LabelEstimationMethod.DISTRIBUTION)
+        labels.append(pand_df)
+    # The subset of the distributions does not cover all woningtypen and bouwperioden
+    assert sum(pand_df["energylabel"].notna().sum() for pand_df in labels) > 0
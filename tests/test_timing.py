@@ -0,0 +1,26 @@
+from wijklabels.timing import StageTimer, TimingOptions, read_records, write_summary
+
+
+def test_stage_timer(tmp_path):
+    timer = StageTimer(TimingOptions(directory=tmp_path))
+    for i in range(10):
+        timer.start(f"NL.IMBAG.Pand.050310000000000{i}")
+        with timer.stage("get_pand"):
+            pass
+        with timer.stage("estimate_labels"):
+            sum(range(1000 * i))
+        timer.finish(rows=i + 1, failed=i == 3)
+
+    records = read_records(tmp_path)
+    assert len(records) == 10
+    assert (records["total"] >= records["get_pand"] + records["estimate_labels"]).all()
+
+    summary = write_summary(tmp_path, ["get_pand", "calculate_vormfactor",
+                                       "estimate_labels"])
+    assert tmp_path.joinpath("timing_summary.json").exists()
+    assert summary["panden"] == 10
+    assert summary["rows"] == 55
+    assert summary["failed"] == 1
+    assert list(summary["stages"]) == ["get_pand", "estimate_labels", "total"]
+    assert summary["stages"]["total"]["p50"] <= summary["stages"]["total"]["max"]
+    assert summary["slowest"][0]["pand_identificatie"].startswith("NL.IMBAG.Pand.")
@@ -0,0 +1,28 @@
+import pytest
+
+geopandas = pytest.importorskip("geopandas")
+from shapely.geometry import Point, box
+
+from wijklabels.aggregate import read_unit_mapping
+from wijklabels.units import write_unit_mapping
+
+
+def test_write_unit_mapping(tmp_path):
+    p_vbo = tmp_path / "verblijfsobjecten.gpkg"
+    geopandas.GeoDataFrame({
+        "identificatie": ["0503010000000001", "0503010000000002", "0503010000000003"],
+        "geometry": [Point(0.5, 0.5), Point(1.5, 0.5), Point(5, 5)],
+    }, crs="EPSG:28992").to_file(p_vbo, driver="GPKG")
+    p_units = tmp_path / "pc4.gpkg"
+    geopandas.GeoDataFrame({
+        "postcode": [2611, 2612],
+        "geometry": [box(0, 0, 1, 1), box(1, 0, 2, 1)],
+    }, crs="EPSG:28992").to_file(p_units, driver="GPKG")
+    p_out = tmp_path / "pc4.parquet"
+
+    assert write_unit_mapping(p_vbo, p_units, p_out, unit_code_col="postcode")
+    mapping = read_unit_mapping(p_out)
+    assert list(mapping["vbo_identificatie"]) == [503010000000001, 503010000000002]
+    assert list(mapping["unit_code"]) == ["2611", "2612"]
+    # The mapping is not rebuilt when the inputs did not change
+    assert not write_unit_mapping(p_vbo, p_units, p_out, unit_code_col="postcode")
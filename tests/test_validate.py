@@ -0,0 +1,55 @@
+import pandas as pd
+
+from wijklabels.labels import parse_energylabel_ditributions, \
+    reshape_for_classification, EnergyLabel
+from wijklabels.validate import ep_online_label_in_distributions, label_distance, \
+    confusion_counts, calculate_accuracy, confusion_matrix
+from wijklabels.woningtype import Bouwperiode
+
+
+def test_label_distance():
+    df = pd.DataFrame({"energylabel_ep_online": [EnergyLabel.A, EnergyLabel.D],
+                       "energylabel": [EnergyLabel.D, EnergyLabel.D]})
+    distance = label_distance(df, "energylabel_ep_online", "energylabel")
+    assert list(distance) == [-3, 0]
+
+
+def test_ep_online_label_in_distributions(excelloader):
+    distributions = reshape_for_classification(
+        parse_energylabel_ditributions(excelloader))
+    possible = distributions.loc[distributions["probability"].notna()].iloc[0]
+    impossible = distributions.loc[distributions["probability"].isna()].iloc[0]
+    (wt, bp, vf) = possible.name
+    (wt_i, bp_i, vf_i) = impossible.name
+    df = pd.DataFrame({
+        "woningtype_pre_nta8800": [wt, wt_i, wt],
+        "bouwperiode": [bp, bp_i, bp],
+        "vormfactorclass": [vf, vf_i, pd.NA],
+        "energylabel_ep_online": [possible["energylabel"], impossible["energylabel"],
+                                  possible["energylabel"]],
+    })
+    result = ep_online_label_in_distributions(df, distributions)
+    assert list(result) == [True, False, False]
+
+
+def test_confusion_counts():
+    df = pd.DataFrame({
+        "woningtype": ["vrijstaand", "vrijstaand", "appartement - hoekvloer",
+                       "appartement - tussenvloer"],
+        "bouwperiode": [Bouwperiode.FROM_1965_UNTIL_1974] * 4,
+        "ep_online_label_in_distributions": [True, True, False, True],
+        "energylabel": [EnergyLabel.B, EnergyLabel.C, EnergyLabel.A, EnergyLabel.D],
+        "energylabel_ep_online": [EnergyLabel.B, EnergyLabel.A, EnergyLabel.A,
+                                  EnergyLabel.C],
+    })
+    counts = confusion_counts(df)
+    assert counts.sum() == 4
+    assert calculate_accuracy(counts, within=0) == 0.5
+    assert calculate_accuracy(counts, within=1) == 0.75
+    assert calculate_accuracy(counts, within=0, woningtype="eengezins") == 0.5
+    assert calculate_accuracy(counts, within=0, woningtype="meergezins") == 0.5
+    assert calculate_accuracy(counts, within=0, only_possible_labels=True) == 1 / 3
+    matrix = confusion_matrix(counts)
+    assert matrix.shape == (11, 11)
+    assert matrix.loc[EnergyLabel.A, EnergyLabel.C] == 1
+    assert matrix.loc[EnergyLabel.B, EnergyLabel.B] == 1
@@ -8,6 +8,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from wijklabels.load import EPLoader
+from wijklabels.identificatie import encode_index
 from wijklabels.woningtype import Bouwperiode, WoningtypePreNTA8800
 
 parser = argparse.ArgumentParser(prog='wijklabels-analyse-ep-online')
@@ -60,6 +61,7 @@ if __name__ == '__main__':
                 columns=["pand_identificatie", "vbo_identificatie", "oorspronkelijkbouwjaar", "woningtype"],
                 index=columns_index
             )
+            encode_index(bag_df)
 
     joined_df = ep_online_df.join(
         bag_df,
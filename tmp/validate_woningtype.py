@@ -4,6 +4,7 @@ import pandas as pd
 from matplotlib import pyplot as plt
 
 from wijklabels.load import EPLoader
+from wijklabels.identificatie import encode_index
 from wijklabels.woningtype import Woningtype
 
 
@@ -49,6 +50,7 @@ if __name__ == '__main__':
         Path(args.path_labels).resolve(),
         index_col=["pand_identificatie", "vbo_identificatie"],
         converters={"woningtype": to_woningtype})
+    encode_index(woningtypen_df)
     ep_df = EPLoader(Path(args.path_ep).resolve()).load()
     joined_df = woningtypen_df.join(ep_df, how="inner", rsuffix="_ep")
 